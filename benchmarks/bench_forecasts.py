@@ -0,0 +1,96 @@
+""" Benchmark forecast XML parsing against the recorded products
+
+    python benchmarks/bench_forecasts.py
+
+    Compares the streaming parser with the original ElementTree/XPath
+    parser, which is kept here as the reference implementation.
+"""
+
+import os
+import sys
+import timeit
+from pathlib import Path
+from xml.etree import ElementTree
+
+import pytz
+from dateutil.parser import parse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.forecasts import ForecastPeriod, parse_product, select_area
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures"
+PRODUCTS = ["IDQ10095", "IDQ10170", "IDQ11295"]
+
+
+def get_value(element, metric):
+    """ Original lookup, which compiles and runs the XPath twice """
+    if element.findall(f"*[@type='{metric}']"):
+        return element.findall(f"*[@type='{metric}']")[0].text
+    return None
+
+
+def reference_parse(xml, description=None):
+    """ Original Forecast.parse_forecast_data, for one location """
+    tree = ElementTree.fromstring(xml)
+    locations = tree.find("forecast").findall("area[@type='location']")
+    location = locations[0]
+    if description and description != location.attrib["description"]:
+        for loc in locations:
+            if loc.attrib["description"] == description:
+                location = loc
+    metros = tree.find("forecast").findall("area[@type='metropolitan']")
+    metro_periods = metros[0].findall("forecast-period") if metros else []
+
+    forecasts = []
+    for i, fp in enumerate(location.findall("forecast-period")):
+        text = get_value(fp, "forecast")
+        if not text and metro_periods:
+            fp2 = metro_periods[i]
+            if fp.attrib["index"] == fp2.attrib["index"]:
+                text = get_value(fp2, "forecast")
+        forecasts.append(
+            ForecastPeriod(
+                parse(fp.attrib["start-time-utc"]).replace(tzinfo=pytz.UTC),
+                parse(fp.attrib["end-time-utc"]).replace(tzinfo=pytz.UTC),
+                get_value(fp, "forecast_icon_code"),
+                text,
+                get_value(fp, "air_temperature_maximum"),
+                get_value(fp, "air_temperature_minimum"),
+                get_value(fp, "precis"),
+                get_value(fp, "probability_of_precipitation"),
+                get_value(fp, "precipitation_range"),
+            )
+        )
+    return forecasts
+
+
+def best_of(func, number):
+    """ Fastest time per call in milliseconds """
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    print(f"{'product':10} {'areas':>5} {'one (ms)':>20} {'all areas (ms)':>24}")
+    for product in PRODUCTS:
+        xml = (FIXTURES / f"{product}.xml").read_text()
+        parsed = parse_product(xml)
+        descriptions = [area.description for area in parsed.areas]
+
+        # Results must match before timings mean anything
+        for desc in descriptions:
+            expected = select_area(parsed.areas, desc).forecasts
+            assert reference_parse(xml, desc) == expected
+
+        old_one = best_of(lambda: reference_parse(xml), 20)
+        new_one = best_of(lambda: parse_product(xml), 20)
+        old_all = best_of(lambda: [reference_parse(xml, d) for d in descriptions], 2)
+        new_all = new_one  # One parse returns every area
+        print(
+            f"{product:10} {len(descriptions):5} "
+            f"{old_one:7.2f} -> {new_one:6.2f} ({old_one / new_one:4.1f}x) "
+            f"{old_all:9.2f} -> {new_all:6.2f} ({old_all / new_all:5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+""" Memory used to keep observation histories for many stations
+
+    python benchmarks/bench_memory.py [stations]
+
+    Loads the recorded feed once per station, as if each had been downloaded,
+    and measures the memory retained by each representation with tracemalloc.
+"""
+
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import pytz
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.observations import Observation, ObservationHistory
+
+FEED = Path(__file__).parent.parent / "tests" / "fixtures" / "IDQ60801.94576.json"
+
+
+def reference_observation(obs: dict) -> Observation:
+    """ Original ObservationSite.get_observation, for one record """
+    for k, v in obs.items():
+        if v == "-":
+            obs[k] = None
+    local_dt = datetime.strptime(obs["local_date_time_full"], "%Y%m%d%H%M%S")
+    utc_dt = datetime.strptime(obs["aifstime_utc"], "%Y%m%d%H%M%S")
+    if obs["vis_km"]:
+        obs["vis_km"] = float(obs["vis_km"])
+    if obs["rain_trace"]:
+        obs["rain_trace"] = float(obs["rain_trace"])
+    values = {f: obs[f] for f in Observation._fields if f in obs}
+    values.update(local_dt=local_dt, utc_dt=utc_dt.replace(tzinfo=pytz.UTC))
+    return Observation(**values)
+
+
+def feed_records(text: str) -> list:
+    return json.loads(text)["observations"]["data"]
+
+
+def measure(build, text: str, stations: int) -> int:
+    """ Bytes retained after building one history per station """
+    tracemalloc.start()
+    kept = [build(feed_records(text)) for _ in range(stations)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def main():
+    stations = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    text = FEED.read_text()
+    rows = len(feed_records(text)) * stations
+    cases = [
+        ("feed dicts", lambda records: records),
+        ("Observation list", lambda recs: [reference_observation(r) for r in recs]),
+        ("ObservationHistory", ObservationHistory),
+    ]
+    print(f"{stations} stations, {rows} records")
+    print(f"{'representation':20} {'MB':>8} {'bytes/row':>10}")
+    for name, build in cases:
+        used = measure(build, text, stations)
+        print(f"{name:20} {used / 1e6:8.1f} {used / rows:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+""" Offline benchmark suite against recorded BOM data
+
+    python benchmarks/bench_suite.py            # Compare with baselines.json
+    python benchmarks/bench_suite.py --update   # Store new baselines
+
+    Every case runs against the packaged station files and the recorded
+    feeds in tests/fixtures, with network access disabled. The result of
+    each case is hashed and must match the stored baseline exactly.
+    Timings are compared with the stored baseline and reported as a
+    regression when slower than the allowed tolerance. Timings depend on
+    the machine, so store new baselines before comparing on another one.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures"
+BASELINES = Path(__file__).parent / "baselines.json"
+FEED = FIXTURES / "IDQ60801.94576.json"
+PRODUCTS = ["IDQ10095", "IDQ10170", "IDQ11295"]  # Metro, district and state wide
+FIELDS = ["air_temp", "rain_trace"]
+POINTS = [
+    (-27.47, 153.03),  # Brisbane
+    (-33.87, 151.21),  # Sydney
+    (-37.81, 144.96),  # Melbourne
+    (-12.46, 130.84),  # Darwin
+    (-31.95, 115.86),  # Perth
+    (-42.88, 147.33),  # Hobart
+    (-23.70, 133.88),  # Alice Springs
+]
+QUERIES = ["b", "brisb", "brisbane aero", "aero bris", "brisbnae", "syd", "alice"]
+
+
+class Case(NamedTuple):
+    """ Benchmark case """
+
+    name: str
+    func: Callable
+    number: int
+
+
+class RecordedResponse:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.status_code = 200
+        self.headers = {}  # type: Dict[str, str]
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class RecordedSession:
+    """ Stands in for requests, returning the recorded feed for every url """
+
+    def __init__(self, path: Path) -> None:
+        self.content = path.read_bytes()
+
+    def get(self, url, **kwargs):
+        return RecordedResponse(self.content)
+
+
+def disable_network() -> None:
+    """ Make any attempt to reach the BOM servers fail loudly """
+
+    def connect(*args, **kwargs):
+        raise RuntimeError("Benchmarks must run offline")
+
+    socket.socket.connect = connect
+    socket.create_connection = connect
+
+
+def get_cases() -> List[Case]:
+    """ Benchmark cases, importing bomweather once the cache dir is set """
+    from bomweather.forecasts import Forecast
+    from bomweather.observations import ObservationSite
+    from bomweather.station_index import clear_loaded
+    from bomweather.stations import (
+        closest_obs_station,
+        get_forecast_locations,
+        get_obs_locations,
+    )
+    from bomweather.search import search_stations
+
+    session = RecordedSession(FEED)
+    xml = {product: (FIXTURES / f"{product}.xml").read_text() for product in PRODUCTS}
+
+    def obs_locations_cold():
+        clear_loaded()
+        return get_obs_locations()
+
+    def closest_points():
+        return [closest_obs_station(lat, lon) for lat, lon in POINTS]
+
+    def search_queries():
+        return [search_stations(query) for query in QUERIES]
+
+    def site():
+        return ObservationSite(94576, "IDQ60801", session=session)
+
+    cases = [
+        Case("get_obs_locations (open index)", obs_locations_cold, 20),
+        Case("get_obs_locations", get_obs_locations, 200),
+        Case("closest_obs_station", closest_points, 50),
+        Case("get_forecast_locations", get_forecast_locations, 50),
+        Case("search_stations", search_queries, 200),
+        Case("get_observation", lambda: site().get_observation(0), 50),
+        Case("ObservationSite.history", lambda: list(site().history()), 50),
+        Case("get_observation fields", lambda: site().get_observation(0, FIELDS), 50),
+    ]
+    for product in PRODUCTS:
+        cases.append(
+            Case(
+                f"parse_forecast_data {product}",
+                lambda p=product: Forecast(p, xml=xml[p]).forecasts,
+                20,
+            )
+        )
+    return cases
+
+
+def digest(result) -> str:
+    """ Stable hash of a benchmark result """
+    if isinstance(result, dict):
+        result = sorted(result.items())
+    text = json.dumps(result, default=str, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def best_of(func: Callable, number: int, repeat: int = 5) -> float:
+    """ Fastest time per call in milliseconds """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def run_cases(cases: List[Case], timed: bool = True) -> Dict[str, dict]:
+    """ Run each case, returning the result digest and time per call """
+    results = {}
+    for case in cases:
+        result = {"result": digest(case.func())}
+        if timed:
+            result["ms"] = round(best_of(case.func, case.number), 4)
+        results[case.name] = result
+    return results
+
+
+def compare(
+    results: Dict[str, dict], baselines: Dict[str, dict], tolerance: float
+) -> List[str]:
+    """ Describe each result that differs from or is slower than its baseline """
+    problems = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if base is None:
+            problems.append(f"{name}: no baseline")
+            continue
+        if result["result"] != base["result"]:
+            problems.append(f"{name}: result changed")
+        if "ms" in result and result["ms"] > base["ms"] * tolerance:
+            problems.append(
+                f"{name}: {result['ms']:.3f} ms is slower than "
+                f"{base['ms']:.3f} ms x {tolerance}"
+            )
+    return problems
+
+
+def load_baselines(path: Path = BASELINES) -> Dict[str, dict]:
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1].strip())
+    parser.add_argument("--update", action="store_true", help="store new baselines")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="slowdown allowed before reporting a regression (default 1.5)",
+    )
+    args = parser.parse_args()
+
+    disable_network()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["BOMWEATHER_CACHE"] = cache_dir
+        results = run_cases(get_cases())
+
+    baselines = {} if args.update else load_baselines()
+    print(f"{'case':36} {'ms':>10} {'baseline':>10}")
+    for name, result in results.items():
+        base = baselines.get(name, {}).get("ms", float("nan"))
+        print(f"{name:36} {result['ms']:10.3f} {base:10.3f}")
+
+    if args.update:
+        with open(BASELINES, "w") as fp:
+            json.dump(results, fp, indent=4)
+            fp.write("\n")
+        print(f"Stored baselines in {BASELINES}")
+        return 0
+
+    problems = compare(results, baselines, args.tolerance)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+""" Throughput of concurrent fetching against a local stand-in server
+
+    python benchmarks/bench_transport.py [stations] [latency]
+
+    Serves the recorded Brisbane feed as many stations and the recorded
+    forecast products from a StandInServer on this machine, with latency
+    seconds of delay per response, then times the fetcher and the
+    forecast export at several levels of concurrency.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.export import CSVWriter, FORECAST_FIELDS, export_forecasts
+from bomweather.fetch import ObservationFetcher
+from bomweather.forecasts import FORECAST_FOLDER
+from bomweather.ftp import FTPPool
+from bomweather.standin import StandInServer
+from bomweather.transport import set_transport
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures"
+PRODUCTS = ["IDQ10095", "IDQ10170", "IDQ11295"]
+CONCURRENCY = [1, 8, 32, 64]
+
+
+class Discard:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_root(root: Path, stations: int) -> list:
+    """ Recordings for stations copies of the feed, return their sites """
+    folder = root / "http" / "fwo" / "IDQ60801"
+    folder.mkdir(parents=True)
+    sites = [(90000 + i, "IDQ60801") for i in range(stations)]
+    for wmo, product in sites:
+        feed = folder / f"{product}.{wmo}.json"
+        shutil.copy(str(FIXTURES / "IDQ60801.94576.json"), str(feed))
+    products = root / "ftp" / FORECAST_FOLDER
+    products.mkdir(parents=True)
+    for product in PRODUCTS:
+        shutil.copy(str(FIXTURES / f"{product}.xml"), str(products))
+    return sites
+
+
+def report(workload: str, workers: int, count: int, seconds: float) -> None:
+    print(f"{workload:24} {workers:8} {seconds:8.2f} {count / seconds:8.0f}")
+
+
+def main():
+    stations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    with tempfile.TemporaryDirectory() as tmp:
+        sites = make_root(Path(tmp), stations)
+        with StandInServer(tmp, latency=latency) as server:
+            previous = set_transport(server.transport())
+            try:
+                print(f"{stations} stations, {latency * 1000:.0f}ms latency")
+                print(f"{'workload':24} {'workers':>8} {'seconds':>8} {'per sec':>8}")
+                for workers in CONCURRENCY:
+                    start = time.perf_counter()
+                    with ObservationFetcher(concurrency=workers) as fetcher:
+                        count = sum(1 for _ in fetcher.iter_observations(sites))
+                    seconds = time.perf_counter() - start
+                    report("observation feeds", workers, count, seconds)
+                for workers in (1, 4):
+                    products = PRODUCTS * 10
+                    start = time.perf_counter()
+                    with FTPPool(FORECAST_FOLDER, size=workers) as pool:
+                        writer = CSVWriter(Discard(), FORECAST_FIELDS)
+                        export_forecasts(products, writer, pool)
+                    seconds = time.perf_counter() - start
+                    report("forecast products", workers, len(products), seconds)
+            finally:
+                set_transport(previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,58 @@
 
 
 import logging
+from importlib import import_module
 from logging import NullHandler
-from bomweather.stations import get_obs_locations
-from bomweather.stations import closest_obs_station
-from bomweather.stations import get_forecast_locations
-from bomweather.stations import closest_forecast_location
-from bomweather.observations import ObservationSite, Observation
-from bomweather.forecasts import Forecast, ForecastPeriod
-
-__all__ = [
-    "get_obs_locations",
-    "closest_obs_station",
-    "get_forecast_locations",
-    "closest_forecast_location",
-    "ObservationSite",
-    "Observation",
-    "Forecast",
-    "ForecastPeriod",
-]
+
+# Public names and the module they live in. Modules are only imported when a
+# name is first used, so callers that only need station lookups never load
+# requests, dateutil, pytz, ftplib or xml.etree.
+_LAZY = {
+    "get_obs_locations": "bomweather.stations",
+    "closest_obs_station": "bomweather.stations",
+    "closest_obs_stations": "bomweather.stations",
+    "k_nearest_obs_stations": "bomweather.stations",
+    "obs_stations_within": "bomweather.stations",
+    "get_forecast_locations": "bomweather.stations",
+    "closest_forecast_location": "bomweather.stations",
+    "closest_forecast_locations": "bomweather.stations",
+    "search_stations": "bomweather.search",
+    "ObservationSite": "bomweather.observations",
+    "Observation": "bomweather.observations",
+    "Forecast": "bomweather.forecasts",
+    "ForecastPeriod": "bomweather.forecasts",
+    "ForecastCache": "bomweather.forecasts",
+    "ObservationArchive": "bomweather.archive",
+    "ObservationCache": "bomweather.cache",
+    "ResilientObservations": "bomweather.resilience",
+    "ResilientForecasts": "bomweather.resilience",
+    "SourcePolicy": "bomweather.resilience",
+    "FTPPool": "bomweather.ftp",
+    "Transport": "bomweather.transport",
+    "set_transport": "bomweather.transport",
+    "ObservationFetcher": "bomweather.fetch",
+    "fetch_observations": "bomweather.fetch",
+    "get_observations": "bomweather.fetch",
+    "ObservationScheduler": "bomweather.scheduler",
+    "IDWInterpolator": "bomweather.interpolate",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(import_module(module), name)
+    globals()[name] = value  # Only look it up once
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
 
 # Set default logging handler to avoid "No handler found" warnings.
 logging.getLogger(__name__).addHandler(NullHandler())
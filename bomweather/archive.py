@@ -0,0 +1,191 @@
+""" bomweather.archive
+
+    Local SQLite archive of observations
+
+    Station feeds only cover the last three days, so records are kept in a
+    table keyed by (wmo, aifstime_utc). Feeds can be ingested as often as
+    needed, rows that are already stored are skipped.
+
+"""
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+from bomweather.cache import get_cache_dir
+from bomweather.observations import (
+    EPOCH,
+    FLOAT_FIELDS,
+    STR_FIELDS,
+    UTC_EPOCH,
+    Observation,
+    ObservationHistory,
+    record_type,
+)
+
+ARCHIVE_FILENAME = "observations.sqlite"
+
+# Observation fields and the column each is stored in
+COLUMNS = {"wmo": "wmo", "local_dt": "local_ts", "utc_dt": "utc_ts"}
+COLUMNS.update({f: f for f in FLOAT_FIELDS + STR_FIELDS})
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    wmo INTEGER NOT NULL,
+    utc_ts INTEGER NOT NULL,
+    local_ts INTEGER NOT NULL,
+    {floats},
+    {strings},
+    PRIMARY KEY (wmo, utc_ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS observations_utc ON observations (utc_ts);
+""".format(
+    floats=",\n    ".join(f"{f} REAL" for f in FLOAT_FIELDS),
+    strings=",\n    ".join(f"{f} TEXT" for f in STR_FIELDS),
+)
+
+Time = Union[datetime, int, float]
+
+
+def to_seconds(value: Time) -> int:
+    """ Seconds since 1970 UTC, naive datetimes are treated as UTC """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+def _decode(field: str, value):
+    if value is None:
+        return None
+    if field == "utc_dt":
+        return UTC_EPOCH + timedelta(seconds=value)
+    if field == "local_dt":
+        return EPOCH + timedelta(seconds=value)
+    return value
+
+
+class ObservationArchive:
+    """ Observations from many stations stored in SQLite """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None) -> None:
+        """ Open or create archive
+        :param path: Database file, defaults to observations.sqlite in the cache dir
+        """
+        self.path = Path(path) if path else get_cache_dir() / ARCHIVE_FILENAME
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"<ObservationArchive {self.path}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def ingest(self, history: ObservationHistory) -> int:
+        """ Store the records of a feed that are not already in the archive
+
+        :param history: Parsed station feed, eg from ObservationSite.history()
+        :return: number of new rows
+        """
+        if history.fields != Observation._fields:
+            raise ValueError("Only histories with every field can be archived")
+        columns = [history.wmo, history.utc_ts, history.local_ts]
+        columns += [history.columns[f] for f in FLOAT_FIELDS]
+        codes = [history.columns[f] for f in STR_FIELDS]
+        strings = history.strings
+        nfloats = len(FLOAT_FIELDS)
+
+        def rows():
+            for i in range(len(history)):
+                row = [col[i] for col in columns]
+                for j in range(3, 3 + nfloats):
+                    if row[j] != row[j]:  # NaN is stored as NULL
+                        row[j] = None
+                row.extend(strings[col[i]] for col in codes)
+                yield row
+
+        names = ["wmo", "utc_ts", "local_ts"] + FLOAT_FIELDS + STR_FIELDS
+        sql = "INSERT OR IGNORE INTO observations ({}) VALUES ({})".format(
+            ", ".join(names), ", ".join("?" * len(names))
+        )
+        before = self._conn.total_changes
+        with self._conn:
+            self._conn.executemany(sql, rows())
+        return self._conn.total_changes - before
+
+    def ingest_records(self, records: Iterable[dict]) -> int:
+        """ Store records from the "data" list of a station json feed """
+        return self.ingest(ObservationHistory(list(records)))
+
+    def _select(self, fields: Optional[Sequence[str]], where: str, params: tuple):
+        if fields is None:
+            fields = Observation._fields
+        unknown = [f for f in fields if f not in COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown observation fields {unknown}")
+        fields = tuple(fields)
+        record = record_type(fields)
+        sql = "SELECT {} FROM observations WHERE {}".format(
+            ", ".join(COLUMNS[f] for f in fields), where
+        )
+        cursor = self._conn.execute(sql, params)
+        return (record(*(_decode(f, v) for f, v in zip(fields, row))) for row in cursor)
+
+    def query(
+        self,
+        wmo: int,
+        start: Optional[Time] = None,
+        end: Optional[Time] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Iterator:
+        """ Records for one station, oldest first
+
+        Rows are read from the database as they are iterated over.
+
+        :param wmo: World Meteorological Organisation (WMO) ID
+        :param start: Earliest UTC time to include
+        :param end: Latest UTC time to include
+        :param fields: Observation fields to return, defaults to all of them
+        :return: Observation records, or named tuples of the requested fields
+        """
+        low = to_seconds(start) if start is not None else -(2 ** 63)
+        high = to_seconds(end) if end is not None else 2 ** 63 - 1
+        return self._select(
+            fields,
+            "wmo = ? AND utc_ts BETWEEN ? AND ? ORDER BY utc_ts",
+            (int(wmo), low, high),
+        )
+
+    def at(self, when: Time, fields: Optional[Sequence[str]] = None) -> Iterator:
+        """ Records from every station at one UTC time, ordered by WMO ID
+
+        :param when: Observation time
+        :param fields: Observation fields to return, defaults to all of them
+        """
+        return self._select(fields, "utc_ts = ? ORDER BY wmo", (to_seconds(when),))
+
+    def count(self, wmo: Optional[int] = None) -> int:
+        """ Number of stored records, for one station or all of them """
+        if wmo is None:
+            cursor = self._conn.execute("SELECT COUNT(*) FROM observations")
+        else:
+            cursor = self._conn.execute(
+                "SELECT COUNT(*) FROM observations WHERE wmo = ?", (int(wmo),)
+            )
+        return cursor.fetchone()[0]
+
+    def stations(self) -> list:
+        """ WMO IDs with stored records """
+        sql = "SELECT DISTINCT wmo FROM observations ORDER BY wmo"
+        return [wmo for wmo, in self._conn.execute(sql)]
@@ -0,0 +1,231 @@
+""" bomweather.cache
+
+    Local cache locations for derived data,
+    and a cache for observation feeds downloaded from the BOM website
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from bomweather import metrics
+from bomweather.jsondecode import response_json
+from bomweather.transport import get_transport
+
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_INTERVAL = 30 * 60  # Most stations report every half hour
+ENTRY_NAME = re.compile(r"[0-9a-f]{40}\.json")  # sha1 of the feed URL
+
+
+def get_cache_dir() -> Path:
+    """ Get the directory used for locally generated cache files
+
+        Uses the BOMWEATHER_CACHE environment variable if set,
+        otherwise ~/.cache/bomweather
+    """
+    path = os.environ.get("BOMWEATHER_CACHE")
+    if path:
+        cache_dir = Path(path)
+    else:
+        cache_dir = Path.home() / ".cache" / "bomweather"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+class CacheEntry(NamedTuple):
+    """ Cached observation feed """
+
+    data: dict
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires: float
+
+
+def latest_feed_time(data: dict) -> Tuple[Optional[datetime], float]:
+    """ Get the latest observation time and report interval (seconds) of a feed """
+    records = data.get("observations", {}).get("data", [])
+    times = []
+    for rec in records[:2]:
+        try:
+            times.append(datetime.strptime(rec["aifstime_utc"], "%Y%m%d%H%M%S"))
+        except (KeyError, TypeError, ValueError):
+            break
+    if not times:
+        return None, DEFAULT_INTERVAL
+    interval = DEFAULT_INTERVAL
+    if len(times) == 2 and times[0] > times[1]:
+        interval = (times[0] - times[1]).total_seconds()
+    return times[0].replace(tzinfo=timezone.utc), interval
+
+
+class ObservationCache:
+    """ LRU cache of observation feeds with conditional revalidation
+
+        Entries expire when the station's next observation is due, based on
+        the latest aifstime_utc plus the gap between the last two reports.
+        Expired entries are revalidated with If-None-Match/If-Modified-Since
+        so unchanged feeds are not downloaded again.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        directory: Optional[Path] = None,
+        min_ttl: float = 60,
+        max_ttl: float = 3600,
+        grace: float = 60,
+        session: Optional["requests.Session"] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """ Create cache
+        :param maxsize: Maximum number of feeds held in memory
+        :param directory: Also keep feeds on disk in this directory
+        :param min_ttl: Shortest time (s) before revalidating a feed
+        :param max_ttl: Longest time (s) before revalidating a feed
+        :param grace: Time (s) allowed after the due time for BOM to publish
+        :param session: requests session used for downloads
+        """
+        self.maxsize = maxsize
+        self.directory = Path(directory) if directory else None
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.grace = grace
+        transport = get_transport()
+        if session is None:
+            self.session = transport.session()
+        else:
+            self.session = transport.wrap_session(session)
+        self.clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict[str, CacheEntry]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def __repr__(self):
+        return f"<ObservationCache {len(self._entries)} feeds>"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ Counters for cache hits, misses and revalidations """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "size": len(self._entries),
+        }
+
+    def ttl(self, data: dict) -> float:
+        """ Seconds until a new observation may be published """
+        latest, interval = latest_feed_time(data)
+        if latest is None:
+            return self.min_ttl
+        due = latest.timestamp() + interval + self.grace
+        return min(self.max_ttl, max(self.min_ttl, due - self.clock()))
+
+    def get(self, url: str, timeout: float = 10) -> dict:
+        """ Get decoded json for a feed, downloading only when needed """
+        entry = self._lookup(url)
+        if entry and entry.expires > self.clock():
+            self._count("hits")
+            return entry.data
+
+        headers = {}
+        if entry:
+            self._count("revalidations")
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        else:
+            self._count("misses")
+
+        with metrics.timed("http.fetch", url) as t:
+            r = self.session.get(url, headers=headers, timeout=timeout)
+            if metrics.enabled():
+                t.nbytes = len(r.content)
+        if entry and r.status_code == 304:
+            self._count("not_modified")
+            data = entry.data
+            etag = r.headers.get("ETag", entry.etag)
+            last_modified = r.headers.get("Last-Modified", entry.last_modified)
+        else:
+            r.raise_for_status()
+            with metrics.timed("json.parse", url):
+                data = response_json(r)
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+        expires = self.clock() + self.ttl(data)
+        self._store(url, CacheEntry(data, etag, last_modified, expires))
+        return data
+
+    def fresh(self, url: str) -> bool:
+        """ Is a feed cached that get() would return without a request """
+        entry = self._lookup(url)
+        return entry is not None and entry.expires > self.clock()
+
+    def clear(self) -> None:
+        """ Remove all feeds from memory and disk """
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for path in self.directory.glob("*.json"):
+                if ENTRY_NAME.fullmatch(path.name):
+                    path.unlink()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _path(self, url: str) -> Path:
+        return self.directory / (hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def _lookup(self, url: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+                return entry
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(url), "r") as fp:
+                entry = CacheEntry(**json.load(fp))
+        except (OSError, ValueError, TypeError):
+            return None
+        self._remember(url, entry)
+        return entry
+
+    def _store(self, url: str, entry: CacheEntry) -> None:
+        self._remember(url, entry)
+        if self.directory:
+            fd, tmp = tempfile.mkstemp(dir=str(self.directory), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as fp:
+                    json.dump(entry._asdict(), fp)
+                os.replace(tmp, str(self._path(url)))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def _remember(self, url: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
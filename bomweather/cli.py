@@ -0,0 +1,131 @@
+""" bomweather.cli
+
+    Command line interface
+
+        bomweather export observations --state QLD --format csv -o qld.csv
+        bomweather export forecasts --product IDQ10095,IDQ10170
+
+"""
+
+import argparse
+import logging
+import sys
+from typing import List, Optional
+
+from bomweather.export import (
+    FORECAST_FIELDS,
+    FORMATS,
+    export_forecasts,
+    export_observations,
+    open_writer,
+    select_products,
+    select_sites,
+)
+from bomweather.observations import Observation, record_type
+
+
+def _split(values: Optional[List[str]]) -> List[str]:
+    """ Allow both repeated options and comma separated lists """
+    return [v for value in values or () for v in value.split(",") if v]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="bomweather", description="Bureau of Meteorology weather data"
+    )
+    commands = parser.add_subparsers(dest="command")
+    export = commands.add_parser(
+        "export", help="Stream observations or forecasts for many stations to a file"
+    )
+    export.add_argument("kind", choices=("observations", "forecasts"))
+    export.add_argument("--state", action="append", help="States, eg QLD,NSW")
+    export.add_argument("--wmo", action="append", help="Observation station WMO IDs")
+    export.add_argument("--product", action="append", help="Forecast product IDs")
+    export.add_argument(
+        "--fields", help="Comma separated observation fields, defaults to all"
+    )
+    export.add_argument(
+        "--latest",
+        action="store_true",
+        help="Only the latest observation of each station, not the last three days",
+    )
+    export.add_argument("--format", choices=FORMATS, default="ndjson")
+    export.add_argument(
+        "-o", "--output", help="Output file, defaults to stdout (not for parquet)"
+    )
+    export.add_argument(
+        "--workers", type=int, default=16, help="Downloads in flight at once"
+    )
+    standin = commands.add_parser(
+        "standin", help="Serve recorded BOM files over local HTTP and FTP"
+    )
+    standin.add_argument("root", help="Folder with http/ and ftp/ recordings")
+    standin.add_argument(
+        "--latency", type=float, default=0.0, help="Delay (s) before each response"
+    )
+    standin.add_argument("--host", default="127.0.0.1")
+    standin.add_argument("--http-port", type=int, default=8080)
+    standin.add_argument("--ftp-port", type=int, default=2121)
+    return parser
+
+
+def standin(args: argparse.Namespace) -> int:
+    from bomweather.standin import StandInServer
+
+    server = StandInServer(
+        args.root, args.latency, args.host, args.http_port, args.ftp_port
+    )
+    print(
+        f"BOMWEATHER_HTTP_BASE={server.http_base} "
+        f"BOMWEATHER_FTP_HOST={server.ftp_host}",
+        file=sys.stderr,
+    )
+    server.serve_forever()
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    states = _split(args.state)
+    if args.kind == "observations":
+        if args.product:
+            raise ValueError("--product only applies to forecasts")
+        fields = _split([args.fields]) if args.fields else list(Observation._fields)
+        record_type(tuple(fields))  # Check the fields before creating the output
+        wmos = _split(args.wmo)
+        sites = select_sites(states, wmos)
+        unknown = set(wmos) - {str(wmo) for wmo, _ in sites}
+        if unknown:
+            print(f"Unknown WMO IDs: {','.join(sorted(unknown))}", file=sys.stderr)
+        writer = open_writer(args.format, args.output, fields)
+        stats = export_observations(
+            sites, writer, fields, latest=args.latest, workers=args.workers
+        )
+    else:
+        for option in ("wmo", "fields", "latest"):
+            if getattr(args, option):
+                raise ValueError(f"--{option} only applies to observations")
+        products = select_products(states, _split(args.product))
+        writer = open_writer(args.format, args.output, FORECAST_FIELDS)
+        # BOM limits anonymous FTP connections, so use fewer than for HTTP
+        stats = export_forecasts(products, writer, workers=min(args.workers, 4))
+
+    print(stats.summary(), file=sys.stderr)
+    for source, error in stats.failures:
+        print(f"  {source}: {error}", file=sys.stderr)
+    return 1 if stats.failures and not stats.rows else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    logging.basicConfig(level=logging.ERROR)
+    if args.command == "standin":
+        return standin(args)
+    try:
+        return export(args)
+    except ValueError as e:
+        parser.error(str(e))
+        return 2
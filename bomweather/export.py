@@ -0,0 +1,329 @@
+""" bomweather.export
+
+    Stream observations and forecasts for many stations to a file
+
+    Feeds are downloaded by a pool of workers and each one is written out as
+    soon as it arrives, so only the feeds in flight are held in memory no
+    matter how many stations are exported. Rows can be written as NDJSON, CSV
+    or Parquet (requires pyarrow).
+
+"""
+
+import csv
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from bomweather.fetch import ObservationFetcher, iter_bounded
+from bomweather.forecasts import FORECAST_FOLDER, ForecastPeriod, parse_product
+from bomweather.ftp import FTPPool
+from bomweather.observations import FLOAT_FIELDS, Observation, record_type
+from bomweather.stations import get_forecast_locations, get_obs_locations
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv", "parquet")
+FORECAST_FIELDS = ("product", "aac", "description", "issue_time") + tuple(
+    ForecastPeriod._fields
+)
+TIME_FIELDS = frozenset(["local_dt", "utc_dt", "start", "end"])
+
+
+class ExportStats(NamedTuple):
+    """ Totals for a finished export """
+
+    rows: int
+    sources: int
+    failures: List[Tuple[str, Exception]]
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.rows} rows from {self.sources} sources in {self.seconds:.1f}s "
+            f"({self.rows_per_second:.0f} rows/s), {len(self.failures)} failed"
+        )
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class NDJSONWriter:
+    """ One JSON object per line """
+
+    def __init__(
+        self, fp: IO[str], fields: Sequence[str], close_fp: bool = False
+    ) -> None:
+        """ Create writer
+        :param fp: Text file to write to
+        :param fields: Field names of each row
+        :param close_fp: Close fp when the writer is closed, not just flush it
+        """
+        self.fp = fp
+        self.fields = fields
+        self.close_fp = close_fp
+
+    def write(self, rows: Iterable[Sequence]) -> None:
+        fields = self.fields
+        lines = [
+            json.dumps({f: _text(v) for f, v in zip(fields, row)}) + "\n"
+            for row in rows
+        ]
+        self.fp.writelines(lines)
+
+    def close(self) -> None:
+        if self.close_fp:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+
+class CSVWriter:
+    """ Comma separated values with a header row """
+
+    def __init__(
+        self, fp: IO[str], fields: Sequence[str], close_fp: bool = False
+    ) -> None:
+        """ Create writer, see NDJSONWriter """
+        self.fp = fp
+        self.close_fp = close_fp
+        self._writer = csv.writer(fp)
+        self._writer.writerow(fields)
+
+    def write(self, rows: Iterable[Sequence]) -> None:
+        self._writer.writerows([_text(v) for v in row] for row in rows)
+
+    def close(self) -> None:
+        if self.close_fp:
+            self.fp.close()
+        else:
+            self.fp.flush()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required for Parquet export, "
+            "install with: pip install bomweather[parquet]"
+        ) from None
+    return pyarrow
+
+
+class ParquetWriter:
+    """ Parquet file written one row group per batch of rows """
+
+    def __init__(self, path: str, fields: Sequence[str], batch_size: int = 10000):
+        pa = _import_pyarrow()
+        self._pa = pa
+        self.fields = fields
+        self.batch_size = batch_size
+        self.schema = pa.schema([(f, self._type(f)) for f in fields])
+        self._writer = pa.parquet.ParquetWriter(path, self.schema)
+        self._rows = []  # type: List[Sequence]
+
+    def _type(self, field: str):
+        pa = self._pa
+        if field == "wmo":
+            return pa.int64()
+        if field == "local_dt":
+            return pa.timestamp("s")
+        if field in TIME_FIELDS:
+            return pa.timestamp("s", tz="UTC")
+        if field in FLOAT_FIELDS:
+            return pa.float64()
+        return pa.string()
+
+    def write(self, rows: Iterable[Sequence]) -> None:
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._rows:
+            return
+        columns = [list(col) for col in zip(*self._rows)]
+        table = self._pa.Table.from_arrays(
+            [self._pa.array(col, type=t) for col, t in zip(columns, self.schema.types)],
+            schema=self.schema,
+        )
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(fmt: str, output: Optional[str], fields: Sequence[str], stdout=None):
+    """ Create a writer for a format, writing to stdout if there is no output
+
+        A file opened for output is closed with the writer.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, expected one of {FORMATS}")
+    if fmt == "parquet":
+        if not output or output == "-":
+            raise ValueError("Parquet export needs an output file")
+        return ParquetWriter(output, fields)
+    to_file = bool(output) and output != "-"
+    if to_file:
+        fp = open(output, "w", newline="", encoding="utf-8")
+    else:
+        fp = stdout or sys.stdout
+    if fmt == "csv":
+        return CSVWriter(fp, fields, close_fp=to_file)
+    return NDJSONWriter(fp, fields, close_fp=to_file)
+
+
+def select_sites(
+    states: Sequence[str] = (), wmos: Sequence[str] = ()
+) -> List[Tuple[int, str]]:
+    """ (wmo, product) of the observation stations in states or wmos,
+        or every station if neither is given
+    """
+    states = {s.upper() for s in states}
+    wmos = {str(w) for w in wmos}
+    sites = []
+    for wmo, station in get_obs_locations().items():
+        wanted = station.state.upper() in states or wmo in wmos
+        if (states or wmos) and not wanted:
+            continue
+        sites.append((int(wmo), station.obs_product))
+    return sites
+
+
+def select_products(
+    states: Sequence[str] = (), products: Sequence[str] = ()
+) -> List[str]:
+    """ Forecast product IDs in states or products, or every product """
+    states = {s.upper() for s in states}
+    selected = list(products)
+    if states or not products:
+        for product, location in get_forecast_locations().items():
+            if product in selected:
+                continue
+            if not states or location.state.upper() in states:
+                selected.append(product)
+    return selected
+
+
+def _column(history, field: str, count: int) -> list:
+    values = history.column(field)[:count]
+    if field in FLOAT_FIELDS:
+        return [None if v != v else v for v in values]  # NaN is missing
+    return values
+
+
+def export_observations(
+    sites: Iterable[Tuple[int, str]],
+    writer,
+    fields: Optional[Sequence[str]] = None,
+    latest: bool = False,
+    fetcher: Optional[ObservationFetcher] = None,
+    workers: int = 16,
+) -> ExportStats:
+    """ Write observations for each station as its feed arrives
+
+    :param sites: (wmo, product) for each station
+    :param writer: Writer created for fields
+    :param fields: Observation fields to write, defaults to all of them
+    :param latest: Only write the latest observation of each station
+    :param fetcher: ObservationFetcher to download with
+    :param workers: Number of downloads in flight when no fetcher is given
+    """
+    fields = tuple(fields or Observation._fields)
+    try:
+        record_type(fields)  # Check the fields before downloading anything
+    except ValueError:
+        writer.close()
+        raise
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = ObservationFetcher(workers)
+    start = time.perf_counter()
+    rows = sources = 0
+    try:
+        for history in fetcher.iter_histories(sites, fields):
+            sources += 1
+            count = min(1, len(history)) if latest else len(history)
+            columns = [_column(history, f, count) for f in fields]
+            writer.write([col[i] for col in columns] for i in range(count))
+            rows += count
+    finally:
+        writer.close()
+        if own_fetcher:
+            fetcher.close()
+    failures = [(f"{product}.{wmo}", e) for wmo, product, e in fetcher.failures]
+    return ExportStats(rows, sources, failures, time.perf_counter() - start)
+
+
+def iter_forecast_rows(product: str, data: bytes) -> Iterator[tuple]:
+    """ One row per forecast period of each location in a product """
+    parsed = parse_product(data)
+    for area in parsed.areas:
+        head = (product, area.aac, area.description, parsed.issue_time)
+        for period in area.forecasts:
+            yield head + tuple(period)
+
+
+def export_forecasts(
+    products: Iterable[str],
+    writer,
+    pool: Optional[FTPPool] = None,
+    workers: int = 4,
+) -> ExportStats:
+    """ Write every forecast period of each product as it arrives
+
+    :param products: BOM Forecast Product IDs
+    :param writer: Writer created for FORECAST_FIELDS
+    :param pool: FTPPool to download with
+    :param workers: Number of FTP connections when no pool is given
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = FTPPool(FORECAST_FOLDER, size=workers)
+    failures = []  # type: List[Tuple[str, Exception]]
+
+    def download(product):
+        try:
+            return product, pool.retrieve(f"{product}.xml")
+        except Exception as e:  # Any failure should not stop the other products
+            log.warning("Unable to fetch forecast %s: %s", product, e)
+            failures.append((product, e))
+            return product, None
+
+    start = time.perf_counter()
+    rows = sources = 0
+    try:
+        with ThreadPoolExecutor(pool.size) as executor:
+            items = ((product,) for product in products)
+            for product, data in iter_bounded(executor, download, items, 2 * pool.size):
+                if data is None:
+                    continue
+                try:
+                    batch = list(iter_forecast_rows(product, data))
+                except Exception as e:
+                    log.warning("Unable to parse forecast %s: %s", product, e)
+                    failures.append((product, e))
+                    continue
+                writer.write(batch)
+                rows += len(batch)
+                sources += 1
+    finally:
+        writer.close()
+        if own_pool:
+            pool.close()
+    return ExportStats(rows, sources, failures, time.perf_counter() - start)
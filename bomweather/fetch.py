@@ -0,0 +1,214 @@
+""" bomweather.fetch
+
+    Fetch observations for many stations concurrently
+
+"""
+
+import asyncio
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+from typing import Sequence, TypeVar
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from bomweather.cache import ObservationCache
+from bomweather.observations import Observation, ObservationHistory, ObservationSite
+from bomweather.transport import get_transport
+
+log = logging.getLogger(__name__)
+
+Site = Tuple[int, str]  # (wmo, product)
+T = TypeVar("T")
+
+
+def iter_bounded(
+    pool: ThreadPoolExecutor, func: Callable[..., T], items: Iterable, limit: int
+) -> Iterator[T]:
+    """ Yield func(*item) for each item in the order they complete
+
+        At most limit calls are submitted at once, so results do not build up
+        when there are many items.
+    """
+    pending = set()
+    for item in items:
+        if len(pending) >= limit:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(pool.submit(func, *item))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def pooled_session(
+    concurrency: int = 32, retries: int = 2, backoff: float = 0.5
+) -> requests.Session:
+    """ Create a requests session with keep-alive connections for many workers
+
+    :param concurrency: Number of connections to keep open per host
+    :param retries: Retries for connection errors and 5xx responses
+    :param backoff: Retry backoff factor in seconds
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=concurrency, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return get_transport().wrap_session(session)
+
+
+class ObservationFetcher:
+    """ Download observations for many stations with bounded concurrency
+
+        Stations that fail after retries are skipped and recorded in failures.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 32,
+        timeout: float = 10,
+        retries: int = 2,
+        cache: Optional[ObservationCache] = None,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        """ Create fetcher
+        :param concurrency: Maximum number of requests in flight
+        :param timeout: Timeout in seconds for each request
+        :param retries: Retries for each station
+        :param cache: Optional ObservationCache to use for feeds
+        :param session: Optional requests session, pooled by default
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.own_session = session is None
+        if session is None:
+            self.session = pooled_session(concurrency, retries)
+        else:
+            self.session = get_transport().wrap_session(session)
+        self.failures = []  # type: List[Tuple[int, str, Exception]]
+
+    def __repr__(self):
+        return f"<ObservationFetcher concurrency={self.concurrency}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """ Close pooled connections, unless the session was passed in """
+        if self.own_session:
+            self.session.close()
+
+    def site(self, wmo: int, product: str) -> ObservationSite:
+        """ Observation site sharing this fetcher's connections """
+        return ObservationSite(
+            wmo, product, cache=self.cache, session=self.session, timeout=self.timeout
+        )
+
+    def fetch(self, wmo: int, product: str) -> Optional[Observation]:
+        """ Get the latest observation for one station, or None if it failed """
+        try:
+            return self.site(wmo, product).last_observation()
+        except Exception as e:  # Any failure should not stop the other stations
+            log.warning("Unable to fetch observations for %s.%s: %s", product, wmo, e)
+            self.failures.append((wmo, product, e))
+            return None
+
+    def fetch_history(
+        self, wmo: int, product: str, fields: Optional[Sequence[str]] = None
+    ) -> Optional[ObservationHistory]:
+        """ Get all records for one station, or None if it failed
+        :param fields: Only convert these Observation fields
+        """
+        try:
+            return self.site(wmo, product).history(fields)
+        except Exception as e:  # Any failure should not stop the other stations
+            log.warning("Unable to fetch observations for %s.%s: %s", product, wmo, e)
+            self.failures.append((wmo, product, e))
+            return None
+
+    def iter_observations(self, sites: Iterable[Site]) -> Iterator[Observation]:
+        """ Yield latest observations in the order they complete """
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for obs in iter_bounded(pool, self.fetch, sites, 2 * self.concurrency):
+                if obs is not None:
+                    yield obs
+
+    def iter_histories(
+        self, sites: Iterable[Site], fields: Optional[Sequence[str]] = None
+    ) -> Iterator[ObservationHistory]:
+        """ Yield the full history of each station in the order they complete
+        :param fields: Only convert these Observation fields
+        """
+        fetch = partial(self.fetch_history, fields=fields)
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            limit = 2 * self.concurrency
+            for history in iter_bounded(pool, fetch, sites, limit):
+                if history is not None:
+                    yield history
+
+    async def observations(self, sites: Iterable[Site]) -> AsyncIterator[Observation]:
+        """ Async version of iter_observations """
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(self.concurrency)
+        items = iter(sites)
+        pending = set()  # type: set
+        try:
+            while True:
+                for wmo, product in islice(items, 2 * self.concurrency - len(pending)):
+                    pending.add(loop.run_in_executor(pool, self.fetch, wmo, product))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    obs = future.result()
+                    if obs is not None:
+                        yield obs
+        finally:
+            # Closed early: drop queued requests without blocking the event loop
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+
+async def fetch_observations(
+    sites: Iterable[Site], concurrency: int = 32, **kwargs
+) -> AsyncIterator[Observation]:
+    """ Yield the latest observation for each station as it arrives
+
+    :param sites: (wmo, product) for each station
+    :param concurrency: Maximum number of requests in flight
+    """
+    with ObservationFetcher(concurrency, **kwargs) as fetcher:
+        async for obs in fetcher.observations(sites):
+            yield obs
+
+
+def get_observations(
+    sites: Iterable[Site], concurrency: int = 32, **kwargs
+) -> List[Observation]:
+    """ Get the latest observation for each station, for non-async callers
+
+    :param sites: (wmo, product) for each station
+    :param concurrency: Maximum number of requests in flight
+    """
+    with ObservationFetcher(concurrency, **kwargs) as fetcher:
+        return list(fetcher.iter_observations(sites))
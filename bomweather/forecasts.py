@@ -1,12 +1,18 @@
-import ftplib
 import io
+import threading
 from typing import NamedTuple
-from typing import Optional
+from typing import Optional, Iterable, Iterator, Dict, List, Tuple, Union, IO
+from collections.abc import Mapping
 from datetime import datetime
 import pytz
 from xml.etree import ElementTree
 from dateutil.parser import parse
 
+from bomweather import metrics
+from bomweather.ftp import FTPPool
+
+FORECAST_FOLDER = "anon/gen/fwo"
+
 # https://github.com/home-assistant/home-assistant/pull/17351/files
 
 
@@ -24,6 +30,131 @@ class ForecastPeriod(NamedTuple):
     precis_range: str
 
 
+class ForecastArea(NamedTuple):
+    """ Forecast periods for one location in a product """
+
+    aac: str
+    description: str
+    forecasts: List[ForecastPeriod]
+
+
+class ForecastProduct(NamedTuple):
+    """ Parsed forecast product """
+
+    product: str
+    issue_time: str
+    areas: List[ForecastArea]
+
+
+def parse_utc(value: str) -> datetime:
+    """ Parse ISO formatted UTC times such as 2019-02-02T06:37:00Z """
+    try:
+        dt = datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        dt = parse(value)
+    return dt.replace(tzinfo=pytz.UTC)
+
+
+def parse_product(source: Union[str, bytes, IO[bytes]]) -> ForecastProduct:
+    """ Parse every location area in a forecast product
+
+        The XML is streamed and each forecast-period is read once into a
+        map of type attribute to text, then cleared, so the element tree
+        is never built for large state wide products.
+
+        Locations without their own forecast text use the text of their parent
+        metropolitan area, or the first metropolitan area if they have no parent.
+
+    :param source: Product XML, or a binary file object to read it from
+    :return: product ID, issue time and location areas in document order
+    """
+    nbytes = None
+    if isinstance(source, str):
+        source = source.encode()
+    if isinstance(source, bytes):
+        nbytes = len(source)
+        source = io.BytesIO(source)
+
+    with metrics.timed("xml.parse") as t:
+        parsed = _parse_product(source)
+        t.nbytes = nbytes
+        t.detail = parsed.product
+    return parsed
+
+
+def _parse_product(source: IO[bytes]) -> ForecastProduct:
+    product = ""
+    issue_time = ""
+    metros = {}  # type: Dict[str, Dict[str, Optional[str]]]
+    locations = []  # type: List[Tuple[Dict[str, str], List[tuple]]]
+    periods = []  # type: List[tuple]
+
+    for _, elem in ElementTree.iterparse(source):
+        tag = elem.tag
+        if tag == "forecast-period":
+            values = {}  # type: Dict[str, Optional[str]]
+            for child in elem:
+                values.setdefault(child.get("type"), child.text)
+            periods.append((dict(elem.attrib), values))
+            elem.clear()
+        elif tag == "area":
+            area_type = elem.get("type")
+            if area_type == "location":
+                locations.append((dict(elem.attrib), periods))
+            elif area_type == "metropolitan":
+                metros[elem.get("aac")] = {
+                    attrib["index"]: values.get("forecast")
+                    for attrib, values in periods
+                }
+            periods = []
+            elem.clear()
+        elif tag == "identifier":
+            product = elem.text
+        elif tag == "issue-time-local":
+            issue_time = elem.text
+
+    # Every area repeats the same few period times
+    times = {}  # type: Dict[str, datetime]
+    default_metro = next(iter(metros.values()), {})
+    areas = []
+    for attrib, location_periods in locations:
+        metro_text = metros.get(attrib.get("parent-aac"), default_metro)
+        forecasts = []
+        for fp, values in location_periods:
+            start = fp["start-time-utc"]
+            end = fp["end-time-utc"]
+            for value in (start, end):
+                if value not in times:
+                    times[value] = parse_utc(value)
+            forecast_text = values.get("forecast")
+            if not forecast_text:
+                # Get forecast from the metroplitan forecast
+                forecast_text = metro_text.get(fp["index"])
+            forecasts.append(
+                ForecastPeriod(
+                    times[start],
+                    times[end],
+                    values.get("forecast_icon_code"),
+                    forecast_text,
+                    values.get("air_temperature_maximum"),
+                    values.get("air_temperature_minimum"),
+                    values.get("precis"),
+                    values.get("probability_of_precipitation"),
+                    values.get("precipitation_range"),
+                )
+            )
+        areas.append(ForecastArea(attrib["aac"], attrib["description"], forecasts))
+    return ForecastProduct(product, issue_time, areas)
+
+
+def select_area(areas: List[ForecastArea], description: Optional[str]) -> ForecastArea:
+    """ Get the area matching description, or the first area """
+    for area in areas:
+        if area.description == description:
+            return area
+    return areas[0]
+
+
 class Forecast:
     """ BOM Weather Forecast
 
@@ -35,101 +166,275 @@ class Forecast:
 
     """
 
-    def __init__(self, product: str, description: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        product: str,
+        description: Optional[str] = None,
+        xml: Optional[str] = None,
+        lazy: bool = False,
+        pool: Optional[FTPPool] = None,
+        cache: Optional["ForecastCache"] = None,
+    ) -> None:
         """ Returns weather observations
         :param product: BOM Forecast Product ID
+        :param description: Location within the product, defaults to the first
+        :param xml: Product XML that has already been downloaded
+        :param lazy: Wait until the forecast is first used to download it
+        :param pool: FTPPool to download with instead of a new connection
+        :param cache: ForecastCache to skip downloads of unchanged products
         """
         self.product = product
-        self.desc = description
+        self.pool = pool
+        self.cache = cache
+        self._desc = description
+        self.changed = False  # Did the last load get a new issue of the forecast
 
-        self.issue_time = None
-        self.aac = None
-        self.forecasts = list()
-        xml = self.get_forecast_data()
-        self.parse_forecast_data(xml)
+        self._issue_time = None
+        self._aac = None
+        self._forecasts = list()  # type: List[ForecastPeriod]
+        self.loaded = False
+        if xml is not None:
+            self.parse_forecast_data(xml)
+        elif not lazy:
+            self.load()
+
+    @classmethod
+    def from_xml(
+        cls, xml: str, product: Optional[str] = None, description: Optional[str] = None
+    ) -> "Forecast":
+        """ Create forecast from product XML without downloading anything """
+        parsed = parse_product(xml)
+        forecast = cls(product or parsed.product, description, lazy=True)
+        forecast._set_area(parsed.issue_time, select_area(parsed.areas, description))
+        return forecast
+
+    @classmethod
+    def fetch_many(
+        cls, products: Iterable[str], pool: Optional[FTPPool] = None
+    ) -> Dict[str, "Forecast"]:
+        """ Download several forecast products over the same FTP connection
+
+        :param products: BOM Forecast Product IDs
+        :param pool: FTPPool to use, otherwise a single connection is opened
+        """
+        own_pool = pool is None
+        if own_pool:
+            pool = FTPPool(FORECAST_FOLDER, size=1)
+        try:
+            return {product: cls(product, pool=pool) for product in products}
+        finally:
+            if own_pool:
+                pool.close()
 
     def __repr__(self):
         return f"<Forecast {self.product} {self.desc} - Issued {self.issue_time}>"
 
+    def load(self) -> None:
+        """ Download and parse the forecast """
+        if self.cache is not None:
+            parsed, _ = self.cache.get(self.product)
+            self._set_area(parsed.issue_time, select_area(parsed.areas, self._desc))
+            return
+        xml = self.get_forecast_data()
+        self.parse_forecast_data(xml)
+
+    def refresh(self) -> bool:
+        """ Load the forecast again, return True if a new issue was published
+
+            With a ForecastCache, nothing is downloaded unless the remote
+            file has changed.
+        """
+        self.load()
+        return self.changed
+
+    def _ensure_loaded(self) -> None:
+        if not self.loaded:
+            self.load()
+
+    @property
+    def desc(self) -> Optional[str]:
+        self._ensure_loaded()
+        return self._desc
+
+    @property
+    def issue_time(self) -> Optional[str]:
+        self._ensure_loaded()
+        return self._issue_time
+
+    @property
+    def aac(self) -> Optional[str]:
+        self._ensure_loaded()
+        return self._aac
+
+    @property
+    def forecasts(self) -> List[ForecastPeriod]:
+        self._ensure_loaded()
+        return self._forecasts
+
     def get_forecast_data(self):
         """ Download latest forecast from FTP server """
-        host = "ftp.bom.gov.au"
-        folder = "anon/gen/fwo"
         filename = f"{self.product}.xml"
+        if self.pool is not None:
+            return self.pool.retrieve(filename).decode()
 
-        xml: str = ""
-        with io.BytesIO() as fp:
-            with ftplib.FTP(host) as ftp:
-                ftp.login()
-                ftp.cwd(folder)
-                ftp.retrbinary(f"RETR {filename}", fp.write)
-                fp.seek(0)  # Return to start of file
-                xml = fp.read().decode()
-        return xml
+        with FTPPool(FORECAST_FOLDER, size=1) as pool:
+            return pool.retrieve(filename).decode()
 
     def parse_forecast_data(self, xml):
         """ Process the XML data """
-        tree = ElementTree.fromstring(xml)
-        amoc = tree.find("amoc")
-        self.issue_time = amoc.find("issue-time-local").text
-
-        # Get forecast area element
-        locations = tree.find("forecast").findall("area[@type='location']")
-        location = locations[0]
-        if self.desc and self.desc != location.attrib["description"]:
-            for loc in locations:
-                if loc.attrib["description"] == self.desc:
-                    location = loc
-
-        self.aac = location.attrib["aac"]
-        self.desc = location.attrib["description"]
-        forecast_periods = location.findall("forecast-period")
-
-        # See if there is a higer area element
-        metros = tree.find("forecast").findall("area[@type='metropolitan']")
-        try:
-            metro = metros[0]
-            metro_forecast_periods = metro.findall("forecast-period")
-        except IndexError:
-            metro = None
-
-        for i, fp in enumerate(forecast_periods):
-            forecast_index = fp.attrib["index"]
-            start = parse(fp.attrib["start-time-utc"])
-            start = start.replace(tzinfo=pytz.UTC)
-            end = parse(fp.attrib["end-time-utc"])
-            end = end.replace(tzinfo=pytz.UTC)
-
-            forecast_icon = self.get_forecast_value(fp, "forecast_icon_code")
-            temp_min = self.get_forecast_value(fp, "air_temperature_minimum")
-            temp_max = self.get_forecast_value(fp, "air_temperature_maximum")
-            forecast_text = self.get_forecast_value(fp, "forecast")
-            if not forecast_text and metro:
-                # Get forecast from the metroplitan forecast
-                fp2 = metro_forecast_periods[i]
-                if forecast_index == fp2.attrib["index"]:
-                    forecast_text = self.get_forecast_value(fp2, "forecast")
-            precis = self.get_forecast_value(fp, "precis")
-            precis_prob = self.get_forecast_value(fp, "probability_of_precipitation")
-            precis_range = self.get_forecast_value(fp, "precipitation_range")
-
-            forecast = ForecastPeriod(
-                start,
-                end,
-                forecast_icon,
-                forecast_text,
-                temp_max,
-                temp_min,
-                precis,
-                precis_prob,
-                precis_range,
-            )
-            self.forecasts.append(forecast)
+        parsed = parse_product(xml)
+        self._set_area(parsed.issue_time, select_area(parsed.areas, self._desc))
+
+    def _set_area(self, issue_time: str, area: "ForecastArea") -> None:
+        self.changed = not self.loaded or issue_time != self._issue_time
+        self._issue_time = issue_time
+        self._aac = area.aac
+        self._desc = area.description
+        self._forecasts = area.forecasts
+        self.loaded = True
+
+    @classmethod
+    def areas_from_xml(cls, xml: str, product: Optional[str] = None) -> "ForecastAreas":
+        """ Create forecasts for every location in a product from one parse """
+        parsed = parse_product(xml)
+        product = product or parsed.product
+        forecasts = []
+        for area in parsed.areas:
+            forecast = cls(product, area.description, lazy=True)
+            forecast._set_area(parsed.issue_time, area)
+            forecasts.append(forecast)
+        return ForecastAreas(product, parsed.issue_time, forecasts)
+
+    @classmethod
+    def fetch_areas(
+        cls, product: str, pool: Optional[FTPPool] = None
+    ) -> "ForecastAreas":
+        """ Download a product once and get forecasts for all of its locations
+
+        :param product: BOM Forecast Product ID
+        :param pool: FTPPool to download with instead of a new connection
+        """
+        xml = cls(product, lazy=True, pool=pool).get_forecast_data()
+        return cls.areas_from_xml(xml, product)
 
     @staticmethod
     def get_forecast_value(forecast_element, metric):
         """ Search for first matching result """
 
-        if forecast_element.findall(f"*[@type='{metric}']"):
-            return forecast_element.findall(f"*[@type='{metric}']")[0].text
+        element = forecast_element.find(f"*[@type='{metric}']")
+        if element is not None:
+            return element.text
         return None
+
+
+class CachedProduct(NamedTuple):
+    """ Parsed product and the remote file it came from """
+
+    info: Optional[Dict[str, object]]
+    parsed: ForecastProduct
+
+
+class ForecastCache:
+    """ Parsed forecast products, downloaded again only when they change
+
+        The modification time and size of the remote file are checked on a
+        pooled connection first, and the parsed product is reused if they
+        have not changed since the last download. A rewritten file with the
+        same issue time is not counted as a change.
+    """
+
+    def __init__(self, pool: Optional[FTPPool] = None) -> None:
+        """ Create cache
+        :param pool: FTPPool for the forecast folder, one is opened by default
+        """
+        self.pool = pool if pool is not None else FTPPool(FORECAST_FOLDER)
+        self.checks = 0
+        self.downloads = 0
+        self._products = {}  # type: Dict[str, CachedProduct]
+        self._forecasts = {}  # type: Dict[Tuple[str, Optional[str]], Forecast]
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<ForecastCache {len(self._products)} products>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def issue_time(self, product: str) -> Optional[str]:
+        """ Issue time of the cached product, if it has been downloaded """
+        entry = self._products.get(product)
+        return entry.parsed.issue_time if entry else None
+
+    def get(self, product: str) -> Tuple[ForecastProduct, bool]:
+        """ Get a parsed product, and whether it changed since the last call
+
+        :param product: BOM Forecast Product ID
+        """
+        filename = f"{product}.xml"
+        info = self.pool.info(filename)
+        entry = self._products.get(product)
+        with self._lock:
+            self.checks += 1
+        if entry is not None and info is not None and info == entry.info:
+            return entry.parsed, False
+
+        parsed = parse_product(self.pool.retrieve(filename))
+        with self._lock:
+            self.downloads += 1
+            self._products[product] = CachedProduct(info, parsed)
+        changed = entry is None or parsed.issue_time != entry.parsed.issue_time
+        return parsed, changed
+
+    def forecast(self, product: str, description: Optional[str] = None) -> Forecast:
+        """ Get a forecast, reusing the same Forecast while it is unchanged
+
+            Check forecast.changed to see if a new issue was published.
+        """
+        key = (product, description)
+        with self._lock:
+            forecast = self._forecasts.get(key)
+            if forecast is None:
+                forecast = self._forecasts[key] = Forecast(
+                    product, description, lazy=True, cache=self
+                )
+        forecast.load()
+        return forecast
+
+
+class ForecastAreas(Mapping):
+    """ Forecasts for every location in a product
+
+        Iterates over area codes (aac), and can be indexed by either
+        the area code or the location description.
+    """
+
+    def __init__(self, product: str, issue_time: str, forecasts: List[Forecast]):
+        self.product = product
+        self.issue_time = issue_time
+        self._by_aac = {f.aac: f for f in forecasts}
+        self._by_desc = {f.desc: f for f in forecasts}
+
+    def __repr__(self):
+        return f"<ForecastAreas {self.product} {len(self)} locations>"
+
+    def __getitem__(self, key: str) -> Forecast:
+        try:
+            return self._by_aac[key]
+        except KeyError:
+            return self._by_desc[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_aac)
+
+    def __len__(self) -> int:
+        return len(self._by_aac)
+
+    def descriptions(self) -> List[str]:
+        """ Location names in the product """
+        return list(self._by_desc)
@@ -0,0 +1,157 @@
+""" bomweather.ftp
+
+    Reusable connections to the BOM FTP server
+
+"""
+
+import ftplib
+import io
+import logging
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from bomweather import metrics
+from bomweather.transport import get_transport
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def remote_file_info(ftp: ftplib.FTP, filename: str) -> Dict[str, object]:
+    """ Modification time and size of a remote file """
+    mdtm = ftp.sendcmd(f"MDTM {filename}").split(maxsplit=1)[-1]
+    return {"mdtm": mdtm, "size": ftp.size(filename)}
+
+
+class FTPPool:
+    """ Small pool of logged in FTP connections to one folder
+
+        Connections are opened when first needed, reused for later
+        transfers and replaced if the server has dropped them.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        host: Optional[str] = None,
+        size: int = 2,
+        timeout: Optional[float] = 30,
+    ) -> None:
+        """ Create pool
+        :param folder: Remote folder to change to after login
+        :param host: FTP server as host or host:port, defaults to the transport's
+        :param size: Maximum number of open connections
+        :param timeout: Socket timeout in seconds
+        """
+        self.host = host or get_transport().ftp_host
+        self.folder = folder
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # type: queue.LifoQueue
+        self._slots = threading.BoundedSemaphore(size)
+        self._open: List[ftplib.FTP] = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<FTPPool {self.host}/{self.folder} {len(self._open)} open>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self) -> ftplib.FTP:
+        log.debug("Connecting to %s", self.host)
+        with metrics.timed("ftp.connect", self.host):
+            ftp = get_transport().connect_ftp(self.host, self.timeout)
+            try:
+                ftp.cwd(self.folder)
+            except BaseException:
+                ftp.close()
+                raise
+        with self._lock:
+            self._open.append(ftp)
+        return ftp
+
+    def _discard(self, ftp: ftplib.FTP) -> None:
+        with self._lock:
+            if ftp in self._open:
+                self._open.remove(ftp)
+        try:
+            ftp.close()
+        except OSError:
+            pass
+
+    def retrieve(self, filename: str) -> bytes:
+        """ Download a file from the pool folder """
+        return self._call(lambda ftp: self._retr(ftp, filename))
+
+    def info(self, filename: str) -> Optional[Dict[str, object]]:
+        """ Modification time and size of a file in the pool folder
+
+        :return: {"mdtm": ..., "size": ...}, or None if the server refused
+        """
+
+        def stat(ftp):
+            with metrics.timed("ftp.info", filename):
+                return remote_file_info(ftp, filename)
+
+        try:
+            return self._call(stat)
+        except ftplib.error_perm as e:
+            log.debug("Unable to get info for %s: %s", filename, e)
+            return None
+
+    def _call(self, func: Callable[[ftplib.FTP], T]) -> T:
+        """ Run func with a pooled connection, reconnecting once if it was dropped """
+        with self._slots:
+            try:
+                ftp = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                ftp = self._connect()
+                reused = False
+            try:
+                data = func(ftp)
+            except ftplib.error_perm:
+                self._idle.put(ftp)  # eg. missing file, connection is still fine
+                raise
+            except (EOFError, OSError, ftplib.error_temp) as e:
+                self._discard(ftp)
+                if not reused:
+                    raise
+                # Idle connections get dropped by the server, so retry once
+                log.debug("Reconnecting to %s after %s", self.host, e)
+                ftp = self._connect()
+                try:
+                    data = func(ftp)
+                except BaseException:
+                    self._discard(ftp)
+                    raise
+            except BaseException:
+                self._discard(ftp)
+                raise
+            self._idle.put(ftp)
+            return data
+
+    @staticmethod
+    def _retr(ftp: ftplib.FTP, filename: str) -> bytes:
+        with metrics.timed("ftp.retr", filename) as t, io.BytesIO() as fp:
+            ftp.retrbinary(f"RETR {filename}", fp.write)
+            t.nbytes = fp.tell()
+            return fp.getvalue()
+
+    def close(self) -> None:
+        """ Log out of all connections """
+        with self._lock:
+            connections, self._open = self._open, []
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except (EOFError, OSError, ftplib.Error):
+                ftp.close()
+        while not self._idle.empty():
+            self._idle.get_nowait()
@@ -0,0 +1,180 @@
+""" bomweather.interpolate
+
+    Estimate observations between stations (requires numpy)
+
+    Values are interpolated with inverse distance weighting (IDW) over the
+    k nearest stations that have a value. Neighbours and weights depend only
+    on where the stations and points are and which stations have values, so
+    they are cached. Evaluating the same points again each cycle is then one
+    gather and weighted sum per field.
+
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from bomweather.spatial import EARTH_RADIUS_KM, _import_numpy, _unit_vectors
+
+DEFAULT_FIELDS = ("air_temp", "rel_hum", "rain_trace")
+
+
+class IDWInterpolator:
+    """ Inverse distance weighted estimates at fixed points """
+
+    def __init__(
+        self,
+        lats: Sequence[float],
+        lons: Sequence[float],
+        k: int = 8,
+        power: float = 2.0,
+        max_distance_km: Optional[float] = None,
+        chunk_size: int = 2048,
+        cache_size: int = 8,
+    ) -> None:
+        """ Create interpolator
+        :param lats: Latitudes of the points to estimate
+        :param lons: Longitudes of the points to estimate
+        :param k: Number of nearest stations used for each point
+        :param power: Distance weighting power, higher favours closer stations
+        :param max_distance_km: Ignore stations further away than this,
+            points without any stations in range are NaN
+        :param chunk_size: Number of points to find neighbours for at a time
+        :param cache_size: Number of station layouts to keep weights for
+        """
+        np = _import_numpy()
+        self._np = np
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if lats.shape != lons.shape:
+            raise ValueError("lats and lons must be the same shape")
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        self.shape = lats.shape
+        self.k = k
+        self.power = power
+        self.max_distance_km = max_distance_km
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        lat_r = np.radians(lats.ravel())
+        self._xyz = _unit_vectors(np, lat_r, np.radians(lons.ravel()))
+        self._weights = OrderedDict()  # type: OrderedDict
+
+    def __repr__(self):
+        return f"<IDWInterpolator {len(self._xyz)} points k={self.k}>"
+
+    @classmethod
+    def grid(
+        cls,
+        south: float,
+        north: float,
+        west: float,
+        east: float,
+        step: float,
+        **kwargs,
+    ) -> "IDWInterpolator":
+        """ Interpolator for a regular lat/lon grid, results have shape (lat, lon)
+
+        :param south: Southern edge latitude
+        :param north: Northern edge latitude
+        :param west: Western edge longitude
+        :param east: Eastern edge longitude
+        :param step: Grid spacing in degrees
+        """
+        np = _import_numpy()
+        grid_lats = np.arange(south, north + step / 2, step)
+        grid_lons = np.arange(west, east + step / 2, step)
+        lats, lons = np.meshgrid(grid_lats, grid_lons, indexing="ij")
+        interpolator = cls(lats, lons, **kwargs)
+        interpolator.grid_lats = grid_lats
+        interpolator.grid_lons = grid_lons
+        return interpolator
+
+    def weights(self, station_lats, station_lons, valid) -> Tuple:
+        """ Neighbour positions and normalised weights for each point
+
+        :param station_lats: Latitudes of all stations
+        :param station_lons: Longitudes of all stations
+        :param valid: Boolean array of the stations that have a value
+        :return: (index, weights) arrays of shape (points, k)
+        """
+        np = self._np
+        st_lats = np.ascontiguousarray(station_lats, dtype=float)
+        st_lons = np.ascontiguousarray(station_lons, dtype=float)
+        valid = np.ascontiguousarray(valid, dtype=bool)
+        key = (st_lats.tobytes(), st_lons.tobytes(), valid.tobytes())
+        cached = self._weights.get(key)
+        if cached is not None:
+            self._weights.move_to_end(key)
+            return cached
+
+        candidates = np.flatnonzero(valid)
+        if not len(candidates):
+            raise ValueError("No stations have a value")
+        st_xyz = _unit_vectors(
+            np, np.radians(st_lats[candidates]), np.radians(st_lons[candidates])
+        )
+        k = min(self.k, len(candidates))
+        npoints = len(self._xyz)
+        index = np.empty((npoints, k), dtype=np.intp)
+        weights = np.empty((npoints, k))
+        for start in range(0, npoints, self.chunk_size):
+            points = self._xyz[start : start + self.chunk_size]
+            dots = points @ st_xyz.T
+            if k < len(candidates):
+                nearest = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            else:
+                nearest = np.broadcast_to(np.arange(k), (len(points), k))
+            # Chord length from the coordinates is accurate at short range
+            chord = np.linalg.norm(points[:, None, :] - st_xyz[nearest], axis=2)
+            km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+            with np.errstate(divide="ignore"):
+                w = 1 / km ** self.power
+            exact = km < 1e-6
+            on_station = exact.any(axis=1)
+            w[on_station] = exact[on_station]  # Use the station value as is
+            if self.max_distance_km is not None:
+                w[km > self.max_distance_km] = 0
+            total = w.sum(axis=1, keepdims=True)
+            with np.errstate(invalid="ignore"):
+                weights[start : start + len(points)] = w / total  # NaN if none
+            index[start : start + len(points)] = candidates[nearest]
+
+        result = (index, weights)
+        self._weights[key] = result
+        while len(self._weights) > self.cache_size:
+            self._weights.popitem(last=False)
+        return result
+
+    def evaluate(self, station_lats, station_lons, values):
+        """ Estimate a field at every point
+
+        :param station_lats: Latitudes of the stations
+        :param station_lons: Longitudes of the stations
+        :param values: Value at each station, NaN (or None) where missing
+        :return: Estimates with the shape of the points
+        """
+        np = self._np
+        values = np.asarray(values, dtype=float)
+        index, weights = self.weights(station_lats, station_lons, np.isfinite(values))
+        estimate = np.einsum("ij,ij->i", weights, values[index])
+        return estimate.reshape(self.shape)
+
+    def interpolate(
+        self, observations: Iterable, fields: Iterable[str] = DEFAULT_FIELDS
+    ) -> Dict[str, object]:
+        """ Estimate observation fields at every point
+
+        :param observations: Latest Observation from each station
+        :param fields: Observation fields to estimate
+        :return: Estimates for each field, with the shape of the points
+        """
+        np = self._np
+        observations = list(observations)
+        lats = np.array([obs.lat for obs in observations], dtype=float)
+        lons = np.array([obs.lon for obs in observations], dtype=float)
+        results = {}
+        for field in fields:
+            values = [getattr(obs, field) for obs in observations]
+            values = np.array([np.nan if v is None else v for v in values], dtype=float)
+            results[field] = self.evaluate(lats, lons, values)
+        return results
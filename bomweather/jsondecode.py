@@ -0,0 +1,38 @@
+""" bomweather.jsondecode
+
+    Decode json feeds with orjson when it is installed
+
+"""
+
+import json
+from typing import Union
+
+_orjson = False  # Not imported yet, None if it is not installed
+
+
+def get_orjson():
+    """ The orjson module, or None if it is not installed """
+    global _orjson
+    if _orjson is False:
+        try:
+            import orjson
+        except ImportError:  # Optional, pip install bomweather[orjson]
+            orjson = None
+        _orjson = orjson
+    return _orjson
+
+
+def loads(data: Union[bytes, str]):
+    """ Decode json text """
+    orjson = get_orjson()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def response_json(response):
+    """ Decode the body of a requests response """
+    orjson = get_orjson()
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
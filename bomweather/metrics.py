@@ -0,0 +1,216 @@
+""" bomweather.metrics
+
+    Timings for network, parsing and lookup phases
+
+    Nothing is measured until a hook is added. Hooks are called with an
+    Event after each phase finishes:
+
+        http.fetch      observation feed download
+        ftp.connect     FTP login and change of folder
+        ftp.retr        FTP file download
+        ftp.info        FTP modification time and size check
+        json.parse      observation feed decoding
+        xml.parse       forecast product parsing
+        index.load      station index or forecast location loading
+        index.search    nearest station and forecast location lookups
+        stale.served    cached result served while refreshing or failing,
+                        seconds is the age of the result
+
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+log = logging.getLogger(__name__)
+
+PHASES = (
+    "http.fetch",
+    "ftp.connect",
+    "ftp.retr",
+    "ftp.info",
+    "json.parse",
+    "xml.parse",
+    "index.load",
+    "index.search",
+    "stale.served",
+)
+
+_hooks = []  # Functions called with each Event
+
+
+class Event(NamedTuple):
+    """ A finished phase """
+
+    phase: str
+    seconds: float
+    nbytes: Optional[int]
+    detail: Optional[str]
+    error: bool
+
+
+class _Timer:
+    """ Times a phase and reports it to the hooks """
+
+    __slots__ = ("phase", "detail", "nbytes", "_start")
+
+    def __init__(self, phase: str, detail: Optional[str]) -> None:
+        self.phase = phase
+        self.detail = detail
+        self.nbytes = None  # type: Optional[int]
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        emit(Event(self.phase, seconds, self.nbytes, self.detail, exc_type is not None))
+
+
+class _NullTimer:
+    """ Shared timer used when there are no hooks """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __setattr__(self, name, value):
+        pass  # Ignore nbytes
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(phase: str, detail: Optional[str] = None):
+    """ Context manager timing a phase, set .nbytes on it to record a size
+
+    :param phase: One of PHASES
+    :param detail: Product ID, filename or similar
+    """
+    if not _hooks:
+        return _NULL_TIMER
+    return _Timer(phase, detail)
+
+
+def enabled() -> bool:
+    """ Are any hooks listening """
+    return bool(_hooks)
+
+
+def emit(event: Event) -> None:
+    """ Send an event to every hook, a failing hook is logged and ignored """
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            log.exception("Metrics hook %r failed", hook)
+
+
+def add_hook(hook: Callable[[Event], None]) -> Callable[[Event], None]:
+    """ Call hook(event) after each phase """
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook: Callable[[Event], None]) -> None:
+    """ Stop calling a hook """
+    try:
+        _hooks.remove(hook)
+    except ValueError:
+        pass
+
+
+class PhaseStats(NamedTuple):
+    """ Totals for one phase """
+
+    count: int
+    errors: int
+    seconds: float
+    nbytes: int
+
+
+class MetricsRegistry:
+    """ Hook that keeps running totals for each phase
+
+        registry = add_hook(MetricsRegistry())
+    """
+
+    def __init__(self) -> None:
+        self._stats = {}  # type: Dict[str, PhaseStats]
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<MetricsRegistry {len(self._stats)} phases>"
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            stats = self._stats.get(event.phase, PhaseStats(0, 0, 0.0, 0))
+            self._stats[event.phase] = PhaseStats(
+                stats.count + 1,
+                stats.errors + event.error,
+                stats.seconds + event.seconds,
+                stats.nbytes + (event.nbytes or 0),
+            )
+
+    def stats(self) -> Dict[str, PhaseStats]:
+        """ Totals for each phase seen so far """
+        with self._lock:
+            return dict(self._stats)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class PrometheusHook:
+    """ Hook that records phases as Prometheus metrics
+
+        Requires prometheus_client. Adds a bomweather_phase_seconds histogram,
+        and bomweather_phase_bytes_total and bomweather_phase_errors_total
+        counters, all labelled by phase.
+    """
+
+    def __init__(self, registry=None, prefix: str = "bomweather") -> None:
+        """ Create metrics
+        :param registry: prometheus_client registry, defaults to the global one
+        :param prefix: Metric name prefix
+        """
+        try:
+            from prometheus_client import REGISTRY, Counter, Histogram
+        except ImportError:
+            raise ImportError(
+                "prometheus_client is required for PrometheusHook, "
+                "install with: pip install bomweather[prometheus]"
+            ) from None
+        registry = registry if registry is not None else REGISTRY
+        self.seconds = Histogram(
+            f"{prefix}_phase_seconds",
+            "Time spent in each phase",
+            ["phase"],
+            registry=registry,
+        )
+        self.nbytes = Counter(
+            f"{prefix}_phase_bytes",
+            "Bytes downloaded or parsed in each phase",
+            ["phase"],
+            registry=registry,
+        )
+        self.errors = Counter(
+            f"{prefix}_phase_errors",
+            "Phases that raised an exception",
+            ["phase"],
+            registry=registry,
+        )
+
+    def __call__(self, event: Event) -> None:
+        self.seconds.labels(event.phase).observe(event.seconds)
+        if event.nbytes:
+            self.nbytes.labels(event.phase).inc(event.nbytes)
+        if event.error:
+            self.errors.labels(event.phase).inc()
@@ -6,13 +6,25 @@
 """
 
 import ftplib
+import sys
+from array import array
+from calendar import timegm
 from io import BytesIO
+from collections import namedtuple
+from functools import lru_cache
 from typing import NamedTuple
-from typing import Optional
-from datetime import datetime
+from typing import Optional, List, Dict, Iterator, Sequence
+from datetime import datetime, timedelta
 import requests
 import pytz
 
+from bomweather import metrics
+from bomweather.cache import ObservationCache
+from bomweather.jsondecode import response_json
+from bomweather.transport import get_transport
+
+NAN = float("nan")
+
 
 class Observation(NamedTuple):
     """ Weather Observation """
@@ -46,6 +58,287 @@ class Observation(NamedTuple):
     wind_spd_kt: Optional[float]
 
 
+FLOAT_FIELDS = [
+    "lat",
+    "lon",
+    "apparent_t",
+    "cloud_base_m",
+    "cloud_oktas",
+    "delta_t",
+    "gust_kmh",
+    "gust_kt",
+    "air_temp",
+    "dewpt",
+    "press",
+    "press_msl",
+    "press_qnh",
+    "rain_trace",
+    "rel_hum",
+    "vis_km",
+    "wind_spd_kmh",
+    "wind_spd_kt",
+]
+STR_FIELDS = ["name", "history_product", "cloud", "cloud_type", "weather", "wind_dir"]
+STRING_FIELD_SET = frozenset(STR_FIELDS)
+
+
+@lru_cache(maxsize=64)
+def record_type(fields: tuple):
+    """ Observation, or a smaller named tuple with only some of its fields """
+    if fields == Observation._fields:
+        return Observation
+    unknown = [f for f in fields if f not in Observation._fields]
+    if unknown:
+        raise ValueError(f"Unknown observation fields {unknown}")
+    return namedtuple("ProjectedObservation", fields)
+
+
+EPOCH = datetime(1970, 1, 1)
+UTC_EPOCH = EPOCH.replace(tzinfo=pytz.UTC)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse BOM YYYYMMDDhhmmss timestamps """
+    return datetime(
+        int(value[0:4]),
+        int(value[4:6]),
+        int(value[6:8]),
+        int(value[8:10]),
+        int(value[10:12]),
+        int(value[12:14]),
+    )
+
+
+def timestamp_seconds(value: str) -> int:
+    """ Seconds since 1970 for a BOM YYYYMMDDhhmmss timestamp, ignoring time zone """
+    return timegm(
+        (
+            int(value[0:4]),
+            int(value[4:6]),
+            int(value[6:8]),
+            int(value[8:10]),
+            int(value[10:12]),
+            int(value[12:14]),
+        )
+    )
+
+
+def to_float(value) -> float:
+    """ Convert feed value to float, with NaN for missing ("-") values """
+    if value is None or value == "-":
+        return NAN
+    return float(value)
+
+
+class ObservationHistory:
+    """ All records from a station feed in columns, newest first
+
+        Numeric fields are float arrays with NaN for missing values.
+        Times are stored as integer seconds and WMO IDs as integers.
+        Text fields are dictionary encoded: each column is an array of codes
+        into a table of unique strings, with code 0 for missing values.
+
+        If only some fields are requested, the other columns are not
+        converted and records are ProjectedObservation named tuples with
+        just those fields. WMO ID and times are always loaded.
+    """
+
+    def __init__(self, records: List[dict], fields: Optional[Sequence[str]] = None):
+        """ Convert feed records to columns in a single pass
+        :param records: The "data" list from a station json feed
+        :param fields: Observation fields to load, defaults to all of them
+        """
+        self.fields = Observation._fields if fields is None else tuple(fields)
+        self.record = record_type(self.fields)
+        float_fields = [f for f in FLOAT_FIELDS if f in self.fields]
+        str_fields = [f for f in STR_FIELDS if f in self.fields]
+
+        self.wmo = array("q")
+        self.local_ts = array("q")  # Local time, as if it was UTC
+        self.utc_ts = array("q")
+        self.columns = {f: array("d") for f in float_fields}  # type: Dict
+        self.columns.update({f: array("I") for f in str_fields})
+        self.strings = [None]  # type: List[Optional[str]]
+
+        codes: Dict[Optional[str], int] = {None: 0, "-": 0}
+        floats = [(self.columns[f].append, f) for f in float_fields]
+        strings = [(self.columns[f].append, f) for f in str_fields]
+        for rec in records:
+            self.wmo.append(int(rec["wmo"]))
+            self.local_ts.append(timestamp_seconds(rec["local_date_time_full"]))
+            self.utc_ts.append(timestamp_seconds(rec["aifstime_utc"]))
+            for append, field in floats:
+                append(to_float(rec.get(field)))
+            for append, field in strings:
+                value = rec.get(field)
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(self.strings)
+                    self.strings.append(sys.intern(value))
+                append(code)
+
+    def __repr__(self):
+        return f"<ObservationHistory {len(self)} records>"
+
+    def __len__(self) -> int:
+        return len(self.utc_ts)
+
+    @property
+    def local_dt(self) -> List[datetime]:
+        """ Local times of each record """
+        return [EPOCH + timedelta(seconds=ts) for ts in self.local_ts]
+
+    @property
+    def utc_dt(self) -> List[datetime]:
+        """ UTC times of each record """
+        return [UTC_EPOCH + timedelta(seconds=ts) for ts in self.utc_ts]
+
+    def value(self, field: str, idx: int):
+        """ Get a single value, with None for missing values """
+        if field == "local_dt":
+            return EPOCH + timedelta(seconds=self.local_ts[idx])
+        if field == "utc_dt":
+            return UTC_EPOCH + timedelta(seconds=self.utc_ts[idx])
+        if field == "wmo":
+            return self.wmo[idx]
+        value = self._column(field)[idx]
+        if field in STRING_FIELD_SET:
+            return self.strings[value]
+        return None if value != value else value  # NaN check
+
+    def _column(self, field: str):
+        try:
+            return self.columns[field]
+        except KeyError:
+            if field not in Observation._fields:
+                raise
+            raise KeyError(f"{field} was not loaded, only {self.fields}") from None
+
+    def __getitem__(self, idx: int):
+        """ Build the Observation (or ProjectedObservation) for a single record """
+        if self.record is not Observation:
+            return self.record(*[self.value(f, idx) for f in self.fields])
+        strings = self.strings
+        values = {f: strings[self.columns[f][idx]] for f in STR_FIELDS}
+        for f in FLOAT_FIELDS:
+            value = self.columns[f][idx]
+            values[f] = None if value != value else value  # NaN check
+        return Observation(
+            wmo=self.wmo[idx],
+            local_dt=EPOCH + timedelta(seconds=self.local_ts[idx]),
+            utc_dt=UTC_EPOCH + timedelta(seconds=self.utc_ts[idx]),
+            **values,
+        )
+
+    def __iter__(self) -> Iterator["Observation"]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def view(self, idx: int) -> "ObservationView":
+        """ Get a lightweight view of a record without building an Observation """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("observation index out of range")
+        return ObservationView(self, idx)
+
+    def views(self) -> Iterator["ObservationView"]:
+        """ Views of every record """
+        for idx in range(len(self)):
+            yield ObservationView(self, idx)
+
+    def column(self, field: str):
+        """ Get all values for a field """
+        if field in ("local_dt", "utc_dt"):
+            return getattr(self, field)
+        if field == "wmo":
+            return self.wmo
+        if field in STRING_FIELD_SET:
+            strings = self.strings
+            return [strings[code] for code in self._column(field)]
+        return self._column(field)
+
+    def to_numpy(self) -> dict:
+        """ Get columns as numpy arrays (requires numpy) """
+        import numpy as np
+
+        data = {
+            "wmo": np.frombuffer(self.wmo, dtype=np.int64).copy(),
+            "local_dt": np.frombuffer(self.local_ts, dtype=np.int64).astype(
+                "datetime64[s]"
+            ),
+            "utc_dt": np.frombuffer(self.utc_ts, dtype=np.int64).astype(
+                "datetime64[s]"
+            ),
+        }
+        for f in FLOAT_FIELDS:
+            if f in self.columns:
+                data[f] = np.frombuffer(self.columns[f], dtype=np.float64).copy()
+        for f in STR_FIELDS:
+            if f in self.columns:
+                data[f] = np.array(self.column(f), dtype=object)
+        return data
+
+    def to_pandas(self):
+        """ Get records as a DataFrame indexed by UTC time (requires pandas) """
+        import pandas as pd
+
+        data = {"wmo": self.wmo.tolist(), "local_dt": self.local_dt}
+        for f in FLOAT_FIELDS:
+            if f in self.columns:
+                data[f] = self.columns[f].tolist()
+        for f in STR_FIELDS:
+            if f in self.columns:
+                data[f] = self.column(f)
+        return pd.DataFrame(data, index=pd.DatetimeIndex(self.utc_dt, name="utc_dt"))
+
+
+class ObservationView:
+    """ One record of an ObservationHistory
+
+        Has the same attributes as Observation, but only holds a reference
+        to the history and the record position. Values are read from the
+        columns when accessed.
+    """
+
+    __slots__ = ("_history", "_idx")
+
+    def __init__(self, history: ObservationHistory, idx: int) -> None:
+        self._history = history
+        self._idx = idx
+
+    def __repr__(self):
+        return f"<ObservationView {self.wmo} {self.utc_dt.isoformat()}>"
+
+    def __eq__(self, other):
+        if isinstance(other, ObservationView):
+            return self.to_observation() == other.to_observation()
+        if isinstance(other, Observation):
+            return self.to_observation() == other
+        return NotImplemented
+
+    def to_observation(self) -> Observation:
+        """ Copy the record into an Observation """
+        return self._history[self._idx]
+
+    def _asdict(self) -> dict:
+        return self.to_observation()._asdict()
+
+
+def _view_field(field: str) -> property:
+    def get(self):
+        try:
+            return self._history.value(field, self._idx)
+        except KeyError as e:
+            raise AttributeError(*e.args) from None
+
+    return property(get)
+
+
+for _field in Observation._fields:
+    setattr(ObservationView, _field, _view_field(_field))
+
+
 class ObservationSite:
     """ BOM Weather Station Observations
 
@@ -57,73 +350,67 @@ class ObservationSite:
 
     """
 
-    def __init__(self, wmo: int, product: str) -> None:
+    def __init__(
+        self,
+        wmo: int,
+        product: str,
+        cache: Optional[ObservationCache] = None,
+        session: Optional[requests.Session] = None,
+        timeout: float = 10,
+    ) -> None:
         """ Returns weather observations
         :param product: BOM History Product ID
         :param wmo: World Meteorological Organisation (WMO) ID
+        :param cache: Optional ObservationCache shared between sites
+        :param session: Optional requests session to reuse connections
+        :param timeout: Request timeout in seconds
         """
 
         self.wmo = wmo
         self.product = product
-        self.obs_url = f"http://www.bom.gov.au/fwo/{product}/{product}.{wmo}.json"
+        self.cache = cache
+        if session is not None:
+            session = get_transport().wrap_session(session)
+        self.session = session
+        self.timeout = timeout
+        self.obs_url = get_transport().url(f"fwo/{product}/{product}.{wmo}.json")
+        self._history = None  # type: Optional[ObservationHistory]
 
     def __repr__(self):
         return f"<Observations {self.product}.{self.wmo}>"
 
     @property
     def name(self):
-        return self.last_observation().name
+        history = self._history
+        if history is None or "name" not in history.columns:
+            # Convert just the latest name, keeping the history already loaded
+            data = self.get_observation_data()["data"][:1]
+            history = ObservationHistory(data, ["name"])
+        return history.value("name", 0)
 
-    def last_observation(self):
-        """ Get latest observation """
-        return self.get_observation(idx=0)
-
-    def get_observation(self, idx):
-        """ Return formatted observation data """
-
-        obs = self.get_observation_data()["data"][idx]
-        obs = self.dict_clean(obs)
-
-        # Convert data types
-        local_dt = datetime.strptime(obs["local_date_time_full"], "%Y%m%d%H%M%S")
-        utc_dt = datetime.strptime(obs["aifstime_utc"], "%Y%m%d%H%M%S")
-        utc_dt = utc_dt.replace(tzinfo=pytz.UTC)
+    def last_observation(self, fields: Optional[Sequence[str]] = None):
+        """ Get latest observation
+        :param fields: Only convert these fields, see history()
+        """
+        return self.get_observation(idx=0, fields=fields)
 
-        if obs["vis_km"]:
-            obs["vis_km"] = float(obs["vis_km"])
+    def get_observation(self, idx, fields: Optional[Sequence[str]] = None):
+        """ Return formatted observation data
+        :param idx: Record position, 0 is the latest
+        :param fields: Only convert these fields, see history()
+        """
+        data = self.get_observation_data()["data"]
+        return ObservationHistory([data[idx]], fields)[0]
 
-        if obs["rain_trace"]:
-            obs["rain_trace"] = float(obs["rain_trace"])
+    def history(self, fields: Optional[Sequence[str]] = None) -> ObservationHistory:
+        """ Download the station feed once and return all records
 
-        return Observation(
-            wmo=obs["wmo"],
-            name=obs["name"],
-            history_product=obs["history_product"],
-            local_dt=local_dt,
-            utc_dt=utc_dt,
-            lat=obs["lat"],
-            lon=obs["lon"],
-            apparent_t=obs["apparent_t"],
-            cloud=obs["cloud"],
-            cloud_base_m=obs["cloud_base_m"],
-            cloud_oktas=obs["cloud_oktas"],
-            cloud_type=obs["cloud_type"],
-            delta_t=obs["delta_t"],
-            gust_kmh=obs["gust_kmh"],
-            gust_kt=obs["gust_kt"],
-            air_temp=obs["air_temp"],
-            dewpt=obs["dewpt"],
-            press=obs["press"],
-            press_msl=obs["press_msl"],
-            press_qnh=obs["press_qnh"],
-            rain_trace=obs["rain_trace"],
-            rel_hum=obs["rel_hum"],
-            vis_km=obs["vis_km"],
-            weather=obs["weather"],
-            wind_dir=obs["wind_dir"],
-            wind_spd_kmh=obs["wind_spd_kmh"],
-            wind_spd_kt=obs["wind_spd_kt"],
-        )
+        :param fields: Only convert these Observation fields, records are then
+            ProjectedObservation named tuples with just those fields
+        """
+        data = self.get_observation_data()["data"]
+        self._history = ObservationHistory(data, fields)
+        return self._history
 
     @staticmethod
     def dict_clean(obj: dict) -> dict:
@@ -134,5 +421,12 @@ class ObservationSite:
 
     def get_observation_data(self):
         """ Get latest observations """
-        r = requests.get(self.obs_url, timeout=10)
-        return r.json()["observations"]
+        if self.cache is not None:
+            return self.cache.get(self.obs_url, timeout=self.timeout)["observations"]
+        with metrics.timed("http.fetch", self.obs_url) as t:
+            http = self.session or get_transport().http()
+            r = http.get(self.obs_url, timeout=self.timeout)
+            if metrics.enabled():
+                t.nbytes = len(r.content)
+        with metrics.timed("json.parse", self.obs_url):
+            return response_json(r)["observations"]
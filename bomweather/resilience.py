@@ -0,0 +1,455 @@
+""" bomweather.resilience
+
+    Keep serving data while the BOM servers are slow or down
+
+    Each data source keeps the last good parsed result for every feed or
+    product. Within fresh_for seconds it is returned as is; after that it is
+    still returned straight away (up to max_stale seconds old) while a new
+    copy is downloaded in the background. Downloads that have not finished
+    after hedge_after seconds are sent a second time, and whichever answers
+    first is used. After failure_threshold failures in a row the circuit
+    breaker opens: for reset_after seconds nothing is downloaded and callers
+    get the cached data, or CircuitOpenError if there is none.
+
+    Every stale result served is reported to metrics hooks as a
+    "stale.served" event, with seconds set to the age of the data.
+
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+from typing import Callable, Dict, Generic, NamedTuple, Optional, Tuple, TypeVar
+from typing import TYPE_CHECKING
+
+from bomweather import metrics
+from bomweather.cache import ObservationCache
+from bomweather.forecasts import FORECAST_FOLDER, Forecast, ForecastCache
+from bomweather.forecasts import ForecastProduct, parse_product
+from bomweather.ftp import FTPPool
+from bomweather.jsondecode import response_json
+from bomweather.transport import get_transport
+
+if TYPE_CHECKING:
+    import requests
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SourcePolicy(NamedTuple):
+    """ How hard to try a data source, and how old its data may be """
+
+    timeout: float  # Seconds before a single request is abandoned
+    hedge_after: Optional[float]  # Seconds before a second request is sent
+    fresh_for: float  # Seconds a result is used without revalidating
+    max_stale: float  # Oldest result (s) served while refreshing or failing
+    failure_threshold: int  # Failures in a row that open the circuit
+    reset_after: float  # Seconds the circuit stays open before a retry
+
+
+OBSERVATION_POLICY = SourcePolicy(
+    timeout=10,
+    hedge_after=1.5,
+    fresh_for=120,
+    max_stale=3 * 3600,
+    failure_threshold=5,
+    reset_after=60,
+)
+FORECAST_POLICY = SourcePolicy(
+    timeout=30,
+    hedge_after=5,
+    fresh_for=600,
+    max_stale=24 * 3600,
+    failure_threshold=3,
+    reset_after=120,
+)
+
+
+class CircuitOpenError(Exception):
+    """ A source has failed repeatedly and there is no cached data to serve """
+
+
+class CircuitBreaker:
+    """ Stop calling a source after repeated failures
+
+        closed      calls are allowed
+        open        calls are refused until reset_after has passed
+        half-open   one trial call is allowed, success closes the circuit
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_after: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None  # type: Optional[float]
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<CircuitBreaker {self.state}>"
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at < self.reset_after:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """ May a call be made now """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class CachedResult(NamedTuple):
+    """ Last good result for a key and when it was fetched """
+
+    value: object
+    fetched: float
+
+
+class ResilientSource(Generic[T]):
+    """ Stale-while-revalidate cache with hedged requests and a circuit breaker
+
+        fetch(key) is called to download and parse a key.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], T],
+        policy: SourcePolicy,
+        name: str = "source",
+        workers: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """ Create source
+        :param fetch: Function downloading and parsing one key
+        :param policy: Timeouts, hedging, staleness and circuit breaker settings
+        :param name: Name used in logs and metrics
+        :param workers: Threads for background refreshes
+        """
+        self.fetch = fetch
+        self.policy = policy
+        self.name = name
+        self.clock = clock
+        self.breaker = CircuitBreaker(
+            policy.failure_threshold, policy.reset_after, clock
+        )
+        self.counts = {
+            "fresh": 0,
+            "stale": 0,
+            "fetched": 0,
+            "hedged": 0,
+            "failed": 0,
+            "rejected": 0,
+        }
+        self._results: Dict[str, CachedResult] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresh_pool = ThreadPoolExecutor(workers)
+        self._request_pool = ThreadPoolExecutor(2 * workers)
+
+    def __repr__(self):
+        return f"<ResilientSource {self.name} {len(self._results)} cached>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """ Wait for background refreshes to finish """
+        self._refresh_pool.shutdown(wait=True)
+        self._request_pool.shutdown(wait=False)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counts[counter] += 1
+
+    def age(self, key: str) -> Optional[float]:
+        """ Seconds since the cached result for key was fetched """
+        cached = self._results.get(key)
+        return None if cached is None else self.clock() - cached.fetched
+
+    def get(self, key: str, timeout: Optional[float] = None) -> T:
+        """ Get the result for key, downloading only if there is none to serve
+
+        :param timeout: Longest time (s) to wait for a download, the download
+            itself carries on in the background and is cached if it succeeds
+        :raises CircuitOpenError: The circuit is open and nothing is cached
+        :raises TimeoutError: Nothing is cached and the download took too long
+        """
+        cached = self._results.get(key)
+        if cached is not None:
+            age = self.clock() - cached.fetched
+            if age < self.policy.fresh_for:
+                self._count("fresh")
+                return cached.value
+            if age < self.policy.max_stale:
+                self._refresh(key)
+                return self._stale(key, cached, age)
+
+        # Data older than max_stale is still better than nothing
+        if not self.breaker.allow():
+            self._count("rejected")
+            if cached is not None:
+                return self._stale(key, cached, self.clock() - cached.fetched)
+            raise CircuitOpenError(f"{self.name} is failing, no cached {key}")
+        try:
+            return self._download(key, timeout)
+        except Exception:
+            if cached is not None:
+                return self._stale(key, cached, self.clock() - cached.fetched)
+            raise
+
+    def _stale(self, key: str, cached: CachedResult, age: float):
+        self._count("stale")
+        if metrics.enabled():
+            metrics.emit(metrics.Event("stale.served", age, None, key, False))
+        return cached.value
+
+    def _refresh(self, key: str) -> None:
+        """ Download key in the background, unless it is already refreshing """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                if self.breaker.allow():
+                    self._download(key)
+            except Exception as e:
+                log.warning("Unable to refresh %s %s: %s", self.name, key, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self._refresh_pool.submit(refresh)
+        except RuntimeError:  # Closed
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _download(self, key: str, timeout: Optional[float] = None) -> T:
+        try:
+            value = self._hedged(key, timeout)
+        except Exception:
+            self._count("failed")
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self._store(key, value)
+        return value
+
+    def _store(self, key: str, value: T) -> None:
+        self._count("fetched")
+        with self._lock:
+            self._results[key] = CachedResult(value, self.clock())
+
+    def _hedged(self, key: str, timeout: Optional[float] = None) -> T:
+        """ Fetch key, sending a second request if the first is slow """
+        first = self._request_pool.submit(self.fetch, key)
+        hedge_after = self.policy.hedge_after
+        waited = 0.0
+        pending = {first}
+        if hedge_after is not None and (timeout is None or timeout > hedge_after):
+            done, _ = wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+            self._count("hedged")
+            waited = hedge_after
+            pending.add(self._request_pool.submit(self.fetch, key))
+        deadline = None if timeout is None else time.monotonic() + timeout - waited
+        error = None  # type: Optional[BaseException]
+        while pending:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            done, pending = wait(pending, remaining, FIRST_COMPLETED)
+            if not done:
+                self._keep_late(key, pending)
+                raise TimeoutError(f"No {self.name} {key} within {timeout}s")
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    return future.result()
+        raise error
+
+    def _keep_late(self, key: str, futures) -> None:
+        """ Cache downloads that finish after the caller stopped waiting """
+
+        def finished(future):
+            if not future.cancelled() and future.exception() is None:
+                self._store(key, future.result())
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+
+class ResilientObservations:
+    """ Observation feeds served stale-while-revalidate
+
+        Pass as the cache of ObservationSite, ObservationFetcher or
+        ObservationScheduler.
+    """
+
+    def __init__(
+        self,
+        policy: SourcePolicy = OBSERVATION_POLICY,
+        session: Optional["requests.Session"] = None,
+        cache: Optional[ObservationCache] = None,
+        workers: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """ Create source
+        :param policy: Timeouts, hedging, staleness and circuit breaker settings
+        :param session: requests session used for downloads
+        :param cache: ObservationCache to download through with revalidation
+        :param workers: Threads for background refreshes
+        """
+        self.own_session = session is None and cache is None
+        if self.own_session:
+            session = get_transport().session()
+        elif session is not None:
+            session = get_transport().wrap_session(session)
+        self.session = session
+        self.cache = cache
+        self.policy = policy
+        self.source = ResilientSource(
+            self._fetch, policy, "observations", workers, clock
+        )
+
+    def __repr__(self):
+        return f"<ResilientObservations {self.source.breaker.state}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.source.close()
+        if self.own_session:
+            self.session.close()
+
+    def _fetch(self, url: str) -> dict:
+        if self.cache is not None:
+            return self.cache.get(url, timeout=self.policy.timeout)
+        with metrics.timed("http.fetch", url) as t:
+            r = self.session.get(url, timeout=self.policy.timeout)
+            if metrics.enabled():
+                t.nbytes = len(r.content)
+        r.raise_for_status()
+        with metrics.timed("json.parse", url):
+            return response_json(r)
+
+    def get(self, url: str, timeout: Optional[float] = None) -> dict:
+        """ Get decoded json for a feed
+        :param timeout: Longest time (s) to wait for a download, each request
+            uses the policy timeout
+        """
+        return self.source.get(url, timeout)
+
+
+class ResilientForecasts:
+    """ Forecast products served stale-while-revalidate
+
+        Pass as the cache of Forecast, or use forecast() directly.
+    """
+
+    def __init__(
+        self,
+        policy: SourcePolicy = FORECAST_POLICY,
+        pool: Optional[FTPPool] = None,
+        cache: Optional[ForecastCache] = None,
+        workers: int = 2,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """ Create source
+        :param policy: Timeouts, hedging, staleness and circuit breaker settings
+        :param pool: FTPPool for the forecast folder, one is opened by default
+        :param cache: ForecastCache to skip downloads of unchanged products
+        :param workers: Threads for background refreshes
+        """
+        if pool is None and cache is None:
+            # Room for a hedged download next to each refresh
+            pool = FTPPool(FORECAST_FOLDER, size=2 * workers, timeout=policy.timeout)
+        self.pool = pool
+        self.cache = cache
+        self.source = ResilientSource(
+            self._fetch, policy, "forecasts", workers, clock
+        )
+        self._issued: Dict[str, str] = {}
+        self._forecasts: Dict[Tuple[str, Optional[str]], Forecast] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<ResilientForecasts {self.source.breaker.state}>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.source.close()
+        if self.pool is not None:
+            self.pool.close()
+
+    def _fetch(self, product: str) -> ForecastProduct:
+        if self.cache is not None:
+            return self.cache.get(product)[0]
+        return parse_product(self.pool.retrieve(f"{product}.xml"))
+
+    def get(self, product: str) -> Tuple[ForecastProduct, bool]:
+        """ Get a parsed product, and whether it changed since the last call """
+        parsed = self.source.get(product)
+        with self._lock:
+            changed = self._issued.get(product) != parsed.issue_time
+            self._issued[product] = parsed.issue_time
+        return parsed, changed
+
+    def forecast(self, product: str, description: Optional[str] = None) -> Forecast:
+        """ Get a forecast, reusing the same Forecast for each location """
+        key = (product, description)
+        with self._lock:
+            forecast = self._forecasts.get(key)
+            if forecast is None:
+                forecast = self._forecasts[key] = Forecast(
+                    product, description, lazy=True, cache=self
+                )
+        forecast.load()
+        return forecast
@@ -0,0 +1,314 @@
+""" bomweather.scheduler
+
+    Poll many stations around the time each one publishes
+
+    Most stations report every half hour and the feed is updated shortly
+    after. The scheduler remembers the latest aifstime_utc of each station,
+    polls again when the next report is due (plus a grace period and random
+    jitter, so stations are spread out), and backs off while a feed has not
+    changed. Only observations that have not been seen before are emitted.
+
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List
+from typing import Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from bomweather.cache import DEFAULT_INTERVAL, ObservationCache
+from bomweather.observations import Observation, ObservationSite
+from bomweather.transport import get_transport
+
+log = logging.getLogger(__name__)
+
+Site = Tuple[int, str]  # (wmo, product)
+Failure = Tuple[int, str, Exception]
+Waiter = Tuple[asyncio.AbstractEventLoop, asyncio.Event]  # Woken by stop()
+
+
+class RateLimiter:
+    """ Token bucket allowing a steady request rate with short bursts """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """ Create limiter
+        :param rate: Requests per second
+        :param burst: Requests allowed at once after being idle
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ Wait until a request is allowed """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+class StationState:
+    """ What is known about when a station publishes """
+
+    __slots__ = ("wmo", "product", "last_utc", "interval", "next_poll", "misses")
+
+    def __init__(self, wmo: int, product: str, next_poll: float) -> None:
+        self.wmo = wmo
+        self.product = product
+        self.last_utc = None  # type: Optional[int]
+        self.interval = DEFAULT_INTERVAL
+        self.next_poll = next_poll
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<StationState {self.product}.{self.wmo} next={self.next_poll:.0f}>"
+
+
+class ObservationScheduler:
+    """ Change feed of new observations for many stations
+
+        for obs in scheduler.changes():  # Blocks between polls
+            ...
+    """
+
+    def __init__(
+        self,
+        sites: Iterable[Site] = (),
+        workers: int = 8,
+        rate: float = 10,
+        grace: float = 60,
+        jitter: float = 30,
+        retry: float = 60,
+        max_backoff: float = 900,
+        timeout: float = 10,
+        cache: Optional[ObservationCache] = None,
+        session=None,
+        max_failures: int = 100,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """ Create scheduler
+        :param sites: (wmo, product) for each station to watch
+        :param workers: Maximum number of requests in flight
+        :param rate: Maximum requests per second to each host
+        :param grace: Time (s) allowed after a report is due for BOM to publish it
+        :param jitter: Random delay (s) added to each poll, up to this much
+        :param retry: First delay (s) after polling a feed that had not changed
+        :param max_backoff: Longest delay (s) between polls of an unchanged feed
+        :param timeout: Request timeout in seconds
+        :param cache: Optional ObservationCache to use for feeds
+        :param session: requests session, pooled by default
+        :param max_failures: Number of recent failures kept in failures
+        """
+        self.own_session = session is None and cache is None
+        if self.own_session:
+            from bomweather.fetch import pooled_session
+
+            session = pooled_session(workers)
+        elif session is not None:
+            session = get_transport().wrap_session(session)
+        self.session = session
+        self.cache = cache
+        self.workers = workers
+        self.rate = rate
+        self.grace = grace
+        self.jitter = jitter
+        self.retry = retry
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.clock = clock
+        self.failures: Deque[Failure] = deque(maxlen=max_failures)
+        self._stations: Dict[Site, StationState] = {}
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._waiters: Set[Waiter] = set()
+        self._pool = ThreadPoolExecutor(workers)
+        for wmo, product in sites:
+            self.add(wmo, product)
+
+    def __repr__(self):
+        return f"<ObservationScheduler {len(self._stations)} stations>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """ Stop polling and release the workers and connections """
+        self.stop()
+        self._pool.shutdown(wait=True)
+        if self.own_session:
+            self.session.close()
+
+    def stop(self) -> None:
+        """ Make changes() and watch() return after the current poll """
+        self._stop.set()
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, stopped in waiters:
+            try:
+                loop.call_soon_threadsafe(stopped.set)
+            except RuntimeError:  # Loop already closed
+                pass
+
+    def add(self, wmo: int, product: str) -> None:
+        """ Start watching a station, it is polled straight away """
+        with self._lock:
+            self._stations.setdefault(
+                (wmo, product), StationState(wmo, product, self.clock())
+            )
+
+    def remove(self, wmo: int, product: str) -> None:
+        """ Stop watching a station """
+        with self._lock:
+            self._stations.pop((wmo, product), None)
+
+    @property
+    def stations(self) -> List[StationState]:
+        with self._lock:
+            return list(self._stations.values())
+
+    def next_due(self) -> Optional[float]:
+        """ Time the next station should be polled """
+        return min((st.next_poll for st in self.stations), default=None)
+
+    def due(self, now: Optional[float] = None) -> List[StationState]:
+        """ Stations that should be polled now """
+        now = self.clock() if now is None else now
+        return [st for st in self.stations if st.next_poll <= now]
+
+    def _limiter(self, url: str) -> RateLimiter:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(self.rate, burst=self.workers)
+            return self._limiters[host]
+
+    def poll(self, state: StationState) -> List[Observation]:
+        """ Poll one station and reschedule it
+
+        :return: observations newer than the last one seen, oldest first
+        """
+        site = ObservationSite(
+            state.wmo,
+            state.product,
+            cache=self.cache,
+            session=self.session,
+            timeout=self.timeout,
+        )
+        fresh = getattr(self.cache, "fresh", None)
+        if fresh is None or not fresh(site.obs_url):
+            self._limiter(site.obs_url).acquire()
+        try:
+            history = site.history()
+        except Exception as e:  # One bad feed should not stop the others
+            log.warning("Unable to poll %s.%s: %s", state.product, state.wmo, e)
+            self.failures.append((state.wmo, state.product, e))
+            self._backoff(state)
+            return []
+
+        times = history.utc_ts
+        last = state.last_utc
+        if not len(times) or (last is not None and times[0] <= last):
+            self._backoff(state)
+            return []
+
+        if last is None:
+            new = [history[0]]  # Only the latest report on the first poll
+        else:
+            new = [history[i] for i in range(len(times)) if times[i] > last]
+            new.reverse()
+        if len(times) > 1 and times[0] > times[1]:
+            state.interval = times[0] - times[1]
+        state.last_utc = times[0]
+        state.misses = 0
+        due = times[0] + state.interval + self.grace
+        state.next_poll = max(due, self.clock() + self.retry) + self._jitter()
+        return new
+
+    def _backoff(self, state: StationState) -> None:
+        """ Poll an unchanged feed again later, doubling the delay each time """
+        delay = min(self.max_backoff, self.retry * 2 ** state.misses)
+        state.misses += 1
+        state.next_poll = self.clock() + delay + self._jitter()
+
+    def _jitter(self) -> float:
+        return random.uniform(0, self.jitter)
+
+    def poll_due(self) -> Iterator[Observation]:
+        """ Poll every station that is due, yielding new observations """
+        futures = [self._pool.submit(self.poll, st) for st in self.due()]
+        for future in as_completed(futures):
+            yield from future.result()
+
+    def changes(self) -> Iterator[Observation]:
+        """ Yield new observations until stop() is called """
+        while not self._stop.is_set():
+            yield from self.poll_due()
+            self._wait()
+
+    def run(self, callback: Callable[[Observation], None]) -> None:
+        """ Call callback(observation) for each new observation until stopped """
+        for obs in self.changes():
+            callback(obs)
+
+    async def watch(self) -> AsyncIterator[Observation]:
+        """ Async version of changes() """
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        waiter = (loop, stopped)
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            while not self._stop.is_set():
+                futures = [
+                    loop.run_in_executor(self._pool, self.poll, st)
+                    for st in self.due()
+                ]
+                for future in asyncio.as_completed(futures):
+                    for obs in await future:
+                        yield obs
+                delay = self._delay()
+                if delay:
+                    try:
+                        await asyncio.wait_for(stopped.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def _delay(self) -> float:
+        """ Seconds until the next station is due, at most a minute """
+        next_due = self.next_due()
+        if next_due is None:
+            return 60
+        return min(60, max(0, next_due - self.clock()))
+
+    def _wait(self) -> None:
+        delay = self._delay()
+        if delay:
+            self._stop.wait(delay)
@@ -9,14 +9,23 @@ import os
 import re
 import json
 import io
-from typing import Optional, Dict, Tuple
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple, List, NamedTuple, TYPE_CHECKING
 from pathlib import Path
-import requests
+
+from bomweather.transport import get_transport
+
+if TYPE_CHECKING:
+    import requests
 
 thisdir = Path(os.path.dirname(os.path.abspath(__file__)))
 OBS_LOOKUP = thisdir / 'data' / "products_obs.json"
 FCST_LOOKUP = thisdir / 'data' / "products_forecast.json"
+FCST_MATCH = thisdir / 'data' / "forecast_locations.json"
+FCST_PAGES = thisdir / 'data' / "products_forecast_pages.json"
 STATES = ["ant", "nsw", "nt", "qld", "tas", "vic", "wa"]
+TOWN_PATTERN = r'/forecasts/(?P<town>.+?).shtml">Detailed'
 
 
 def get_obs_products(rescrape=False) -> Dict[str, str]:
@@ -34,6 +43,7 @@ def scrape_obs_products() -> Dict[str, str]:
     """ Get list of history product IDs for WMOs
         by scraping state overview pages
     """
+    transport = get_transport()
     products = dict()
     pattern = (
         r'<a href="/products/(?P<product>ID[A-Z]\d\d\d\d\d)/'
@@ -41,8 +51,8 @@ def scrape_obs_products() -> Dict[str, str]:
     )
 
     for state in STATES:
-        url = f"http://www.bom.gov.au/{state}/observations/{state}all.shtml"
-        r = requests.get(url, timeout=10)
+        url = transport.url(f"{state}/observations/{state}all.shtml")
+        r = transport.http().get(url, timeout=10)
         for product, wmo in re.findall(pattern, r.text):
             products[wmo] = product
     return products
@@ -63,35 +73,157 @@ def scrape_forecast_products() -> Dict[str, Tuple[str, str]]:
     """
 
     logging.info("Scraping list of BOM forecast products")
-    products = dict()
-    for state in STATES:
-        url = f"http://www.bom.gov.au/{state}/forecasts/precis.shtml"
-        r = requests.get(url, timeout=10)
-        pattern = r'/forecasts/(?P<town>.+?).shtml">Detailed'
-        for town in re.findall(pattern, r.text):
-            product = get_town_forecast_product_id(state, town)
-            if product:
-                products[town] = (product, state)
+    products, _, _ = update_forecast_products(previous={}, validators={})
     return products
 
 
 def get_town_forecast_product_id(state: str, town: str) -> Optional[str]:
     """ Get the product ID from page """
-    url = f"http://www.bom.gov.au/{state}/forecasts/{town}.shtml"
-    r = requests.get(url, timeout=10)
+    transport = get_transport()
+    url = transport.url(f"{state}/forecasts/{town}.shtml")
+    r = transport.http().get(url, timeout=10)
+    return parse_town_product_id(r.text)
+
+
+def parse_town_product_id(text: str) -> Optional[str]:
+    """ Find the product ID in a town forecast page """
     pattern = r"Product (ID[A-Z]\d{5})"
     try:
-        product = re.findall(pattern, r.text)[0]
+        product = re.findall(pattern, text)[0]
     except IndexError:
         pattern2 = r"Product derived from (ID[A-Z]\d{5}) and (ID[A-Z]\d{5})"
         try:
-            products = re.findall(pattern2, r.text)[0]
+            products = re.findall(pattern2, text)[0]
             product = products[-1]
         except IndexError:
             return None
     return product
 
 
+class ProductChanges(NamedTuple):
+    """ Difference between two forecast product lists """
+
+    added: Dict[str, Tuple[str, str]]
+    removed: Dict[str, Tuple[str, str]]
+    changed: Dict[str, Tuple[Tuple[str, str], Tuple[str, str]]]
+
+
+def diff_forecast_products(
+    old: Dict[str, Tuple[str, str]], new: Dict[str, Tuple[str, str]]
+) -> ProductChanges:
+    """ Compare forecast product lists by town """
+    old = {town: tuple(value) for town, value in old.items()}
+    new = {town: tuple(value) for town, value in new.items()}
+    return ProductChanges(
+        added={t: new[t] for t in new if t not in old},
+        removed={t: old[t] for t in old if t not in new},
+        changed={t: (old[t], new[t]) for t in new if t in old and old[t] != new[t]},
+    )
+
+
+def get_forecast_page_validators() -> Dict[str, dict]:
+    """ Get the validators saved by the last incremental scrape """
+    if FCST_PAGES.is_file():
+        with open(FCST_PAGES, "r") as fp:
+            return json.load(fp)
+    return {}
+
+
+def update_forecast_products(
+    previous: Optional[Dict[str, Tuple[str, str]]] = None,
+    validators: Optional[Dict[str, dict]] = None,
+    concurrency: int = 16,
+    session: Optional["requests.Session"] = None,
+) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, dict], ProductChanges]:
+    """ Scrape forecast products, only re-reading town pages that changed
+
+        Town pages are requested concurrently over a shared connection pool,
+        with If-None-Match/If-Modified-Since from the previous scrape. Pages
+        that are not modified, or whose content hash is unchanged, keep their
+        previous product ID.
+
+    :param previous: Products from the last scrape, defaults to the cached file
+    :param validators: Page validators from the last scrape
+    :param concurrency: Maximum number of requests in flight
+    :param session: requests session, pooled by default
+    :return: products, new page validators and the changes from previous
+    """
+    from bomweather.fetch import pooled_session
+
+    if previous is None:
+        previous = get_forecast_products()
+    if validators is None:
+        validators = get_forecast_page_validators()
+    own_session = session is None
+    if own_session:
+        session = pooled_session(concurrency)
+    else:
+        session = get_transport().wrap_session(session)
+
+    def get_towns(state: str) -> List[Tuple[str, str]]:
+        url = get_transport().url(f"{state}/forecasts/precis.shtml")
+        r = session.get(url, timeout=10)
+        r.raise_for_status()
+        return [(town, state) for town in re.findall(TOWN_PATTERN, r.text)]
+
+    def get_product(town: str, state: str) -> Tuple[Optional[str], dict]:
+        url = get_transport().url(f"{state}/forecasts/{town}.shtml")
+        known = validators.get(town, {})
+        if town not in previous or known.get("url") != url:
+            known = {}
+        headers = {}
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+        r = session.get(url, headers=headers, timeout=10)
+        if known and r.status_code == 304:
+            return previous[town][0], known
+        r.raise_for_status()
+        digest = hashlib.sha1(r.content).hexdigest()
+        page = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "sha1": digest,
+        }
+        if known.get("sha1") == digest:
+            return previous[town][0], page
+        return parse_town_product_id(r.text), page
+
+    def get_product_or_previous(town: str, state: str) -> Tuple[Optional[str], dict]:
+        try:
+            return get_product(town, state)
+        except Exception as e:  # One bad page should not stop the rescrape
+            logging.warning("Unable to scrape forecast page for %s: %s", town, e)
+            if town in previous:
+                return previous[town][0], validators.get(town, {})
+            return None, {}
+
+    products = dict()
+    pages = dict()
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            towns = [t for found in pool.map(get_towns, STATES) for t in found]
+            results = pool.map(lambda t: get_product_or_previous(*t), towns)
+            for (town, state), (product, page) in zip(towns, results):
+                if product:
+                    products[town] = (product, state)
+                    pages[town] = page
+    finally:
+        if own_session:
+            session.close()
+
+    changes = diff_forecast_products(previous, products)
+    logging.info(
+        "Forecast products: %s added, %s removed, %s changed",
+        len(changes.added),
+        len(changes.removed),
+        len(changes.changed),
+    )
+    return products, pages, changes
+
+
 if __name__ == "__main__":
 
     LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
@@ -106,6 +238,20 @@ if __name__ == "__main__":
 
     # Update the forecast_stations.json file
     logging.info("Updating products_forecast.json")
-    fc_data = scrape_forecast_products()
+    fc_data, fc_pages, fc_changes = update_forecast_products()
+    for town, product in sorted(fc_changes.added.items()):
+        logging.info("Added %s %s", town, product)
+    for town, product in sorted(fc_changes.removed.items()):
+        logging.info("Removed %s %s", town, product)
+    for town, (old, new) in sorted(fc_changes.changed.items()):
+        logging.info("Changed %s %s -> %s", town, old, new)
     with open(FCST_LOOKUP, "w") as fp:
         json.dump(fc_data, fp, indent=4, sort_keys=True)
+    with open(FCST_PAGES, "w") as fp:
+        json.dump(fc_pages, fp, indent=4, sort_keys=True)
+
+    # Update the forecast_locations.json match table
+    from bomweather.stations import save_forecast_locations
+
+    logging.info("Updating forecast_locations.json")
+    save_forecast_locations()
@@ -6,48 +6,274 @@
 
 import logging
 import os
-import io
-import ftplib
-import zipfile
-from typing import Iterator
+import json
+import tempfile
+import zlib
+import struct
+from itertools import chain
+from typing import Iterator, Iterable, List, Optional, NamedTuple, TYPE_CHECKING
 from pathlib import Path
 
+from bomweather import metrics
+from bomweather.transport import get_transport
+
+if TYPE_CHECKING:
+    import ftplib
+
 thisdir = Path(os.path.dirname(os.path.abspath(__file__)))
 STN_LIST = thisdir / 'data' / "stations.txt"
+STN_META = thisdir / 'data' / "stations_meta.json"
 log = logging.getLogger(__name__)
 
+FOLDER = "anon2/home/ncc/metadata/sitelists"
+FILENAME = "stations.zip"
+HEADER_LINES = 4
+
+
+class StationRow(NamedTuple):
+    """ Station with a WMO ID from stations.txt """
+
+    site: str
+    site_name: str
+    lat: float
+    lon: float
+    state: str
+    wmo: str
+
 
-def get_station_list(rescrape=False):
+class StationChanges(NamedTuple):
+    """ Stations that differ between two station lists """
+
+    added: List[StationRow]
+    removed: List[StationRow]
+    changed: List[StationRow]
+
+
+def get_station_list(rescrape=False) -> List[str]:
     """ Get list of history product IDs for WMOs from local cached file
     """
     if STN_LIST.is_file() and not rescrape:
-        with open(STN_LIST, "rb") as fp:
+        # Lines end in \r\r\n, so only split on \n
+        with open(STN_LIST, "r", newline="\n") as fp:
             return fp.readlines()
     return scrape_station_list()
 
 
+def parse_station_row(line: str) -> Optional[StationRow]:
+    """ Parse a fixed width stations.txt row, if the station has a WMO ID """
+    row = line.strip()
+    wmo = row[128:135].strip()
+    # If no WMO then skip station
+    if not wmo or ".." in wmo:
+        return None
+    return StationRow(
+        site=row[0:6],
+        site_name=row[12:55].strip(),
+        lat=float(row[70:78]),
+        lon=float(row[79:88]),
+        state=row[104:108].strip(),
+        wmo=wmo,
+    )
+
+
+def iter_station_rows(lines: Iterable[str]) -> Iterator[StationRow]:
+    """ Parse the stations with WMO IDs from stations.txt lines """
+    for i, line in enumerate(lines):
+        if i < HEADER_LINES:
+            continue  # Skip headers
+        if len(line.strip()) < 20:
+            # Empty line means we are at the footer
+            break
+        station = parse_station_row(line)
+        if station:
+            yield station
+
+
+def iter_ftp_file(ftp: "ftplib.FTP", filename: str, blocksize: int = 65536):
+    """ Yield a remote file in chunks as they arrive """
+    with ftp.transfercmd(f"RETR {filename}") as conn:
+        while True:
+            data = conn.recv(blocksize)
+            if not data:
+                break
+            yield data
+    ftp.voidresp()
+
+
+def iter_zip_member(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """ Decompress the first file of a zip archive from a stream of chunks
+
+        Reads the local file header at the start of the archive, so the
+        central directory at the end is never needed. The rest of the
+        archive is still read so an FTP transfer is allowed to complete.
+    """
+    chunks = iter(chunks)
+    buffer = b""
+    header = struct.Struct("<4s5H3I2H")
+    while len(buffer) < header.size:
+        buffer += next(chunks)
+    (sig, _, flags, method, _, _, _, size, _, name_len, extra_len) = header.unpack(
+        buffer[: header.size]
+    )
+    if sig != b"PK\x03\x04":
+        raise ValueError("Not a zip archive")
+    start = header.size + name_len + extra_len
+    while len(buffer) < start:
+        buffer += next(chunks)
+    buffer = buffer[start:]
+
+    if method == 0 and not flags & 0x08:  # Stored
+        remaining = size
+        for chunk in chain([buffer], chunks):
+            yield chunk[:remaining]
+            remaining -= len(chunk[:remaining])
+            if not remaining:
+                break
+        for _ in chunks:
+            pass
+        return
+    if method != 8:
+        raise ValueError(f"Unsupported zip compression method {method}")
+
+    decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+    data = buffer
+    while True:
+        yield decomp.decompress(data)
+        if decomp.eof:
+            for _ in chunks:
+                pass
+            return
+        try:
+            data = next(chunks)
+        except StopIteration:
+            raise ValueError("Zip archive ended early") from None
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """ Split a stream of chunks into lines ending in \\n """
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+def connect() -> "ftplib.FTP":
+    """ Log in to the FTP server and change to the station list folder """
+    transport = get_transport()
+    with metrics.timed("ftp.connect", transport.ftp_host):
+        ftp = transport.connect_ftp()
+        try:
+            ftp.cwd(FOLDER)
+            ftp.voidcmd("TYPE I")
+        except BaseException:
+            ftp.close()
+            raise
+    return ftp
+
+
 def scrape_station_list() -> list:
     """ Download list of observation station metadata from
         Bureau of Meteorology FTP service
     """
 
     log.debug("Downloading BOM Station Data")
-    host = "ftp.bom.gov.au"
-    folder = "anon2/home/ncc/metadata/sitelists"
-    filename = "stations.zip"
-
-    output = []
-    with io.BytesIO() as fp:
-        with ftplib.FTP(host) as ftp:
-            ftp.login()
-            ftp.cwd(folder)
-            ftp.retrbinary(f"RETR {filename}", fp.write)
-            fp.seek(0)  # Return to start of file
-            with zipfile.ZipFile(fp) as archive:
-                with archive.open("stations.txt") as txt_file:
-                    for line in txt_file:
-                        output.append(line.decode())
-    return output
+    with connect() as ftp:
+        with metrics.timed("ftp.retr", FILENAME) as t:
+            chunks = iter_zip_member(iter_ftp_file(ftp, FILENAME))
+            lines = [line.decode() for line in iter_lines(chunks)]
+            if metrics.enabled():
+                t.nbytes = sum(len(line) for line in lines)
+    return lines
+
+
+def diff_station_rows(
+    old: Iterable[StationRow], new: Iterable[StationRow]
+) -> StationChanges:
+    """ Compare station lists by site ID """
+    old_sites = {st.site: st for st in old}
+    new_sites = {st.site: st for st in new}
+    return StationChanges(
+        added=[st for site, st in new_sites.items() if site not in old_sites],
+        removed=[st for site, st in old_sites.items() if site not in new_sites],
+        changed=[
+            st
+            for site, st in new_sites.items()
+            if site in old_sites and old_sites[site] != st
+        ],
+    )
+
+
+def write_station_list(
+    lines: Iterable[bytes], path: Path = STN_LIST
+) -> List[StationRow]:
+    """ Atomically replace stations.txt keeping only stations with WMO IDs
+
+    :param lines: stations.txt lines as bytes
+    :return: the stations that were kept
+    """
+    kept = []
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            footer = False
+            for i, line in enumerate(lines):
+                if i < HEADER_LINES or footer:
+                    fp.write(line)
+                    continue
+                text = line.decode()
+                if len(text.strip()) < 20:
+                    footer = True
+                    fp.write(line)
+                    continue
+                station = parse_station_row(text)
+                if station:
+                    kept.append(station)
+                    fp.write(line)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, str(path))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return kept
+
+
+def refresh_station_list(force: bool = False) -> Optional[StationChanges]:
+    """ Update stations.txt from the FTP server if the remote file has changed
+
+        The archive is decompressed and parsed as it downloads, and only
+        stations with a WMO ID are kept. Nothing is downloaded when the
+        remote modification time and size match the last refresh.
+
+    :param force: Download even if the remote file looks unchanged
+    :return: changed stations, or None if the list was already up to date
+    """
+    old = []  # type: List[StationRow]
+    if STN_LIST.is_file():
+        old = list(iter_station_rows(get_station_list()))
+    previous = {}
+    if STN_META.is_file():
+        with open(STN_META, "r") as fp:
+            previous = json.load(fp)
+
+    from bomweather.ftp import remote_file_info
+
+    with connect() as ftp:
+        info = remote_file_info(ftp, FILENAME)
+        if info == previous and old and not force:
+            log.info("Station list is up to date")
+            return None
+        log.debug("Downloading BOM Station Data")
+        with metrics.timed("ftp.retr", FILENAME):
+            chunks = iter_zip_member(iter_ftp_file(ftp, FILENAME))
+            new = write_station_list(iter_lines(chunks), STN_LIST)
+
+    with open(STN_META, "w") as fp:
+        json.dump(info, fp, indent=4, sort_keys=True)
+    return diff_station_rows(old, new)
 
 
 if __name__ == "__main__":
@@ -58,6 +284,14 @@ if __name__ == "__main__":
 
     # Update the stations.txt file
     logging.info("Updating stations.txt")
-    data = scrape_station_list()
-    with open(STN_LIST, "w") as fp:
-        fp.writelines(data)
+    changes = refresh_station_list()
+    if changes is not None:
+        for kind, stations in changes._asdict().items():
+            for st in stations:
+                logging.info("%s %s %s %s", kind.title(), st.wmo, st.site, st.site_name)
+
+        # Forecast locations are matched to stations, so rebuild the match table
+        from bomweather.stations import save_forecast_locations
+
+        logging.info("Updating forecast_locations.json")
+        save_forecast_locations()
@@ -0,0 +1,225 @@
+""" bomweather.search
+
+    Find observation stations and forecast towns by partial name
+
+    Names are split into words and kept in sorted lists, so whole name and
+    word prefixes are found with a binary search. Misspelt names are found
+    through an index of the three letter sequences (trigrams) in each name.
+    The index is built once per process and rebuilt when the station lists
+    change.
+
+"""
+
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from bomweather.scrape_products import FCST_MATCH
+from bomweather.station_index import source_signature
+from bomweather.stations import get_forecast_locations, get_obs_locations
+
+KINDS = ("obs", "forecast")
+MIN_SIMILARITY = 0.3
+
+_index: Dict[str, "NameSearchIndex"] = {}
+
+
+class StationMatch(NamedTuple):
+    """ Station or forecast town matching a search """
+
+    name: str
+    state: str
+    lat: float
+    lon: float
+    kind: str  # "obs" or "forecast"
+    wmo: Optional[str]  # Observation stations only
+    product: str  # Observation or forecast product ID
+    score: float  # Lower is a better match
+
+
+def words(name: str) -> List[str]:
+    """ Lowercase words of a name, without punctuation """
+    return re.findall(r"[a-z0-9]+", name.lower())
+
+
+def trigrams(text: str) -> frozenset:
+    """ Three letter sequences of a normalized name, marking the start """
+    text = "  " + text
+    return frozenset(text[i : i + 3] for i in range(len(text) - 2))
+
+
+def _prefix_range(keys: List[Tuple[str, int]], prefix: str) -> List[int]:
+    """ Entries of a sorted (key, entry) list whose key starts with prefix """
+    start = bisect_left(keys, (prefix,))
+    end = bisect_left(keys, (prefix + "\x7f",), start)  # After any [a-z0-9]
+    return [i for _, i in keys[start:end]]
+
+
+class NameSearchIndex:
+    """ Prefix and trigram index over station and town names """
+
+    def __init__(self, entries: Sequence[StationMatch]) -> None:
+        """ Build index
+        :param entries: Stations to search, with a score of 0
+        """
+        self.entries = list(entries)
+        self._words = []  # type: List[List[str]]
+        self._joined = []  # type: List[str]
+        self._names = []  # type: List[Tuple[str, int]]
+        self._word_keys = []  # type: List[Tuple[str, int]]
+        self._gram_counts = []  # type: List[int]
+        self._by_gram: Dict[str, List[int]] = {}
+        for i, entry in enumerate(self.entries):
+            name_words = words(entry.name)
+            self._words.append(name_words)
+            joined = "".join(name_words)
+            self._joined.append(joined)
+            self._names.append((joined, i))
+            self._word_keys.extend((word, i) for word in set(name_words))
+            grams = trigrams(joined)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._by_gram.setdefault(gram, []).append(i)
+        self._names.sort()
+        self._word_keys.sort()
+        # Among equal scores shorter names first, then alphabetically
+        by_name = sorted(
+            range(len(self.entries)),
+            key=lambda i: (len(self.entries[i].name), self.entries[i].name),
+        )
+        self._order = [0] * len(by_name)
+        for position, i in enumerate(by_name):
+            self._order[i] = position
+
+    def __repr__(self):
+        return f"<NameSearchIndex {len(self.entries)} names>"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(
+        self,
+        query: str,
+        state: Optional[str] = None,
+        kind: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[StationMatch]:
+        """ Best matches for a partial name
+
+            Scores rank how each name matched:
+
+            0: the whole name, ignoring spaces and punctuation
+            1: the start of the name
+            2: the start of a word, for every word of the query
+            3-4: similar spelling, lower for closer matches
+
+        :param query: Partial or misspelt name
+        :param state: Only include this state, eg QLD
+        :param kind: Only include "obs" stations or "forecast" towns
+        :param limit: Maximum number of results
+        """
+        query_words = words(query)
+        if not query_words or limit < 1:
+            return []
+        joined = "".join(query_words)
+        state = state.upper() if state else None
+        entries = self.entries
+
+        def wanted(i: int) -> bool:
+            entry = entries[i]
+            return (state is None or entry.state == state) and (
+                kind is None or entry.kind == kind
+            )
+
+        scores: Dict[int, float] = {}
+        for i in _prefix_range(self._names, joined):
+            if wanted(i):
+                scores[i] = 0 if self._joined[i] == joined else 1
+
+        longest = max(query_words, key=len)
+        others = [q for q in query_words if q != longest]
+        for i in _prefix_range(self._word_keys, longest):
+            if i in scores or not wanted(i):
+                continue
+            name_words = self._words[i]
+            if all(any(w.startswith(q) for w in name_words) for q in others):
+                scores[i] = 2
+
+        if len(scores) < limit and len(joined) >= 3:
+            grams = trigrams(joined)
+            by_gram = self._by_gram
+            shared = Counter(chain.from_iterable(by_gram.get(g, ()) for g in grams))
+            least = MIN_SIMILARITY * len(grams)
+            gram_counts = self._gram_counts
+            for i, count in shared.items():
+                if count < least or i in scores or not wanted(i):
+                    continue
+                # Jaccard similarity of the query and name trigrams
+                similarity = count / (len(grams) + gram_counts[i] - count)
+                if similarity >= MIN_SIMILARITY:
+                    scores[i] = 4 - similarity
+
+        order = self._order
+        ranked = heapq.nsmallest(
+            limit, scores.items(), key=lambda item: (item[1], order[item[0]])
+        )
+        return [entries[i]._replace(score=score) for i, score in ranked]
+
+
+def _entries() -> Iterable[StationMatch]:
+    for station in get_obs_locations().values():
+        yield StationMatch(
+            station.site_name,
+            station.state.upper(),
+            station.lat,
+            station.lon,
+            "obs",
+            station.wmo,
+            station.obs_product,
+            0,
+        )
+    for product, town in get_forecast_locations().items():
+        yield StationMatch(
+            town.site_name.replace("-", " ").title(),
+            town.state.upper(),
+            town.lat,
+            town.lon,
+            "forecast",
+            None,
+            product,
+            0,
+        )
+
+
+def get_name_index() -> NameSearchIndex:
+    """ Get the search index, building it if the station lists have changed """
+    signature = source_signature() + "|" + source_signature([FCST_MATCH])
+    index = _index.get(signature)
+    if index is None:
+        index = NameSearchIndex(_entries())
+        _index.clear()
+        _index[signature] = index
+    return index
+
+
+def search_stations(
+    query: str,
+    state: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = 10,
+) -> List[StationMatch]:
+    """ Find observation stations and forecast towns by partial name
+
+        search_stations("brisb", state="QLD", limit=10)
+
+    :param query: Partial or misspelt name
+    :param state: Only include this state, eg QLD
+    :param kind: Only include "obs" stations or "forecast" towns
+    :param limit: Maximum number of results
+    """
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"Unknown kind {kind}, expected one of {KINDS}")
+    return get_name_index().search(query, state, kind, limit)
@@ -0,0 +1,187 @@
+""" bomweather.spatial
+
+    Spatial index for nearest station lookups
+
+    Points are stored as xyz coordinates on the unit sphere in a KD-tree.
+    Straight line (chord) distance between unit vectors increases with
+    great circle distance, so the tree can be searched with simple
+    squared distances and converted back to kilometres at the end.
+
+"""
+
+import heapq
+from math import asin, cos, pi, radians, sin
+from typing import List, Sequence, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+LEAF_SIZE = 8
+
+
+def to_xyz(lat: float, lon: float) -> Tuple[float, float, float]:
+    """ Convert latitude and longitude to a point on the unit sphere """
+    lat_r = radians(lat)
+    lon_r = radians(lon)
+    return (cos(lat_r) * cos(lon_r), cos(lat_r) * sin(lon_r), sin(lat_r))
+
+
+def chord_to_km(chord_sq: float) -> float:
+    """ Convert a squared chord length on the unit sphere to kilometres """
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, chord_sq ** 0.5 / 2))
+
+
+def km_to_chord(distance_km: float) -> float:
+    """ Convert a great circle distance to a squared chord length """
+    angle = distance_km / EARTH_RADIUS_KM
+    if angle >= pi:
+        return float("inf")
+    return (2 * sin(angle / 2)) ** 2
+
+
+class SpatialIndex:
+    """ KD-tree over latitude and longitude points """
+
+    def __init__(self, lats: Sequence[float], lons: Sequence[float]) -> None:
+        """ Build the tree
+        :param lats: Latitudes of each point
+        :param lons: Longitudes of each point
+        """
+        self._xyz = [to_xyz(lat, lon) for lat, lon in zip(lats, lons)]
+        self._root = self._build(list(range(len(self._xyz))))
+
+    def __len__(self) -> int:
+        return len(self._xyz)
+
+    def _build(self, idx: List[int]):
+        """ Recursively split points on the axis with the largest spread """
+        if len(idx) <= LEAF_SIZE:
+            return (None, idx)
+        xyz = self._xyz
+        spreads = [
+            max(xyz[i][a] for i in idx) - min(xyz[i][a] for i in idx)
+            for a in range(3)
+        ]
+        axis = spreads.index(max(spreads))
+        idx.sort(key=lambda i: xyz[i][axis])
+        mid = len(idx) // 2
+        split = xyz[idx[mid]][axis]
+        return (axis, split, self._build(idx[:mid]), self._build(idx[mid:]))
+
+    def _search(self, point, k: int, limit: float) -> List[Tuple[float, int]]:
+        """ Find up to k points within squared chord limit, nearest first """
+        if k < 1 or not self._xyz:
+            return []
+        xyz = self._xyz
+        px, py, pz = point
+        # Max-heap of (-distance, position) for the best k found so far
+        heap = []  # type: List[Tuple[float, int]]
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, floor = stack.pop()
+            bound = -heap[0][0] if len(heap) == k else limit
+            if floor > bound:
+                continue
+            if node[0] is None:
+                for i in node[1]:
+                    x, y, z = xyz[i]
+                    d = (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2
+                    if d > limit:
+                        continue
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d, i))
+                    elif d < -heap[0][0]:
+                        heapq.heapreplace(heap, (-d, i))
+                continue
+            axis, split, left, right = node
+            diff = point[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, max(floor, diff * diff)))
+            stack.append((near, floor))
+        return sorted((-d, i) for d, i in heap)
+
+    def nearest(self, lat: float, lon: float) -> Tuple[int, float]:
+        """ Get the position and distance (km) of the closest point """
+        results = self.k_nearest(lat, lon, 1)
+        if not results:
+            raise ValueError("Spatial index is empty")
+        return results[0]
+
+    def k_nearest(self, lat: float, lon: float, k: int) -> List[Tuple[int, float]]:
+        """ Get positions and distances (km) of the k closest points """
+        found = self._search(to_xyz(lat, lon), k, float("inf"))
+        return [(i, chord_to_km(d)) for d, i in found]
+
+    def within(
+        self, lat: float, lon: float, radius_km: float
+    ) -> List[Tuple[int, float]]:
+        """ Get positions and distances (km) of points within a radius """
+        limit = km_to_chord(radius_km)
+        found = self._search(to_xyz(lat, lon), len(self._xyz), limit)
+        return [(i, chord_to_km(d)) for d, i in found]
+
+
+def _import_numpy():
+    """ NumPy is only needed for batch lookups """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "numpy is required for batch lookups, "
+            "install with: pip install bomweather[numpy]"
+        ) from None
+    return numpy
+
+
+def _unit_vectors(np, lat_r, lon_r):
+    """ Array version of to_xyz, taking radians and returning shape (n, 3) """
+    cos_lat = np.cos(lat_r)
+    xyz = [cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)]
+    return np.stack(xyz, axis=1)
+
+
+def batch_nearest(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    target_lats: Sequence[float],
+    target_lons: Sequence[float],
+    chunk_size: int = 2048,
+):
+    """ Find the closest target for many points at once
+
+        Points are processed chunk_size at a time, so memory use is bounded
+        by chunk_size x number of targets regardless of the number of points.
+
+    :param lats: Latitudes of the query points
+    :param lons: Longitudes of the query points
+    :param target_lats: Latitudes of the candidates (eg stations)
+    :param target_lons: Longitudes of the candidates
+    :param chunk_size: Number of query points per chunk
+    :return: (index, distance_km) arrays, one entry per query point
+    """
+    np = _import_numpy()
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    if lats.shape != lons.shape:
+        raise ValueError("lats and lons must be the same length")
+    t_lat = np.radians(np.asarray(target_lats, dtype=float))
+    t_lon = np.radians(np.asarray(target_lons, dtype=float))
+    if not len(t_lat):
+        raise ValueError("No targets to search")
+    targets = _unit_vectors(np, t_lat, t_lon).T
+
+    index = np.empty(len(lats), dtype=np.intp)
+    for start in range(0, len(lats), chunk_size):
+        p_lat = np.radians(lats[start : start + chunk_size])
+        p_lon = np.radians(lons[start : start + chunk_size])
+        points = _unit_vectors(np, p_lat, p_lon)
+        # Largest dot product is the smallest great circle distance
+        index[start : start + chunk_size] = np.argmax(points @ targets, axis=1)
+
+    # Haversine for the chosen pairs only, which is accurate at short range
+    p_lat = np.radians(lats)
+    d_lat = t_lat[index] - p_lat
+    d_lon = t_lon[index] - np.radians(lons)
+    a = np.sin(d_lat / 2) ** 2 + np.cos(p_lat) * np.cos(t_lat[index]) * np.sin(
+        d_lon / 2
+    ) ** 2
+    distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return index, distance
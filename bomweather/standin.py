@@ -0,0 +1,297 @@
+""" bomweather.standin
+
+    Local stand-in for the BOM website and anonymous FTP server
+
+    Serves a folder of recorded files with the same layout as a
+    RecordingTransport: http/<url path> over HTTP and ftp/<folder>/<filename>
+    over FTP, with an optional delay before each response. Used to load test
+    pipelines or develop without reaching the BOM servers:
+
+        bomweather standin recorded --latency 0.05 --http-port 8080 --ftp-port 2121
+        BOMWEATHER_HTTP_BASE=http://127.0.0.1:8080 \\
+        BOMWEATHER_FTP_HOST=127.0.0.1:2121 bomweather export observations
+
+    Only the FTP commands the package uses are supported (USER, PASS, TYPE,
+    CWD, PWD, PASV, EPSV, RETR, SIZE, MDTM, NOOP, QUIT).
+
+"""
+
+import logging
+import posixpath
+import socket
+import socketserver
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urlsplit
+
+from bomweather.transport import Transport, recorded_name
+
+log = logging.getLogger(__name__)
+
+
+def _resolve(root: Path, path: str) -> Optional[Path]:
+    """ File under root for a request path, None if it escapes root """
+    clean = posixpath.normpath("/" + path).lstrip("/")
+    target = root / clean
+    if root not in target.parents and target != root:
+        return None
+    return target
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    server_version = "bomweather-standin"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        url = urlsplit(self.path)
+        path = _resolve(server.root, recorded_name(url.path, url.query))
+        if path is None or not path.is_file():
+            self.send_error(404)
+            return
+        stat = path.stat()
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        modified = formatdate(stat.st_mtime, usegmt=True)
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = path.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", _content_type(path))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", modified)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == etag
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                return parsedate_to_datetime(since).timestamp() >= int(mtime)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+
+def _content_type(path: Path) -> str:
+    return {
+        ".json": "application/json",
+        ".xml": "application/xml",
+        ".shtml": "text/html",
+        ".html": "text/html",
+        ".zip": "application/zip",
+    }.get(path.suffix, "application/octet-stream")
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root: Path, latency: float) -> None:
+        super().__init__(address, _HTTPHandler)
+        self.root = root
+        self.latency = latency
+
+
+class _FTPHandler(socketserver.StreamRequestHandler):
+    """ One anonymous FTP session """
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.folder = ""
+        self.passive = None  # type: Optional[socket.socket]
+        self.reply("220 bomweather stand-in FTP")
+        try:
+            for raw in self.rfile:
+                command, _, arg = raw.decode(errors="replace").strip().partition(" ")
+                handler = getattr(self, "ftp_" + command.lower(), None)
+                if handler is None:
+                    self.reply(f"502 {command} not implemented")
+                elif handler(arg) is False:
+                    break
+        finally:
+            if self.passive is not None:
+                self.passive.close()
+
+    def _file(self, name: str) -> Optional[Path]:
+        path = _resolve(self.server.root, posixpath.join("/" + self.folder, name))
+        if path is None or not path.is_file():
+            self.reply(f"550 {name}: No such file")
+            return None
+        return path
+
+    def ftp_user(self, arg):
+        self.reply("331 Please specify the password.")
+
+    def ftp_pass(self, arg):
+        self.reply("230 Login successful.")
+
+    def ftp_syst(self, arg):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_type(self, arg):
+        self.reply("200 Switching to Binary mode.")
+
+    def ftp_noop(self, arg):
+        self.reply("200 NOOP ok.")
+
+    def ftp_pwd(self, arg):
+        self.reply(f'257 "/{self.folder}" is the current directory')
+
+    def ftp_cwd(self, arg):
+        folder = posixpath.normpath(posixpath.join("/" + self.folder, arg))
+        path = _resolve(self.server.root, folder)
+        if path is None or not path.is_dir():
+            self.reply("550 Failed to change directory.")
+            return
+        self.folder = folder.strip("/")
+        self.reply("250 Directory successfully changed.")
+
+    def ftp_size(self, arg):
+        path = self._file(arg)
+        if path:
+            self.reply(f"213 {path.stat().st_size}")
+
+    def ftp_mdtm(self, arg):
+        path = self._file(arg)
+        if path:
+            mtime = time.strftime("%Y%m%d%H%M%S", time.gmtime(path.stat().st_mtime))
+            self.reply(f"213 {mtime}")
+
+    def _listen(self) -> int:
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket()
+        self.passive.bind((self.connection.getsockname()[0], 0))
+        self.passive.listen(1)
+        return self.passive.getsockname()[1]
+
+    def ftp_pasv(self, arg):
+        port = self._listen()
+        host = self.connection.getsockname()[0].replace(".", ",")
+        self.reply(f"227 Entering Passive Mode ({host},{port >> 8},{port & 255}).")
+
+    def ftp_epsv(self, arg):
+        self.reply(f"229 Entering Extended Passive Mode (|||{self._listen()}|)")
+
+    def ftp_retr(self, arg):
+        if self.passive is None:
+            self.reply("425 Use PASV first.")
+            return
+        path = self._file(arg)
+        if path is None:
+            return
+        time.sleep(self.server.latency)
+        self.reply(f"150 Opening BINARY mode data connection for {arg}.")
+        listener, self.passive = self.passive, None
+        with listener:
+            listener.settimeout(10)
+            conn, _ = listener.accept()
+        with conn, open(path, "rb") as fp:
+            conn.sendfile(fp)
+        self.reply("226 Transfer complete.")
+
+    def ftp_quit(self, arg):
+        self.reply("221 Goodbye.")
+        return False
+
+
+class _FTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root: Path, latency: float) -> None:
+        super().__init__(address, _FTPHandler)
+        self.root = root
+        self.latency = latency
+
+
+class StandInServer:
+    """ HTTP and FTP servers for a folder of recordings, run in threads
+
+        with StandInServer("recorded", latency=0.05) as server:
+            set_transport(server.transport())
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        http_port: int = 0,
+        ftp_port: int = 0,
+    ) -> None:
+        """ Create servers, port 0 picks a free port
+        :param root: Folder with http/ and ftp/ recordings
+        :param latency: Delay (s) before each response and file transfer
+        :param host: Address to listen on
+        """
+        root = Path(root).resolve()
+        self.latency = latency
+        self._http = _HTTPServer((host, http_port), root / "http", latency)
+        self._ftp = _FTPServer((host, ftp_port), root / "ftp", latency)
+        self._threads = []  # type: list
+
+    def __repr__(self):
+        return f"<StandInServer {self.http_base} ftp://{self.ftp_host}>"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def http_base(self) -> str:
+        host, port = self._http.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ftp_host(self) -> str:
+        host, port = self._ftp.server_address[:2]
+        return f"{host}:{port}"
+
+    def transport(self) -> Transport:
+        """ Transport downloading from this server """
+        return Transport(self.http_base, self.ftp_host)
+
+    def start(self) -> None:
+        for server in (self._http, self._ftp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        for server in (self._http, self._ftp):
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def serve_forever(self) -> None:
+        """ Run until interrupted """
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
@@ -0,0 +1,245 @@
+""" bomweather.station_index
+
+    Compiled, memory-mapped index of observation stations
+
+    The index is built once from stations.txt and products_obs.json
+    and stored in the cache directory as a compact binary file:
+
+        header      magic, counts and source signature
+        lat, lon    float64 arrays
+        refs        uint32 array of string ids (site, name, state, wmo, product)
+        strings     uint32 offsets and a utf-8 blob of unique strings
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+
+from bomweather import metrics
+from bomweather.cache import get_cache_dir
+from bomweather.scrape_products import OBS_LOOKUP
+from bomweather.scrape_stations import STN_LIST
+from bomweather.spatial import SpatialIndex
+
+log = logging.getLogger(__name__)
+
+INDEX_FILENAME = "stations.idx"
+MAGIC = b"BOMSTIX1"
+HEADER = struct.Struct("<8sIIII")  # magic, count, nstrings, blob length, sig length
+FIELDS = 5  # site, site_name, state, wmo, obs_product
+
+_loaded: Dict[str, "StationIndex"] = {}
+
+
+def source_signature(paths: Sequence[Path] = (STN_LIST, OBS_LOOKUP)) -> str:
+    """ Describe the source files so stale indexes can be detected """
+    parts = [sys.byteorder]
+    for path in paths:
+        try:
+            stat = path.stat()
+            parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append(f"{path.name}:missing")
+    return "|".join(parts)
+
+
+def _pad(length: int) -> int:
+    """ Bytes needed to align to 8 bytes """
+    return -length % 8
+
+
+class StationIndex:
+    """ Array backed collection of observation stations """
+
+    def __init__(self, buffer, signature: Optional[str] = None) -> None:
+        """ Load index from a bytes-like buffer (bytes or mmap) """
+        self._buffer = buffer
+        # Check the header before taking views, so a rejected mmap can be closed
+        magic, count, nstrings, blob_len, sig_len = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a station index file")
+        pos = HEADER.size
+        sig = bytes(buffer[pos : pos + sig_len]).decode()
+        pos += sig_len + _pad(sig_len)
+        if signature is not None and sig != signature:
+            raise ValueError("Station index is out of date")
+        self.signature = sig
+        self.count = count
+
+        view = memoryview(buffer)
+        self.lats = view[pos : pos + 8 * count].cast("d")
+        pos += 8 * count
+        self.lons = view[pos : pos + 8 * count].cast("d")
+        pos += 8 * count
+        self._refs = view[pos : pos + 4 * FIELDS * count].cast("I")
+        pos += 4 * FIELDS * count
+        offsets = view[pos : pos + 4 * (nstrings + 1)].cast("I")
+        pos += 4 * (nstrings + 1)
+        blob = bytes(view[pos : pos + blob_len])
+        self._strings = [
+            sys.intern(blob[offsets[i] : offsets[i + 1]].decode())
+            for i in range(nstrings)
+        ]
+        self._by_wmo: Optional[Dict[str, int]] = None
+        self._spatial = None  # type: Optional[SpatialIndex]
+
+    def __repr__(self):
+        return f"<StationIndex {self.count} stations>"
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int):
+        """ Get Station record at position i """
+        from bomweather.stations import Station
+
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("station index out of range")
+        ref = FIELDS * i
+        s = self._strings
+        r = self._refs
+        return Station(
+            s[r[ref]],
+            s[r[ref + 1]],
+            self.lats[i],
+            self.lons[i],
+            s[r[ref + 2]],
+            s[r[ref + 3]],
+            s[r[ref + 4]],
+        )
+
+    def __iter__(self) -> Iterator:
+        for i in range(self.count):
+            yield self[i]
+
+    def wmo(self, i: int) -> str:
+        """ Get the WMO ID at position i without building a Station """
+        return self._strings[self._refs[FIELDS * i + 3]]
+
+    def find(self, wmo: str) -> Optional[int]:
+        """ Get position of a station by WMO ID """
+        if self._by_wmo is None:
+            self._by_wmo = {self.wmo(i): i for i in range(self.count)}
+        return self._by_wmo.get(str(wmo))
+
+    @property
+    def spatial(self) -> SpatialIndex:
+        """ KD-tree over station coordinates, built on first use """
+        if self._spatial is None:
+            with metrics.timed("index.load", "obs spatial"):
+                self._spatial = SpatialIndex(self.lats, self.lons)
+        return self._spatial
+
+    @staticmethod
+    def build(stations: Iterable, signature: str = "") -> bytes:
+        """ Compile Station records into index bytes """
+        lats = array("d")
+        lons = array("d")
+        refs = array("I")
+        strings: Dict[str, int] = {}
+        for st in stations:
+            lats.append(st.lat)
+            lons.append(st.lon)
+            for value in (st.site, st.site_name, st.state, st.wmo, st.obs_product):
+                refs.append(strings.setdefault(value, len(strings)))
+
+        offsets = array("I", [0])
+        blob = bytearray()
+        for value in strings:  # dicts keep insertion order
+            blob.extend(value.encode())
+            offsets.append(len(blob))
+
+        sig = signature.encode()
+        parts = [
+            HEADER.pack(MAGIC, len(lats), len(strings), len(blob), len(sig)),
+            sig,
+            bytes(_pad(len(sig))),
+            lats.tobytes(),
+            lons.tobytes(),
+            refs.tobytes(),
+            offsets.tobytes(),
+            bytes(blob),
+        ]
+        return b"".join(parts)
+
+    @classmethod
+    def from_stations(cls, stations: Iterable, signature: str = ""):
+        """ Build an in-memory index from Station records """
+        return cls(StationIndex.build(stations, signature))
+
+    @classmethod
+    def open(cls, path: Path, signature: Optional[str] = None):
+        """ Memory map an index file """
+        with open(path, "rb") as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mm, signature)
+        except (ValueError, struct.error):
+            mm.close()
+            raise
+
+
+def write_index(path: Path, data: bytes) -> None:
+    """ Atomically replace the index file """
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, str(path))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _build_index(signature: str) -> StationIndex:
+    """ Build the index and store it in the cache directory if possible """
+    from bomweather.stations import get_obs_stations
+
+    log.debug("Building station index")
+    data = StationIndex.build(get_obs_stations(), signature)
+    try:
+        path = get_cache_dir() / INDEX_FILENAME
+        write_index(path, data)
+        return StationIndex.open(path, signature)
+    except OSError as e:
+        log.warning("Unable to write station index, keeping it in memory: %s", e)
+        return StationIndex(data)
+
+
+def get_station_index(rescrape: bool = False) -> StationIndex:
+    """ Get the station index, building it if the sources have changed
+
+        :param rescrape: Should it re-download station list from web
+    """
+    from bomweather.stations import get_obs_stations
+
+    if rescrape:
+        return StationIndex.from_stations(get_obs_stations(rescrape=True))
+
+    signature = source_signature()
+    index = _loaded.get("obs")
+    if index is not None and index.signature == signature:
+        return index
+
+    with metrics.timed("index.load", "obs") as t:
+        try:
+            index = StationIndex.open(get_cache_dir() / INDEX_FILENAME, signature)
+        except (OSError, ValueError, struct.error):
+            index = _build_index(signature)
+        t.nbytes = len(index._buffer)
+    _loaded["obs"] = index
+    return index
+
+
+def clear_loaded() -> None:
+    """ Forget the index loaded by this process """
+    _loaded.clear()
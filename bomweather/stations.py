@@ -6,18 +6,25 @@
 """
 
 import logging
-import os
 import re
 import json
+from bisect import bisect_left
 from math import cos, asin, sqrt
 from typing import NamedTuple
-from typing import Tuple, Optional, Iterator, List, Dict
-from pathlib import Path
-import requests
+from typing import Tuple, Optional, Iterator, List, Dict, Any, Sequence
 
+from bomweather import metrics
 from bomweather.scrape_products import get_obs_products
 from bomweather.scrape_products import get_forecast_products
-from bomweather.scrape_stations import get_station_list
+from bomweather.scrape_products import FCST_LOOKUP, FCST_MATCH, OBS_LOOKUP
+from bomweather.scrape_stations import get_station_list, iter_station_rows, STN_LIST
+from bomweather.station_index import get_station_index, source_signature
+from bomweather.spatial import SpatialIndex, batch_nearest
+
+log = logging.getLogger(__name__)
+
+_forecast_cache = {}  # type: Dict[str, Tuple[List[ForecastStation], SpatialIndex]]
+_name_index_cache = {}  # type: Dict[Tuple[Station, ...], StationNameIndex]
 
 
 class Station(NamedTuple):
@@ -32,6 +39,14 @@ class Station(NamedTuple):
     obs_product: str
 
 
+class ClosestStations(NamedTuple):
+    """ Batch lookup results, one entry per query point """
+
+    index: Any  # numpy array of positions in the station list
+    distance_km: Any  # numpy array of distances
+    stations: List[Any]
+
+
 def get_obs_locations(rescrape=False) -> Dict[str, Station]:
     """ Get list of observation locations
 
@@ -39,7 +54,7 @@ def get_obs_locations(rescrape=False) -> Dict[str, Station]:
     """
 
     data = {}
-    stations = get_obs_stations(rescrape)
+    stations = get_station_index(rescrape)
     for station in stations:
         data[station.wmo] = station
     return data
@@ -50,34 +65,14 @@ def get_obs_stations(rescrape: bool = False) -> Iterator[Station]:
 
     products = get_obs_products(rescrape)
     station_list = get_station_list(rescrape)
-    for i, line in enumerate(station_list):
-        if i < 4:
-            continue  # Skip headers
-        if type(line) == str:
-            row = line.strip()
-        else:
-            row = line.decode().strip()
-        if len(row) < 20:
-            # Empty line means we are at the footer
-            break
-
-        wmo = row[128:135].strip()
-        # If no WMO then skip station
-        if ".." in wmo:
-            wmo = None
+    for row in iter_station_rows(station_list):
+        if row.wmo not in products.keys():
             continue
+        obs_product = products[row.wmo]
 
-        site_id = row[0:6]
-        site_name = row[12:55].strip()
-        lat = float(row[70:78])
-        lon = float(row[79:88])
-        state = row[104:108].strip()
-
-        if wmo not in products.keys():
-            continue
-        obs_product = products[wmo]
-
-        yield Station(site_id, site_name, lat, lon, state, wmo, obs_product)
+        yield Station(
+            row.site, row.site_name, row.lat, row.lon, row.state, row.wmo, obs_product
+        )
 
 
 def closest_obs_station(lat: float, lon: float, rescrape: bool = False):
@@ -88,14 +83,89 @@ def closest_obs_station(lat: float, lon: float, rescrape: bool = False):
     :param rescrape: Should it re-download station list from web
     """
 
-    stations = get_obs_locations(rescrape)
-    closest_wmo = min(
-        stations,
-        key=lambda wmo: geo_distance(
-            lat, lon, stations[wmo].lat, stations[wmo].lon
-        ),
-    )
-    return stations[closest_wmo]
+    index = get_station_index(rescrape)
+    spatial = index.spatial
+    with metrics.timed("index.search", "obs"):
+        closest, _ = spatial.nearest(lat, lon)
+    return index[closest]
+
+
+def k_nearest_obs_stations(
+    lat: float, lon: float, k: int, rescrape: bool = False
+) -> List[Station]:
+    """ Get the k closest stations to a location, closest first
+
+    :param lat: Latitude
+    :param lon: Longitude
+    :param k: Number of stations to return
+    :param rescrape: Should it re-download station list from web
+    """
+
+    index = get_station_index(rescrape)
+    spatial = index.spatial
+    with metrics.timed("index.search", "obs"):
+        found = spatial.k_nearest(lat, lon, k)
+    return [index[i] for i, _ in found]
+
+
+def obs_stations_within(
+    lat: float, lon: float, radius_km: float, rescrape: bool = False
+) -> List[Station]:
+    """ Get all stations within a distance of a location, closest first
+
+    :param lat: Latitude
+    :param lon: Longitude
+    :param radius_km: Search radius in kilometres
+    :param rescrape: Should it re-download station list from web
+    """
+
+    index = get_station_index(rescrape)
+    spatial = index.spatial
+    with metrics.timed("index.search", "obs"):
+        found = spatial.within(lat, lon, radius_km)
+    return [index[i] for i, _ in found]
+
+
+def closest_obs_stations(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    rescrape: bool = False,
+    chunk_size: int = 2048,
+) -> ClosestStations:
+    """ Get the closest station for many locations at once (requires numpy)
+
+    :param lats: Latitudes
+    :param lons: Longitudes
+    :param rescrape: Should it re-download station list from web
+    :param chunk_size: Number of locations to process at a time
+    """
+
+    index = get_station_index(rescrape)
+    with metrics.timed("index.search", "obs batch"):
+        idx, dist = batch_nearest(lats, lons, index.lats, index.lons, chunk_size)
+    return ClosestStations(idx, dist, [index[i] for i in idx])
+
+
+def closest_forecast_locations(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    rescrape: bool = False,
+    chunk_size: int = 2048,
+) -> ClosestStations:
+    """ Get the closest forecast location for many locations (requires numpy)
+
+    :param lats: Latitudes
+    :param lons: Longitudes
+    :param rescrape: Should it re-download station list from web
+    :param chunk_size: Number of locations to process at a time
+    """
+
+    stations, _ = get_forecast_tree(rescrape)
+    st_lats = [st.lat for st in stations]
+    st_lons = [st.lon for st in stations]
+    with metrics.timed("index.search", "forecast batch"):
+        idx, dist = batch_nearest(lats, lons, st_lats, st_lons, chunk_size)
+    return ClosestStations(idx, dist, [stations[i] for i in idx])
 
 
 def closest_forecast_location(lat: float, lon: float, rescrape: bool = False):
@@ -106,14 +176,10 @@ def closest_forecast_location(lat: float, lon: float, rescrape: bool = False):
     :param rescrape: Should it re-download station list from web
     """
 
-    stations = get_forecast_locations(rescrape)
-    closest_product = min(
-        stations,
-        key=lambda product: geo_distance(
-            lat, lon, stations[product].lat, stations[product].lon
-        ),
-    )
-    return stations[closest_product]
+    stations, tree = get_forecast_tree(rescrape)
+    with metrics.timed("index.search", "forecast"):
+        closest, _ = tree.nearest(lat, lon)
+    return stations[closest]
 
 
 class ForecastStation(NamedTuple):
@@ -132,32 +198,173 @@ def get_forecast_locations(rescrape: bool = False) -> Dict[str, ForecastStation]
         :param rescrape: Should it re-download station list from web
     """
 
+    if FCST_MATCH.is_file() and not rescrape:
+        with open(FCST_MATCH, "r") as fp:
+            table = json.load(fp)
+        return {
+            product: ForecastStation(town, product, lat, lon, state)
+            for product, (town, lat, lon, state) in table["locations"].items()
+        }
+    data, _ = build_forecast_locations(rescrape)
+    return data
+
+
+def build_forecast_locations(
+    rescrape: bool = False
+) -> Tuple[Dict[str, ForecastStation], List[str]]:
+    """ Match forecast towns to observation stations
+
+        :param rescrape: Should it re-download station list from web
+        :return: forecast locations by product, and towns that did not match
+    """
+
     data = {}
+    ranks = {}  # type: Dict[str, int]
+    unmatched = []
     products = get_forecast_products(rescrape)
-    stations = get_obs_locations(rescrape)
+    names = StationNameIndex(get_obs_locations(rescrape))
     for town in products.keys():
         product = products[town][0]
         state = products[town][1]
-        station = match_forecast_to_station(state, town, stations)
+        station, rank = names.match_ranked(state, town)
+        if not station:
+            unmatched.append(town)
+            continue
+        # Looser matches only fill products that have no better match
+        if rank <= ranks.get(product, rank):
+            lat, lon = station.lat, station.lon
+            data[product] = ForecastStation(town, product, lat, lon, state)
+            ranks[product] = rank
+    return data, unmatched
+
+
+def save_forecast_locations() -> List[str]:
+    """ Rebuild the cached forecast_locations.json match table
+
+        :return: towns that could not be matched to a station
+    """
+
+    data, unmatched = build_forecast_locations()
+    table = {
+        "locations": {
+            product: [st.site_name, st.lat, st.lon, st.state]
+            for product, st in data.items()
+        },
+        "unmatched": sorted(unmatched),
+    }
+    with open(FCST_MATCH, "w") as fp:
+        json.dump(table, fp, indent=4, sort_keys=True)
+    if unmatched:
+        log.warning("%s forecast towns have no matching station", len(unmatched))
+    return table["unmatched"]
+
+
+def get_unmatched_forecast_towns() -> List[str]:
+    """ Get forecast towns that could not be matched to a station """
+
+    if FCST_MATCH.is_file():
+        with open(FCST_MATCH, "r") as fp:
+            return json.load(fp)["unmatched"]
+    _, unmatched = build_forecast_locations()
+    return sorted(unmatched)
+
+
+def get_forecast_tree(
+    rescrape: bool = False
+) -> Tuple[List[ForecastStation], SpatialIndex]:
+    """ Get forecast locations with a spatial index over them
+
+        :param rescrape: Should it re-download station list from web
+    """
+
+    signature = source_signature((STN_LIST, OBS_LOOKUP, FCST_LOOKUP, FCST_MATCH))
+    if rescrape or signature not in _forecast_cache:
+        with metrics.timed("index.load", "forecast"):
+            stations = list(get_forecast_locations(rescrape).values())
+            lats = [st.lat for st in stations]
+            tree = SpatialIndex(lats, [st.lon for st in stations])
+        if rescrape:
+            return stations, tree
+        _forecast_cache.clear()
+        _forecast_cache[signature] = (stations, tree)
+    return _forecast_cache[signature]
+
+
+def normalize_name(name: str) -> str:
+    """ Lowercase a place name and remove spaces and punctuation """
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+class StationNameIndex:
+    """ Stations indexed by (state, normalized name) for matching town names """
+
+    def __init__(self, stations: Dict[str, Station]) -> None:
+        self.exact = {}  # type: Dict[Tuple[str, str], Station]
+        self.by_state = {}  # type: Dict[str, List[Tuple[str, Station]]]
+        self.prefixes = {}  # type: Dict[str, List[Tuple[str, int]]]
+        for station in stations.values():
+            if not station.lat:
+                continue
+            state = station.state.lower()
+            key = (state, normalize_name(station.site_name))
+            self.exact.setdefault(key, station)
+            state_list = self.by_state.setdefault(state, [])
+            self.prefixes.setdefault(state, []).append((key[1], len(state_list)))
+            state_list.append((station.site_name.lower(), station))
+        for keys in self.prefixes.values():
+            keys.sort()
+
+    def match(self, state: str, town: str) -> Optional[Station]:
+        """ Find the station for a forecast town """
+        return self.match_ranked(state, town)[0]
+
+    def match_ranked(self, state: str, town: str) -> Tuple[Optional[Station], int]:
+        """ Find the station for a forecast town and how it was matched
+
+            0: first station name containing the town name
+            1: station name equal to the town name, ignoring spaces and punctuation
+            2: first station name starting with the town name, ignoring spaces
+               and punctuation
+        """
+        town_name = town.split("-", 1)[0]
+        stations = self.by_state.get(state, [])
+        for st_name, station in stations:
+            if town_name in st_name:
+                return station, 0
+
+        norm = normalize_name(town_name)
+        if not norm:
+            return None, 3
+        station = self.exact.get((state, norm))
         if station:
-            data[product] = ForecastStation(town, product,station.lat,station.lon,state)
-    return data
+            return station, 1
+
+        keys = self.prefixes.get(state, [])
+        i = bisect_left(keys, (norm, -1))
+        matches = []
+        while i < len(keys) and keys[i][0].startswith(norm):
+            matches.append(keys[i][1])
+            i += 1
+        if matches:
+            return stations[min(matches)][1], 2
+        return None, 3
+
+
+def get_station_name_index(stations: Dict[str, Station]) -> StationNameIndex:
+    """ StationNameIndex for stations, reused while the station list is unchanged """
+
+    signature = tuple(stations.values())
+    if signature not in _name_index_cache:
+        _name_index_cache.clear()
+        _name_index_cache[signature] = StationNameIndex(stations)
+    return _name_index_cache[signature]
 
 
 def match_forecast_to_station(
     state: str, town: str, stations: Dict[str, Station]
 ) -> Optional[Station]:
-
-    town_name = town.split("-", 1)[0]
-    for wmo in stations.keys():
-        if not stations[wmo].lat:
-            continue
-        st_state = stations[wmo].state.lower()
-        st_name = stations[wmo].site_name.lower()
-        if state == st_state:
-            if town_name in st_name:
-                return stations[wmo]
-    return None
+    """ Find the station for a forecast town """
+    return get_station_name_index(stations).match(state, town)
 
 
 def geo_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -0,0 +1,424 @@
+""" bomweather.transport
+
+    Where BOM data is downloaded from
+
+    Every HTTP request and FTP connection goes through the current transport,
+    so the BOM servers can be swapped for a mirror or a local stand-in server
+    (see bomweather.standin), and traffic can be recorded to a folder and
+    replayed later without a network:
+
+        set_transport(Transport("http://localhost:8080", "localhost:2121"))
+        set_transport(RecordingTransport("recorded"))
+        set_transport(ReplayTransport("recorded"))
+
+    The default transport can also be set with environment variables:
+
+        BOMWEATHER_HTTP_BASE    base URL instead of http://www.bom.gov.au
+        BOMWEATHER_FTP_HOST     host[:port] instead of ftp.bom.gov.au
+        BOMWEATHER_RECORD       record every download to this folder
+        BOMWEATHER_REPLAY       serve downloads from this folder instead
+
+    Recordings are stored as plain files, http/<url path> and
+    ftp/<folder>/<filename>, which is also the layout served by the
+    stand-in server.
+
+"""
+
+import io
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import ftplib
+    import requests
+
+BOM_HTTP_BASE = "http://www.bom.gov.au"
+BOM_FTP_HOST = "ftp.bom.gov.au"
+FTP_PORT = 21
+
+_current = None  # type: Optional[Transport]
+_lock = threading.Lock()
+
+
+def split_host(host: str) -> Tuple[str, int]:
+    """ Split host[:port] into the host name and port """
+    name, sep, port = host.rpartition(":")
+    if sep and port.isdigit():
+        return name, int(port)
+    return host, FTP_PORT
+
+
+class Transport:
+    """ Download from the BOM servers, or a mirror of them """
+
+    def __init__(
+        self, http_base: str = BOM_HTTP_BASE, ftp_host: str = BOM_FTP_HOST
+    ) -> None:
+        """ Create transport
+        :param http_base: Base URL of the website, eg http://localhost:8080
+        :param ftp_host: FTP server as host or host:port
+        """
+        self.http_base = http_base.rstrip("/")
+        self.ftp_host = ftp_host
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.http_base} ftp://{self.ftp_host}>"
+
+    def url(self, path: str) -> str:
+        """ URL of a path on the website, eg fwo/IDQ60801/IDQ60801.94576.json """
+        return f"{self.http_base}/{path.lstrip('/')}"
+
+    def http(self):
+        """ Object with a requests style get() for one-off requests """
+        import requests
+
+        return requests
+
+    def session(self) -> "requests.Session":
+        """ New requests session """
+        import requests
+
+        return self.wrap_session(requests.Session())
+
+    def wrap_session(self, session: "requests.Session"):
+        """ Session to use in place of one that has been set up by the caller """
+        return session
+
+    def connect_ftp(
+        self, host: Optional[str] = None, timeout: Optional[float] = None
+    ) -> "ftplib.FTP":
+        """ Log in to the FTP server anonymously
+
+        :param host: host[:port], defaults to the transport's FTP host
+        :param timeout: Socket timeout in seconds
+        """
+        import ftplib
+
+        name, port = split_host(host or self.ftp_host)
+        ftp = ftplib.FTP() if timeout is None else ftplib.FTP(timeout=timeout)
+        try:
+            ftp.connect(name, port)
+            ftp.login()
+        except BaseException:
+            ftp.close()
+            raise
+        return ftp
+
+
+def default_transport() -> Transport:
+    """ Transport configured from the environment """
+    http_base = os.environ.get("BOMWEATHER_HTTP_BASE", BOM_HTTP_BASE)
+    ftp_host = os.environ.get("BOMWEATHER_FTP_HOST", BOM_FTP_HOST)
+    if os.environ.get("BOMWEATHER_REPLAY"):
+        return ReplayTransport(os.environ["BOMWEATHER_REPLAY"], http_base, ftp_host)
+    if os.environ.get("BOMWEATHER_RECORD"):
+        return RecordingTransport(os.environ["BOMWEATHER_RECORD"], http_base, ftp_host)
+    return Transport(http_base, ftp_host)
+
+
+def get_transport() -> Transport:
+    """ Transport used for all downloads """
+    global _current
+    if _current is None:
+        with _lock:
+            if _current is None:
+                _current = default_transport()
+    return _current
+
+
+def set_transport(transport: Optional[Transport]) -> Optional[Transport]:
+    """ Use a different transport, or None to configure from the environment
+
+    :return: the previous transport
+    """
+    global _current
+    with _lock:
+        previous, _current = _current, transport
+    return previous
+
+
+def recorded_name(path: str, query: str = "") -> str:
+    """ File name, relative to the http folder, a URL path and query are kept in
+
+        The query is percent encoded so the name is valid on every platform.
+        Used by both the recording transports and the stand-in server.
+    """
+    from urllib.parse import quote
+
+    name = path.lstrip("/") or "index.html"
+    if query:
+        name += "%3F" + quote(query, safe="")
+    return name
+
+
+def _http_path(root: Path, url: str) -> Path:
+    """ File a response is recorded in """
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    return root / "http" / recorded_name(parts.path, parts.query)
+
+
+def _write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(str(tmp), str(path))
+
+
+class RecordingSession:
+    """ requests session that saves the body of each successful response """
+
+    def __init__(self, session, root: Path) -> None:
+        self._session = session
+        self._root = root
+
+    def get(self, url: str, **kwargs):
+        r = self._session.get(url, **kwargs)
+        if r.status_code == 200:
+            _write(_http_path(self._root, url), r.content)
+        return r
+
+    def close(self) -> None:
+        if hasattr(self._session, "close"):
+            self._session.close()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class RecordingFTP:
+    """ FTP connection that saves each file it downloads """
+
+    def __init__(self, ftp: "ftplib.FTP", root: Path) -> None:
+        self._ftp = ftp
+        self._root = root
+        self._folder = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._ftp.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._ftp, name)
+
+    def _path(self, cmd: str) -> Path:
+        filename = cmd.split(maxsplit=1)[1]
+        return self._root / "ftp" / self._folder / filename
+
+    def cwd(self, folder: str):
+        result = self._ftp.cwd(folder)
+        self._folder = self._ftp.pwd().strip("/")
+        return result
+
+    def retrbinary(self, cmd: str, callback, *args, **kwargs):
+        data = io.BytesIO()
+
+        def tee(block):
+            data.write(block)
+            callback(block)
+
+        result = self._ftp.retrbinary(cmd, tee, *args, **kwargs)
+        _write(self._path(cmd), data.getvalue())
+        return result
+
+    def transfercmd(self, cmd: str, *args):
+        return _RecordingConnection(self._ftp.transfercmd(cmd, *args), self._path(cmd))
+
+
+class _RecordingConnection:
+    """ Data connection that saves what was received once it is closed """
+
+    def __init__(self, conn, path: Path) -> None:
+        self._conn = conn
+        self._path = path
+        self._data = io.BytesIO()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._conn.close()
+        if exc[0] is None:
+            _write(self._path, self._data.getvalue())
+
+    def recv(self, size: int) -> bytes:
+        data = self._conn.recv(size)
+        self._data.write(data)
+        return data
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RecordingTransport(Transport):
+    """ Download as usual, saving every response to a folder """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        http_base: str = BOM_HTTP_BASE,
+        ftp_host: str = BOM_FTP_HOST,
+    ) -> None:
+        super().__init__(http_base, ftp_host)
+        self.root = Path(root)
+
+    def http(self):
+        return RecordingSession(super().http(), self.root)
+
+    def wrap_session(self, session):
+        return RecordingSession(session, self.root)
+
+    def connect_ftp(self, host=None, timeout=None):
+        return RecordingFTP(super().connect_ftp(host, timeout), self.root)
+
+
+class ReplayMissError(ConnectionError):
+    """ Nothing was recorded for a request """
+
+
+class ReplayResponse:
+    """ Recorded response with the parts of requests.Response that are used """
+
+    status_code = 200
+
+    def __init__(self, url: str, content: bytes, mtime: float) -> None:
+        self.url = url
+        self.content = content
+        modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(mtime))
+        self.headers = {"Last-Modified": modified}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class ReplaySession:
+    """ requests style session serving recorded responses """
+
+    def __init__(self, root: Path) -> None:
+        self._root = root
+
+    def get(self, url: str, **kwargs) -> ReplayResponse:
+        path = _http_path(self._root, url)
+        try:
+            return ReplayResponse(url, path.read_bytes(), path.stat().st_mtime)
+        except FileNotFoundError:
+            raise ReplayMissError(f"No recorded response for {url}") from None
+
+    def mount(self, prefix: str, adapter) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayFTP:
+    """ ftplib.FTP stand in serving recorded files """
+
+    def __init__(self, root: Path) -> None:
+        self._root = root / "ftp"
+        self._folder = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _file(self, filename: str) -> Path:
+        import ftplib
+
+        path = self._root / self._folder / filename
+        if not path.is_file():
+            raise ftplib.error_perm(f"550 {filename}: No such file (not recorded)")
+        return path
+
+    def login(self, *args, **kwargs) -> str:
+        return "230 Login successful."
+
+    def cwd(self, folder: str) -> str:
+        self._folder = str(Path(self._folder, folder)).strip("/")
+        return "250 Directory successfully changed."
+
+    def pwd(self) -> str:
+        return "/" + self._folder
+
+    def voidcmd(self, cmd: str) -> str:
+        return "200 OK"
+
+    def voidresp(self) -> str:
+        return "226 Transfer complete."
+
+    def sendcmd(self, cmd: str) -> str:
+        verb, _, arg = cmd.partition(" ")
+        if verb.upper() == "MDTM":
+            mtime = self._file(arg).stat().st_mtime
+            return "213 " + time.strftime("%Y%m%d%H%M%S", time.gmtime(mtime))
+        return "200 OK"
+
+    def size(self, filename: str) -> int:
+        return self._file(filename).stat().st_size
+
+    def retrbinary(self, cmd: str, callback, blocksize: int = 8192, rest=None) -> str:
+        with self.transfercmd(cmd) as conn:
+            while True:
+                block = conn.recv(blocksize)
+                if not block:
+                    break
+                callback(block)
+        return self.voidresp()
+
+    def transfercmd(self, cmd: str, rest=None):
+        filename = cmd.split(maxsplit=1)[1]
+        return _ReplayConnection(self._file(filename).read_bytes())
+
+    def quit(self) -> str:
+        return "221 Goodbye."
+
+    def close(self) -> None:
+        pass
+
+
+class _ReplayConnection(io.BytesIO):
+    """ Data connection reading from recorded bytes """
+
+    def recv(self, size: int) -> bytes:
+        return self.read(size)
+
+
+class ReplayTransport(Transport):
+    """ Serve every download from a folder of recordings, without a network """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        http_base: str = BOM_HTTP_BASE,
+        ftp_host: str = BOM_FTP_HOST,
+    ) -> None:
+        super().__init__(http_base, ftp_host)
+        self.root = Path(root)
+
+    def http(self):
+        return ReplaySession(self.root)
+
+    def session(self):
+        return ReplaySession(self.root)
+
+    def wrap_session(self, session):
+        return ReplaySession(self.root)
+
+    def connect_ftp(self, host=None, timeout=None):
+        return ReplayFTP(self.root)
@@ -22,7 +22,7 @@ setup(
     description=
     'Load weather data from the Australian Bureau of Meteorology (BOM) website',    
     packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
-    python_requires='>=3.4',
+    python_requires='>=3.7',
     include_package_data=True,
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -40,5 +40,14 @@ setup(
         'requests',
         'python-dateutil',
         'pytz',
-    ],   
+    ],
+    extras_require={
+        'numpy': ['numpy'],
+        'orjson': ['orjson'],
+        'prometheus': ['prometheus_client'],
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': ['bomweather=bomweather.cli:main'],
+    },
 )
@@ -0,0 +1,94 @@
+""" Offline stand-ins for the BOM website and FTP server shared by the tests """
+
+import json
+from pathlib import Path
+
+import pytest
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FEED = "IDQ60801.94576.json"
+
+
+class FakeResponse:
+    """ requests style response """
+
+    def __init__(self, content=b"", status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"{self.status_code} error")
+
+
+class FeedSession:
+    """ requests style session serving the recorded Brisbane feed
+
+        Other stations fail with ConnectionError. The feed is served as it was
+        published records ago, and If-None-Match is answered with a 304.
+    """
+
+    def __init__(self):
+        self.raw = (FIXTURES / FEED).read_bytes()
+        self.feed = json.loads(self.raw)
+        self.published = 0
+        self.etag = '"v1"'
+        self.requests = []  # Headers of each request
+        self.closed = False
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers)
+        if not url.endswith(FEED):
+            raise ConnectionError("No such feed")
+        if headers and headers.get("If-None-Match") == self.etag:
+            return FakeResponse(status_code=304, headers={"ETag": self.etag})
+        content = self.raw
+        if self.published:
+            observations = dict(self.feed["observations"])
+            observations["data"] = observations["data"][self.published :]
+            content = json.dumps(dict(self.feed, observations=observations)).encode()
+        return FakeResponse(content, headers={"ETag": self.etag})
+
+    def close(self):
+        self.closed = True
+
+
+class RecordedPool:
+    """ FTPPool style pool serving recorded forecast products """
+
+    size = 2
+
+    def __init__(self):
+        self.retrieved = []
+        self.mdtm = "20190202063701"
+
+    def retrieve(self, filename):
+        self.retrieved.append(filename)
+        return (FIXTURES / filename).read_bytes()
+
+    def info(self, filename):
+        path = FIXTURES / filename
+        if not path.is_file():
+            return None
+        return {"mdtm": self.mdtm, "size": path.stat().st_size}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def feed_session():
+    return FeedSession()
+
+
+@pytest.fixture
+def recorded_pool():
+    return RecordedPool()
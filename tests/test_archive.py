@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import ObservationArchive
+from bomweather.observations import ObservationHistory
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def feed_records():
+    with open(FIXTURES / "IDQ60801.94576.json") as fp:
+        return json.load(fp)["observations"]["data"]
+
+
+def test_ingest_is_idempotent(tmp_path):
+    records = feed_records()
+    with ObservationArchive(tmp_path / "obs.sqlite") as archive:
+        assert archive.ingest_records(records[10:]) == 134
+        # Next download overlaps the records already stored
+        assert archive.ingest(ObservationHistory(records)) == 10
+        assert archive.ingest(ObservationHistory(records)) == 0
+        assert archive.count() == archive.count(94576) == 144
+        assert archive.stations() == [94576]
+
+    # Reopening keeps the data
+    with ObservationArchive(tmp_path / "obs.sqlite") as archive:
+        assert archive.count() == 144
+
+
+def test_query_time_range(tmp_path):
+    history = ObservationHistory(feed_records())
+    with ObservationArchive(tmp_path / "obs.sqlite") as archive:
+        archive.ingest(history)
+
+        records = list(archive.query(94576))
+        assert records == list(reversed(list(history)))  # Oldest first
+
+        latest = history[0].utc_dt
+        recent = list(archive.query(94576, start=latest - timedelta(hours=2)))
+        assert [r.utc_dt for r in recent] == list(reversed(history.utc_dt[:5]))
+
+        naive = latest.replace(tzinfo=None)
+        rows = list(archive.query(94576, naive, naive, fields=["air_temp", "utc_dt"]))
+        assert rows == [(history[0].air_temp, latest)]
+        assert rows[0].air_temp == history[0].air_temp
+        assert not list(archive.query(94575))
+
+        with pytest.raises(ValueError):
+            archive.query(94576, fields=["air_temp; DROP TABLE observations"])
+
+
+def test_query_across_stations(tmp_path):
+    records = feed_records()
+    other = [dict(rec, wmo=94575, air_temp=rec["air_temp"] - 1) for rec in records]
+    with ObservationArchive(tmp_path / "obs.sqlite") as archive:
+        archive.ingest_records(records)
+        archive.ingest_records(other[:5])
+
+        when = datetime.strptime(records[0]["aifstime_utc"], "%Y%m%d%H%M%S")
+        rows = list(archive.at(when, fields=["wmo", "air_temp"]))
+        temp = records[0]["air_temp"]
+        assert rows == [(94575, temp - 1), (94576, temp)]
+        assert len(list(archive.at(when - timedelta(hours=3)))) == 1
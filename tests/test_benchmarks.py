@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import bench_suite
+
+
+def test_results_match_baselines(tmp_path, monkeypatch):
+    """ Run every benchmark case once offline and check the stored results """
+    monkeypatch.setenv("BOMWEATHER_CACHE", str(tmp_path))
+    results = bench_suite.run_cases(bench_suite.get_cases(), timed=False)
+    baselines = bench_suite.load_baselines()
+    assert set(results) == set(baselines)
+    assert bench_suite.compare(results, baselines, tolerance=1) == []
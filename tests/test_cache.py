@@ -0,0 +1,51 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import ObservationCache, ObservationSite
+
+URL = "http://www.bom.gov.au/fwo/IDQ60801/IDQ60801.94576.json"
+LATEST = datetime(2019, 1, 30, 20, 30, tzinfo=timezone.utc).timestamp()
+
+
+def test_cache_expires_with_publishing_cadence(tmp_path, feed_session):
+    """ Test feeds are reused until the next observation is due """
+
+    now = [LATEST + 5 * 60]  # 5 minutes after the latest observation
+    clock = lambda: now[0]  # noqa: E731
+    cache = ObservationCache(directory=tmp_path, session=feed_session, clock=clock)
+    site = ObservationSite(94576, "IDQ60801", cache=cache)
+
+    assert not cache.fresh(URL)
+    assert site.last_observation().air_temp == 21.3
+    assert cache.fresh(URL)
+    assert site.last_observation().air_temp == 21.3
+    assert cache.stats["misses"] == 1
+    assert cache.stats["hits"] == 1
+    assert len(feed_session.requests) == 1
+
+    now[0] += 30 * 60  # Next half hourly observation is due
+    assert not cache.fresh(URL)
+    cache.get(URL)
+    assert feed_session.requests[-1]["If-None-Match"] == '"v1"'
+    assert cache.stats["revalidations"] == 1
+    assert cache.stats["not_modified"] == 1
+
+    # A new cache picks the feed up from disk
+    cache2 = ObservationCache(directory=tmp_path, session=feed_session, clock=clock)
+    cache2.get(URL)
+    assert cache2.stats["hits"] == 1
+
+
+def test_clear_only_removes_cached_feeds(tmp_path, feed_session):
+    """ Test other files sharing the cache directory are kept """
+
+    other = tmp_path / "settings.json"
+    other.write_text("{}")
+    cache = ObservationCache(directory=tmp_path, session=feed_session)
+    cache.get(URL)
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert not list(tmp_path.glob("*.tmp"))
+    cache.clear()
+    assert list(tmp_path.glob("*.json")) == [other]
@@ -0,0 +1,137 @@
+import os
+import sys
+import csv
+import io
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import ObservationFetcher
+from bomweather.cli import main
+from bomweather.export import (
+    FORECAST_FIELDS,
+    CSVWriter,
+    NDJSONWriter,
+    export_forecasts,
+    export_observations,
+    open_writer,
+    select_products,
+    select_sites,
+)
+
+SITES = [(94576, "IDQ60801"), (99999, "IDQ60801")]
+
+
+def test_export_observations_ndjson(feed_session):
+    """ Test every record of the feed is written and failures are counted """
+
+    out = io.StringIO()
+    fields = ["wmo", "utc_dt", "air_temp", "name"]
+    fetcher = ObservationFetcher(concurrency=2, session=feed_session)
+    writer = NDJSONWriter(out, fields)
+    stats = export_observations(SITES, writer, fields, fetcher=fetcher)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert stats.rows == len(rows) > 100
+    assert stats.sources == 1
+    assert stats.failures[0][0] == "IDQ60801.99999"
+    assert rows[0]["name"] == "Brisbane"
+    assert rows[0]["utc_dt"].endswith("+00:00")
+    assert "failed" in stats.summary()
+
+
+def test_export_latest_csv(feed_session):
+    """ Test only the latest record is written, with missing values empty """
+
+    out = io.StringIO()
+    fields = ["wmo", "local_dt", "vis_km", "gust_kt"]
+    fetcher = ObservationFetcher(concurrency=2, session=feed_session)
+    stats = export_observations(
+        SITES[:1], CSVWriter(out, fields), fields, latest=True, fetcher=fetcher
+    )
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert stats.rows == 1
+    assert rows[0] == fields
+    assert rows[1][0] == "94576"
+
+
+def test_histories_only_convert_exported_fields(feed_session):
+    fields = ["wmo", "air_temp"]
+    with ObservationFetcher(concurrency=2, session=feed_session) as fetcher:
+        histories = list(fetcher.iter_histories(SITES[:1], fields))
+    assert histories[0].fields == tuple(fields)
+    assert "name" not in histories[0].columns
+
+
+def test_writer_closes_output_file(tmp_path):
+    """ Test files opened for -o are closed, stdout is only flushed """
+
+    path = tmp_path / "out.csv"
+    writer = open_writer("csv", str(path), ["wmo"])
+    writer.write([(94576,)])
+    writer.close()
+    assert writer.fp.closed
+    assert path.read_text().splitlines() == ["wmo", "94576"]
+
+    out = io.StringIO()
+    writer = open_writer("ndjson", None, ["wmo"], stdout=out)
+    writer.close()
+    assert not out.closed
+
+
+def test_export_unknown_field():
+    with pytest.raises(ValueError):
+        export_observations(SITES, NDJSONWriter(io.StringIO(), ["x"]), ["x"])
+
+
+def test_export_forecasts(recorded_pool):
+    """ Test one row per period of every area, and bad products are skipped """
+
+    out = io.StringIO()
+    products = ["IDQ10095", "IDQ99999"]
+    stats = export_forecasts(
+        products, CSVWriter(out, FORECAST_FIELDS), pool=recorded_pool
+    )
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert stats.sources == 1
+    assert stats.rows == len(rows)
+    assert [product for product, _ in stats.failures] == ["IDQ99999"]
+    assert {row["product"] for row in rows} == {"IDQ10095"}
+    assert len({row["aac"] for row in rows}) > 1
+
+
+def test_select_sites_and_products():
+    sites = select_sites(["qld"], ["94926"])
+    assert (94576, "IDQ60801") in sites
+    assert 94926 in {wmo for wmo, _ in sites}
+    products = select_products(["NT"], ["IDQ10095"])
+    assert products[0] == "IDQ10095"
+    assert len(products) > 1
+
+
+def test_cli_requires_output_for_parquet():
+    with pytest.raises(SystemExit):
+        main(["export", "observations", "--wmo", "94576", "--format", "parquet"])
+
+
+def test_cli_checks_fields_before_output(tmp_path):
+    """ Test a bad --fields leaves an existing output file alone """
+
+    out = tmp_path / "out.csv"
+    out.write_text("previous export")
+    with pytest.raises(SystemExit):
+        main(["export", "observations", "--fields", "x", "-o", str(out)])
+    assert out.read_text() == "previous export"
+
+
+def test_cli_rejects_options_for_other_kind():
+    with pytest.raises(SystemExit):
+        main(["export", "observations", "--product", "IDQ10095"])
+    with pytest.raises(SystemExit):
+        main(["export", "forecasts", "--wmo", "94576"])
+
+
+def test_cli_reports_unknown_wmo(tmp_path, capsys):
+    out = tmp_path / "out.csv"
+    main(["export", "observations", "--wmo", "1", "--format", "csv", "-o", str(out)])
+    assert "Unknown WMO IDs: 1" in capsys.readouterr().err
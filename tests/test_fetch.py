@@ -0,0 +1,48 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import ObservationFetcher, fetch_observations
+
+SITES = [(94576, "IDQ60801"), (99999, "IDQ60801")]
+
+
+def test_fetch_observations_sync(feed_session):
+    """ Test failed stations are skipped and recorded """
+
+    with ObservationFetcher(concurrency=4, session=feed_session) as fetcher:
+        results = list(fetcher.iter_observations(SITES))
+    assert [obs.wmo for obs in results] == [94576]
+    assert fetcher.failures[0][:2] == (99999, "IDQ60801")
+
+
+def test_fetcher_leaves_session_open(feed_session):
+    """ Test a session passed in is left for the caller to close """
+
+    with ObservationFetcher(concurrency=4, session=feed_session):
+        pass
+    assert not feed_session.closed
+
+
+def test_fetch_observations_async(feed_session):
+    """ Test observations are yielded from the async generator """
+
+    async def collect():
+        sites = SITES[:1] * 3
+        return [obs async for obs in fetch_observations(sites, session=feed_session)]
+
+    results = asyncio.run(collect())
+    assert len(results) == 3
+    assert results[0].name == "Brisbane"
+
+
+def test_fetch_observations_async_bounded(feed_session):
+    """ Test only a few requests are queued and closing early stops the rest """
+
+    async def first():
+        async for obs in fetch_observations(SITES[:1] * 100, 2, session=feed_session):
+            return obs
+
+    assert asyncio.run(first()).wmo == 94576
+    assert len(feed_session.requests) <= 8
@@ -1,8 +1,12 @@
 import os
 import sys
+from pathlib import Path
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from bomweather import Forecast
+from bomweather.forecasts import ForecastCache, parse_product
+
+FIXTURES = Path(__file__).parent / "fixtures"
 
 
 def test_getting_metro_forecasts():
@@ -35,3 +39,83 @@ def test_getting_regional_forecasts():
     last_forecast = f.forecasts[-1]
     assert -10.0 < float(last_forecast.temp_max) < 50
     assert -10.0 < float(last_forecast.temp_min) < 50
+
+
+def test_forecast_from_xml():
+    """ Test forecasts can be parsed from already downloaded XML """
+
+    xml = (FIXTURES / "IDQ10095.xml").read_text()
+    f = Forecast.from_xml(xml)
+    assert f.product == "IDQ10095"
+    assert f.desc == "Brisbane"
+    assert f.issue_time == "2019-02-02T16:37:01+10:00"
+    assert len(f.forecasts) == 7
+    assert f.forecasts[0].forecast_text.startswith("Partly cloudy")  # From metro
+
+
+def test_fetch_many_reuses_connection(recorded_pool):
+    """ Test several products load through one pool, and lazy loading """
+
+    pool = recorded_pool
+    forecasts = Forecast.fetch_many(["IDQ10095", "IDQ10170"], pool=pool)
+    assert pool.retrieved == ["IDQ10095.xml", "IDQ10170.xml"]
+    assert forecasts["IDQ10170"].desc == "Rockhampton"
+
+    f = Forecast("IDQ10170", "Yeppoon", lazy=True, pool=pool)
+    assert len(pool.retrieved) == 2
+    assert f.desc == "Yeppoon"
+    assert len(pool.retrieved) == 3
+
+
+def test_fetch_all_areas(recorded_pool):
+    """ Test every location in a product comes from one download """
+
+    pool = recorded_pool
+    areas = Forecast.fetch_areas("IDQ10095", pool=pool)
+    assert pool.retrieved == ["IDQ10095.xml"]
+    assert len(areas) == 8
+    assert areas["QLD_PT004"] is areas["Redcliffe"]
+
+    # Locations without text use the metropolitan forecast
+    metro_text = areas["Brisbane"].forecasts[1].forecast_text
+    assert areas["Redcliffe"].forecasts[1].forecast_text == metro_text
+
+
+def test_parse_product_streaming():
+    """ Test a large state wide product can be parsed from a file """
+
+    with open(FIXTURES / "IDQ11295.xml", "rb") as fp:
+        parsed = parse_product(fp)
+    assert parsed.product == "IDQ11295"
+    assert len(parsed.areas) == 60
+    first = parsed.areas[0].forecasts[0]
+    assert first.start.isoformat() == "2019-02-02T06:37:00+00:00"
+    assert first.forecast_text is None  # No metropolitan area to fall back to
+
+
+def test_forecast_cache_skips_unchanged_products(recorded_pool):
+    """ Test products are only downloaded when the remote file changes """
+
+    pool = recorded_pool
+    cache = ForecastCache(pool)
+    forecast = cache.forecast("IDQ10095")
+    assert forecast.changed
+    assert forecast.desc == "Brisbane"
+    assert cache.issue_time("IDQ10095") == forecast.issue_time
+
+    # Unchanged remote file reuses the parsed product and Forecast
+    assert cache.forecast("IDQ10095") is forecast
+    assert not forecast.changed
+    assert not forecast.refresh()
+    assert pool.retrieved == ["IDQ10095.xml"]
+    assert (cache.checks, cache.downloads) == (3, 1)
+
+    # Rewritten file with the same issue time is downloaded but not a change
+    pool.mdtm = "20190202070000"
+    assert not forecast.refresh()
+    assert len(pool.retrieved) == 2
+
+    other = Forecast("IDQ10095", description="Brisbane", cache=cache)
+    assert other.changed
+    assert other.forecasts == forecast.forecasts
+    assert len(pool.retrieved) == 2
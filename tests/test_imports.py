@@ -0,0 +1,61 @@
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+import bomweather
+
+HEAVY = ["requests", "dateutil", "pytz", "ftplib", "xml.etree.ElementTree", "numpy"]
+BUDGET_US = 50000  # Cumulative import time allowed for the bomweather package
+
+
+def run(code, *args):
+    """ Run code in a fresh interpreter and return stderr """
+    result = subprocess.run(
+        [sys.executable, *args, "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return result.stdout, result.stderr
+
+
+def loaded_after(statement):
+    code = f"import sys\n{statement}\nprint(' '.join(sorted(sys.modules)))"
+    stdout, _ = run(code)
+    return set(stdout.split())
+
+
+def test_import_is_lazy():
+    modules = loaded_after("import bomweather")
+    assert "bomweather.stations" not in modules
+    assert not [m for m in HEAVY if m in modules]
+
+
+def test_station_lookup_avoids_heavy_modules():
+    modules = loaded_after("from bomweather import closest_obs_station")
+    assert "bomweather.stations" in modules
+    assert not [m for m in HEAVY if m in modules]
+
+
+def test_import_time_budget():
+    _, stderr = run("import bomweather", "-X", "importtime")
+    times = re.findall(r"import time:\s+\d+ \|\s+(\d+) \| bomweather$", stderr, re.M)
+    assert times, stderr
+    assert int(times[-1]) < BUDGET_US
+
+
+def test_lazy_attributes():
+    assert set(bomweather.__all__) <= set(dir(bomweather))
+    assert bomweather.Forecast.__module__ == "bomweather.forecasts"
+    assert "Forecast" in vars(bomweather)
+    try:
+        bomweather.not_a_name
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("Expected AttributeError")
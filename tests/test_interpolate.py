@@ -0,0 +1,50 @@
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import IDWInterpolator
+
+np = pytest.importorskip("numpy")
+
+LATS = [-27.0, -27.0, -28.0, -35.0]
+LONS = [153.0, 152.0, 152.5, 150.0]
+Obs = namedtuple("Obs", ["lat", "lon", "air_temp", "rel_hum"])
+
+
+def test_idw_estimates():
+    points = IDWInterpolator([-27.0, -27.0, -27.0], [153.0, 152.5, 140.0], k=2)
+    temps = [20.0, 30.0, 40.0, 10.0]
+    estimates = points.evaluate(LATS, LONS, temps)
+    assert estimates[0] == 20.0  # On a station
+    assert estimates[1] == pytest.approx(25.0)  # Halfway between two stations
+    assert 30 < estimates[2] < 40  # Far from all, between the closest two
+
+    # Stations without values are skipped, and weights are reused
+    first = points.weights(LATS, LONS, np.isfinite(temps))
+    assert points.weights(LATS, LONS, np.isfinite(temps)) is first
+    estimates = points.evaluate(LATS, LONS, [np.nan, 30.0, 40.0, 10.0])
+    assert estimates[0] != 20.0
+    assert 30 <= estimates[1] <= 40
+
+
+def test_max_distance():
+    points = IDWInterpolator([-27.0, -10.0], [152.9, 130.0], max_distance_km=50)
+    estimates = points.evaluate(LATS, LONS, [20.0, 30.0, 40.0, 10.0])
+    assert estimates[0] == pytest.approx(20.0, abs=0.5)
+    assert np.isnan(estimates[1])
+
+
+def test_grid_interpolation():
+    grid = IDWInterpolator.grid(-29, -26, 151, 154, 0.5, k=3)
+    observations = [
+        Obs(lat, lon, 20.0 + i, None if i == 2 else 50.0)
+        for i, (lat, lon) in enumerate(zip(LATS, LONS))
+    ]
+    results = grid.interpolate(observations, ["air_temp", "rel_hum"])
+    assert len(grid.grid_lats) == len(grid.grid_lons) == 7
+    assert results["air_temp"].shape == (7, 7)
+    assert np.all((results["air_temp"] >= 20) & (results["air_temp"] <= 23))
+    assert np.allclose(results["rel_hum"], 50.0)
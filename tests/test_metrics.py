@@ -0,0 +1,69 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import Forecast, ObservationSite, closest_obs_station, metrics
+from bomweather.station_index import clear_loaded
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FEED = FIXTURES / "IDQ60801.94576.json"
+
+
+@pytest.fixture
+def registry():
+    registry = metrics.add_hook(metrics.MetricsRegistry())
+    yield registry
+    metrics.remove_hook(registry)
+
+
+def test_disabled_timer_is_shared():
+    assert not metrics.enabled()
+    with metrics.timed("xml.parse") as t:
+        t.nbytes = 10
+    assert t is metrics.timed("http.fetch")
+
+
+def test_phases_are_recorded(registry, tmp_path, monkeypatch, feed_session):
+    monkeypatch.setenv("BOMWEATHER_CACHE", str(tmp_path))
+    clear_loaded()
+    xml = (FIXTURES / "IDQ10095.xml").read_text()
+    Forecast("IDQ10095", xml=xml)
+    ObservationSite(94576, "IDQ60801", session=feed_session).last_observation()
+    closest_obs_station(-27.47, 153.03)
+
+    stats = registry.stats()
+    assert stats["xml.parse"].count == 1
+    assert stats["xml.parse"].nbytes == len(xml.encode())
+    assert stats["http.fetch"].nbytes == FEED.stat().st_size
+    assert stats["json.parse"].count == 1
+    assert stats["index.search"].count == 1
+    assert "index.load" in stats
+    assert all(s.errors == 0 for s in stats.values())
+    assert set(stats) <= set(metrics.PHASES)
+
+
+def test_errors_and_failing_hooks(registry):
+    def broken(event):
+        raise RuntimeError("hook failed")
+
+    metrics.add_hook(broken)
+    try:
+        with pytest.raises(ValueError):
+            with metrics.timed("ftp.retr", "IDQ10095.xml"):
+                raise ValueError()
+    finally:
+        metrics.remove_hook(broken)
+    assert registry.stats()["ftp.retr"].errors == 1
+
+
+def test_prometheus_hook():
+    prometheus_client = pytest.importorskip("prometheus_client")
+    collector = prometheus_client.CollectorRegistry()
+    hook = metrics.PrometheusHook(registry=collector)
+    hook(metrics.Event("ftp.retr", 0.5, 1000, "IDQ10095.xml", False))
+    labels = {"phase": "ftp.retr"}
+    assert collector.get_sample_value("bomweather_phase_bytes_total", labels) == 1000
+    assert collector.get_sample_value("bomweather_phase_seconds_count", labels) == 1
@@ -1,9 +1,24 @@
 import os
 import sys
+import json
+from pathlib import Path
+
+import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from bomweather import ObservationSite
 
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class RecordedSite(ObservationSite):
+    """ Observation site reading a recorded feed instead of the BOM website """
+
+    def get_observation_data(self):
+        with open(FIXTURES / f"{self.product}.{self.wmo}.json") as fp:
+            return json.load(fp)["observations"]
+
+
 COMPASS_PNTS = [
     "N",
     "NNE",
@@ -33,3 +48,78 @@ def test_latest_observation():
     assert -10.0 < last_obs.air_temp < 50
     assert 970 < last_obs.press < 1030
     assert last_obs.wind_dir in COMPASS_PNTS
+
+
+def test_observation_history():
+    """ Test all records are converted from a single feed """
+
+    site = RecordedSite(94576, "IDQ60801")
+    history = site.history()
+    assert len(history) == 144
+    assert site.name == "Brisbane"
+
+    air_temp = history.column("air_temp")
+    assert len(air_temp) == 144
+    assert history[5].air_temp == air_temp[5]
+    assert history.utc_dt[0] > history.utc_dt[-1]  # Newest first
+
+    # Missing values are NaN in columns and None in records
+    vis_km = history.column("vis_km")
+    missing = [i for i, v in enumerate(vis_km) if v != v]
+    assert missing
+    assert history[missing[0]].vis_km is None
+    assert history[0] == site.last_observation()
+    assert history[-1] == site.get_observation(-1)
+    assert site._history is history  # Single records do not convert the feed
+
+
+def test_observation_views():
+    """ Test row views match records and text is dictionary encoded """
+
+    history = RecordedSite(94576, "IDQ60801").history()
+    view = history.view(-1)
+    record = history[len(history) - 1]
+    for field in record._fields:
+        assert getattr(view, field) == getattr(record, field)
+    assert view == record
+    assert view.to_observation() == record
+    assert list(history.views()) == list(history)
+
+    # Every record shares one copy of each unique string
+    assert history.column("name") == ["Brisbane"] * 144
+    assert len(history.strings) < 30
+    assert history.local_dt[0].tzinfo is None
+    assert history.utc_dt[0].utcoffset().total_seconds() == 0
+
+
+def test_observation_fields():
+    """ Test only the requested fields are converted """
+
+    site = RecordedSite(94576, "IDQ60801")
+    full = site.history()
+    obs = site.get_observation(3, fields=["air_temp", "rain_trace", "utc_dt"])
+    assert obs._fields == ("air_temp", "rain_trace", "utc_dt")
+    assert obs == (full[3].air_temp, full[3].rain_trace, full[3].utc_dt)
+
+    history = site.history(fields=["air_temp"])
+    assert set(history.columns) == {"air_temp"}
+    assert list(history.column("air_temp")) == list(full.column("air_temp"))
+    assert history.view(0).air_temp == full[0].air_temp
+    assert not hasattr(history.view(0), "press")
+    with pytest.raises(KeyError):
+        history.column("press")
+    assert site.name == "Brisbane"
+    assert site._history is history  # Reading the name keeps the loaded columns
+
+    with pytest.raises(ValueError):
+        site.history(fields=["air_temperature"])
+
+
+def test_json_decoding_without_orjson(monkeypatch):
+    """ Test the standard library is used when orjson is not installed """
+
+    from bomweather import jsondecode
+
+    monkeypatch.setattr(jsondecode, "_orjson", None)
+    text = (FIXTURES / "IDQ60801.94576.json").read_bytes()
+    assert jsondecode.loads(text) == json.loads(text)
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import ObservationSite, metrics
+from bomweather.resilience import (
+    CircuitOpenError,
+    ResilientForecasts,
+    ResilientObservations,
+    ResilientSource,
+    SourcePolicy,
+)
+
+POLICY = SourcePolicy(
+    timeout=1,
+    hedge_after=None,
+    fresh_for=60,
+    max_stale=3600,
+    failure_threshold=2,
+    reset_after=30,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Counter:
+    """ fetch function returning how many times it has been called """
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    def __call__(self, key):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("BOM is down")
+        return f"{key} {self.calls}"
+
+
+def test_stale_while_revalidate():
+    """ Test stale results are returned at once and refreshed in the background """
+
+    clock = Clock()
+    fetch = Counter()
+    events = []
+    hook = metrics.add_hook(events.append)
+    try:
+        with ResilientSource(fetch, POLICY, clock=clock) as source:
+            assert source.get("a") == "a 1"
+            clock.now += 10
+            assert source.get("a") == "a 1"  # Fresh
+            clock.now += 100
+            assert source.get("a") == "a 1"  # Stale, refreshing
+            source.close()
+            assert source.get("a") == "a 2"
+    finally:
+        metrics.remove_hook(hook)
+    stale = [e for e in events if e.phase == "stale.served"]
+    assert [e.seconds for e in stale] == [110]
+    assert source.counts["stale"] == 1
+    assert source.counts["fresh"] == 2
+
+
+def test_hedged_request():
+    """ Test a second request is sent when the first is slow """
+
+    release = threading.Event()
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        if len(calls) == 1:
+            release.wait(5)  # The first request hangs
+            return "slow"
+        return "fast"
+
+    with ResilientSource(fetch, POLICY._replace(hedge_after=0.01)) as source:
+        assert source.get("a") == "fast"
+        release.set()
+    assert source.counts["hedged"] == 1
+
+
+def test_download_timeout():
+    """ Test callers stop waiting after timeout and the download is still cached """
+
+    release = threading.Event()
+
+    def fetch(key):
+        release.wait(5)
+        return "late"
+
+    with ResilientSource(fetch, POLICY._replace(hedge_after=0.01)) as source:
+        with pytest.raises(TimeoutError):
+            source.get("a", timeout=0.05)
+        release.set()
+        for _ in range(100):
+            if source.age("a") is not None:
+                break
+            time.sleep(0.05)
+        assert source.get("a") == "late"
+
+
+def test_circuit_breaker():
+    """ Test callers fail fast while the circuit is open, then it is retried """
+
+    clock = Clock()
+    fetch = Counter(fail=True)
+    with ResilientSource(fetch, POLICY, clock=clock) as source:
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                source.get("a")
+        assert source.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            source.get("a")
+        assert fetch.calls == 2
+
+        clock.now += 31
+        assert source.breaker.state == "half-open"
+        fetch.fail = False
+        assert source.get("a") == "a 3"
+        assert source.breaker.state == "closed"
+
+
+def test_open_circuit_serves_old_data():
+    clock = Clock()
+    fetch = Counter()
+    with ResilientSource(fetch, POLICY, clock=clock) as source:
+        source.get("a")
+        fetch.fail = True
+        clock.now += 7200  # Older than max_stale
+        assert source.get("a") == "a 1"
+        assert source.get("a") == "a 1"
+        assert source.breaker.state == "open"
+        assert source.get("a") == "a 1"
+        assert fetch.calls == 3
+
+
+def test_resilient_observations(feed_session):
+    """ Test sites can use the resilient source in place of a cache """
+
+    with ResilientObservations(POLICY, session=feed_session) as source:
+        for _ in range(3):
+            site = ObservationSite(94576, "IDQ60801", cache=source)
+            assert site.last_observation().name == "Brisbane"
+    assert len(feed_session.requests) == 1
+    assert not feed_session.closed  # Left for the caller to close
+
+
+def test_resilient_forecasts(recorded_pool):
+    with ResilientForecasts(POLICY, pool=recorded_pool) as source:
+        forecast = source.forecast("IDQ10095")
+        assert forecast.changed
+        assert forecast.forecasts
+        assert source.forecast("IDQ10095") is forecast
+        assert not forecast.changed
+        assert source.source.counts["fetched"] == 1
@@ -0,0 +1,144 @@
+import os
+import sys
+import asyncio
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.scheduler import ObservationScheduler, RateLimiter
+
+SITE = (94576, "IDQ60801")
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_polls_when_next_report_is_due(feed_session):
+    session = feed_session
+    session.published = 10
+    latest = session.feed["observations"]["data"][10]["aifstime_utc"]
+    clock = Clock(0)
+    with ObservationScheduler(
+        [SITE], session=session, clock=clock, jitter=0, grace=60, retry=60
+    ) as scheduler:
+        first = list(scheduler.poll_due())
+        assert [obs.utc_dt.strftime("%Y%m%d%H%M%S") for obs in first] == [latest]
+        state = scheduler.stations[0]
+        assert state.interval == 1800
+        clock.now = state.last_utc + 600
+        assert scheduler.next_due() == state.last_utc + 1800 + 60
+        assert not list(scheduler.poll_due())  # Nothing is due yet
+        assert len(session.requests) == 1
+
+        # Feed not updated when due, so back off
+        clock.now = scheduler.next_due()
+        assert not list(scheduler.poll_due())
+        assert scheduler.next_due() == clock.now + 60
+        clock.now = scheduler.next_due()
+        assert not list(scheduler.poll_due())
+        assert scheduler.next_due() == clock.now + 120
+
+        # Three new reports, emitted oldest first
+        session.published = 7
+        clock.now = scheduler.next_due()
+        new = list(scheduler.poll_due())
+        assert len(new) == 3
+        assert new[0].utc_dt < new[1].utc_dt < new[2].utc_dt
+        assert state.misses == 0
+
+
+def test_failures_are_recorded(feed_session):
+    clock = Clock(0)
+    sites = [SITE, (99999, "IDQ60801")]
+    with ObservationScheduler(
+        sites, session=feed_session, clock=clock, jitter=0
+    ) as scheduler:
+        assert len(list(scheduler.poll_due())) == 1
+        assert scheduler.failures[0][:2] == (99999, "IDQ60801")
+        assert scheduler.due(now=59) == []
+
+
+def test_change_feeds_stop(feed_session):
+    with ObservationScheduler([SITE], session=feed_session, jitter=0) as scheduler:
+        seen = []
+
+        def callback(obs):
+            seen.append(obs)
+            scheduler.stop()
+
+        scheduler.run(callback)
+    assert seen[0].name == "Brisbane"
+
+    async def watch():
+        with ObservationScheduler([SITE], session=feed_session) as scheduler:
+            async for obs in scheduler.watch():
+                scheduler.stop()
+                return obs
+
+    assert asyncio.run(watch()).name == "Brisbane"
+
+
+def test_rate_limiter():
+    clock = Clock(0)
+    waits = []
+    limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=waits.append)
+    for _ in range(4):
+        limiter.acquire()
+    assert waits == [0.5, 1.0]
+    clock.now = 10
+    limiter.acquire()
+    assert waits == [0.5, 1.0]
+
+
+def test_session_and_failures_are_bounded(feed_session):
+    """ Test a caller's session is left open and old failures are dropped """
+
+    sites = [(90000 + i, "IDQ60801") for i in range(5)]
+    with ObservationScheduler(sites, session=feed_session, max_failures=2) as scheduler:
+        list(scheduler.poll_due())
+        assert len(scheduler.failures) == 2
+    assert not feed_session.closed
+
+
+def test_fresh_cache_hits_are_not_rate_limited(feed_session):
+    class FreshCache:
+        session = feed_session
+
+        def fresh(self, url):
+            return True
+
+        def get(self, url, timeout=10):
+            return self.session.get(url).json()
+
+    class Limiter:
+        calls = 0
+
+        def acquire(self):
+            self.calls += 1
+
+    limiter = Limiter()
+    with ObservationScheduler([SITE], cache=FreshCache()) as scheduler:
+        scheduler._limiter = lambda url: limiter
+        assert len(list(scheduler.poll_due())) == 1
+    assert limiter.calls == 0
+
+
+def test_watch_wakes_on_stop(feed_session):
+    """ Test stop() from another thread ends watch() without waiting for a poll """
+
+    async def watch(scheduler):
+        return [obs async for obs in scheduler.watch()]
+
+    with ObservationScheduler([SITE], session=feed_session, jitter=0) as scheduler:
+        timer = threading.Timer(0.2, scheduler.stop)
+        timer.start()
+        start = time.monotonic()
+        seen = asyncio.run(watch(scheduler))
+        timer.join()
+    assert len(seen) == 1
+    assert time.monotonic() - start < 5
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.scrape_products import update_forecast_products
+from conftest import FakeResponse
+
+STATE_PAGE = '<a href="/qld/forecasts/{}.shtml">Detailed</a>'
+
+
+class FakeSite:
+    """ BOM forecast pages for a few Queensland towns """
+
+    def __init__(self, towns, broken=()):
+        self.towns = towns
+        self.broken = list(broken)  # Listed, but the page is missing
+        self.requested = []
+
+    def get(self, url, headers=None, timeout=None):
+        page = url.rsplit("/", 1)[-1][: -len(".shtml")]
+        if page == "precis":
+            if "/qld/" not in url:
+                return FakeResponse()
+            listed = list(self.towns) + self.broken
+            return FakeResponse("".join(STATE_PAGE.format(t) for t in listed).encode())
+        self.requested.append(page)
+        if page not in self.towns:
+            return FakeResponse(b"Not found", 404)
+        etag = f'"{self.towns[page]}"'
+        if headers and headers.get("If-None-Match") == etag:
+            return FakeResponse(status_code=304)
+        body = f"Product {self.towns[page]}".encode()
+        return FakeResponse(body, headers={"ETag": etag})
+
+
+def test_incremental_forecast_scrape():
+    """ Test unchanged pages are revalidated and changes are reported """
+
+    site = FakeSite({"brisbane": "IDQ10095", "yeppoon": "IDQ10170"})
+    products, pages, changes = update_forecast_products({}, {}, session=site)
+    assert products == {"brisbane": ("IDQ10095", "qld"), "yeppoon": ("IDQ10170", "qld")}
+    assert set(changes.added) == {"brisbane", "yeppoon"}
+
+    towns = {"brisbane": "IDQ10095", "yeppoon": "IDQ10171", "emerald": "IDQ10173"}
+    site = FakeSite(towns)
+    products, pages, changes = update_forecast_products(products, pages, session=site)
+    assert products["brisbane"] == ("IDQ10095", "qld")  # Not modified
+    assert products["yeppoon"] == ("IDQ10171", "qld")
+    assert set(changes.added) == {"emerald"}
+    assert changes.changed == {"yeppoon": (("IDQ10170", "qld"), ("IDQ10171", "qld"))}
+    assert not changes.removed
+
+
+def test_failed_town_pages_are_skipped():
+    """ Test a missing page keeps the previous product and the rest are read """
+
+    previous = {"brisbane": ("IDQ10095", "qld")}
+    site = FakeSite({"yeppoon": "IDQ10170"}, broken=["brisbane", "emerald"])
+    products, pages, changes = update_forecast_products(previous, {}, session=site)
+    assert products == {"brisbane": ("IDQ10095", "qld"), "yeppoon": ("IDQ10170", "qld")}
+    assert set(changes.added) == {"yeppoon"}
+    assert not changes.removed
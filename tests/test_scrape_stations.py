@@ -0,0 +1,89 @@
+import os
+import sys
+import io
+import json
+import zipfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import scrape_stations
+from bomweather.scrape_stations import STN_LIST, get_station_list, iter_station_rows
+from bomweather.scrape_stations import iter_zip_member, iter_lines
+from bomweather.scrape_stations import write_station_list, diff_station_rows
+from bomweather.scrape_stations import FILENAME, FOLDER, refresh_station_list
+from bomweather.standin import StandInServer
+from bomweather.transport import set_transport
+
+
+def stream_zip(data: bytes, chunk_size: int = 1000):
+    """ Zip data the way it arrives from the FTP server """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("stations.txt", data)
+    raw = buffer.getvalue()
+    for i in range(0, len(raw), chunk_size):
+        yield raw[i : i + chunk_size]
+
+
+def test_streaming_station_refresh(tmp_path):
+    """ Test stations.txt is rebuilt from a zip stream with only WMO stations """
+
+    original = STN_LIST.read_bytes()
+    lines = iter_lines(iter_zip_member(stream_zip(original)))
+    path = tmp_path / "stations.txt"
+    kept = write_station_list(lines, path)
+
+    expected = list(iter_station_rows(get_station_list()))
+    assert kept == expected
+    assert path.stat().st_size < len(original) / 10
+    with open(path, "r", newline="\n") as fp:
+        assert list(iter_station_rows(fp)) == expected
+
+    changed = kept[0]._replace(site_name="RENAMED")
+    changes = diff_station_rows(kept, [changed] + kept[2:])
+    assert changes.changed == [changed]
+    assert changes.removed == [kept[1]]
+    assert not changes.added
+
+
+def test_zip_stream_is_read_to_the_end():
+    """ Test the rest of the archive is read so the transfer can complete """
+
+    chunks = stream_zip(b"site\n" * 100, chunk_size=10)
+    assert b"".join(iter_zip_member(chunks)) == b"site\n" * 100
+    assert next(chunks, None) is None
+
+
+def test_refresh_station_list_skips_unchanged(tmp_path, monkeypatch):
+    """ Test a second refresh finds the remote file unchanged and downloads nothing """
+
+    archive = tmp_path / "ftp" / FOLDER / FILENAME
+    archive.parent.mkdir(parents=True)
+    archive.write_bytes(b"".join(stream_zip(STN_LIST.read_bytes())))
+    expected = list(iter_station_rows(get_station_list()))
+    monkeypatch.setattr(scrape_stations, "STN_LIST", tmp_path / "stations.txt")
+    monkeypatch.setattr(scrape_stations, "STN_META", tmp_path / "stations_meta.json")
+    downloads = []
+
+    def iter_ftp_file(ftp, filename):
+        downloads.append(filename)
+        return original(ftp, filename)
+
+    original = scrape_stations.iter_ftp_file
+    monkeypatch.setattr(scrape_stations, "iter_ftp_file", iter_ftp_file)
+
+    previous = set_transport(None)
+    try:
+        with StandInServer(tmp_path) as server:
+            set_transport(server.transport())
+            changes = refresh_station_list()
+            assert changes.added == expected
+            assert not changes.removed and not changes.changed
+            assert downloads == [FILENAME]
+            with open(tmp_path / "stations_meta.json") as fp:
+                assert json.load(fp)["size"] == archive.stat().st_size
+            assert not list(tmp_path.glob("*.tmp"))
+
+            assert refresh_station_list() is None
+            assert downloads == [FILENAME]
+    finally:
+        set_transport(previous)
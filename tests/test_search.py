@@ -0,0 +1,65 @@
+import os
+import sys
+import timeit
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import search_stations
+from bomweather.search import NameSearchIndex, StationMatch
+
+
+def entry(name, state="QLD", kind="obs"):
+    return StationMatch(name, state, 0.0, 0.0, kind, None, "IDQ60801", 0)
+
+
+def test_prefix_search():
+    """ Test partial names find stations, with the state filter applied """
+
+    results = search_stations("brisb", state="qld", limit=10)
+    assert [r.name for r in results][:2] == ["BRISBANE", "BRISBANE AERO"]
+    assert results[0].wmo == "94576"
+    assert all(r.state == "QLD" for r in results)
+    assert search_stations("brisb", state="NSW") == []
+
+
+def test_forecast_towns_and_kind():
+    results = search_stations("alice springs", kind="forecast")
+    assert results[0].kind == "forecast"
+    assert results[0].score == 0
+    with pytest.raises(ValueError):
+        search_stations("alice", kind="other")
+
+
+def test_ranking():
+    """ Test whole names beat prefixes, which beat word prefixes and typos """
+
+    index = NameSearchIndex(
+        [
+            entry("PORT DOUGLAS"),
+            entry("DOUGLAS ISLAND"),
+            entry("DOUGLAS"),
+            entry("DUGLAS"),
+            entry("MACKAY"),
+        ]
+    )
+    names = [r.name for r in index.search("douglas")]
+    assert names == ["DOUGLAS", "DOUGLAS ISLAND", "PORT DOUGLAS", "DUGLAS"]
+    results = index.search("doug port")
+    assert results[0].name == "PORT DOUGLAS"
+    assert results[0].score == 2
+    assert all(r.score > 3 for r in results[1:])
+    assert [r.name for r in index.search("douglas", limit=2)] == names[:2]
+    assert index.search("  ") == []
+
+
+def test_misspelt_name():
+    assert search_stations("brisbnae")[0].name.startswith("BRISBANE")
+
+
+def test_search_is_fast():
+    """ Test searches are quick enough to run on each keystroke """
+
+    search_stations("b")  # Build the index
+    seconds = timeit.timeit(lambda: search_stations("bri"), number=100) / 100
+    assert seconds < 0.005
@@ -0,0 +1,56 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather.stations import get_obs_stations
+from bomweather.station_index import StationIndex, get_station_index, clear_loaded
+from bomweather.station_index import INDEX_FILENAME, write_index
+
+
+def test_index_matches_station_list(tmp_path, monkeypatch):
+    """ Test the compiled index returns the same stations as stations.txt """
+
+    monkeypatch.setenv("BOMWEATHER_CACHE", str(tmp_path))
+    clear_loaded()
+    index = get_station_index()
+    assert (tmp_path / "stations.idx").is_file()
+    assert list(index) == list(get_obs_stations())
+    assert get_station_index() is index
+
+    i = index.find("94576")
+    assert index[i].site_name == "BRISBANE"
+
+
+def test_stale_index_rejected():
+    """ Test an index built for other sources is not used """
+
+    data = StationIndex.build(get_obs_stations(), signature="old")
+    with pytest.raises(ValueError):
+        StationIndex(data, signature="new")
+
+
+def test_stale_index_file_rebuilt(tmp_path, monkeypatch):
+    """ Test a stale index file is closed and replaced """
+
+    monkeypatch.setenv("BOMWEATHER_CACHE", str(tmp_path))
+    write_index(tmp_path / INDEX_FILENAME, StationIndex.build([], signature="old"))
+    clear_loaded()
+    try:
+        assert list(get_station_index()) == list(get_obs_stations())
+    finally:
+        clear_loaded()
+
+
+def test_unwritable_cache_dir(tmp_path, monkeypatch):
+    """ Test the index is kept in memory when the cache directory is unusable """
+
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    monkeypatch.setenv("BOMWEATHER_CACHE", str(not_a_dir / "cache"))
+    clear_loaded()
+    try:
+        index = get_station_index()
+        assert index.find("94576") is not None
+    finally:
+        clear_loaded()
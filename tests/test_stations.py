@@ -1,9 +1,18 @@
 import os
 import sys
+import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from bomweather import closest_obs_station
 from bomweather import closest_forecast_location
+from bomweather import closest_obs_stations
+from bomweather import closest_forecast_locations
+from bomweather import k_nearest_obs_stations
+from bomweather import obs_stations_within
+from bomweather.stations import get_obs_locations, geo_distance
+from bomweather.stations import get_forecast_locations, build_forecast_locations
+from bomweather.stations import get_unmatched_forecast_towns
+from bomweather.stations import get_station_name_index, match_forecast_to_station
 
 
 def test_closest_obs_station_cached():
@@ -19,6 +28,26 @@ def test_closest_obs_station_cached():
     assert "BRISBANE" in st.site_name
 
 
+def test_nearby_obs_stations():
+    """ Test k nearest and radius searches agree with a full scan """
+
+    lat, lon = -27.470125, 153.021072
+    stations = sorted(
+        get_obs_locations().values(),
+        key=lambda st: geo_distance(lat, lon, st.lat, st.lon),
+    )
+
+    nearest = k_nearest_obs_stations(lat, lon, 5)
+    assert nearest == stations[:5]
+    assert nearest[0] == closest_obs_station(lat, lon)
+
+    within = obs_stations_within(lat, lon, 100)
+    expected = [
+        st for st in stations if geo_distance(lat, lon, st.lat, st.lon) <= 100
+    ]
+    assert within == expected
+
+
 def test_closest_obs_station_uncached():
     """ Test some example locations and check against expected names """
 
@@ -37,3 +66,43 @@ def test_closest_forecast_station_cached():
 
     st = closest_forecast_location(-23.133333, 150.733333)
     assert "YEPPOON" in st.site_name.upper()
+
+
+def test_closest_stations_batch():
+    """ Test batch lookups agree with single lookups """
+
+    pytest.importorskip("numpy")
+    lats = [-33.865143, -37.814, -27.470125, -23.133333]
+    lons = [151.209900, 144.96332, 153.021072, 150.733333]
+
+    result = closest_obs_stations(lats, lons, chunk_size=3)
+    assert len(result.stations) == 4
+    for lat, lon, st, dist in zip(lats, lons, result.stations, result.distance_km):
+        assert st == closest_obs_station(lat, lon)
+        assert abs(dist - geo_distance(lat, lon, st.lat, st.lon)) < 0.001
+
+    result = closest_forecast_locations(lats, lons)
+    for lat, lon, st in zip(lats, lons, result.stations):
+        assert st == closest_forecast_location(lat, lon)
+
+
+def test_forecast_location_table():
+    """ Test the packaged match table is up to date with the product lists """
+
+    data, unmatched = build_forecast_locations()
+    assert get_forecast_locations() == data
+    assert get_unmatched_forecast_towns() == sorted(unmatched)
+    assert "brokenhill" not in unmatched
+
+
+def test_match_forecast_to_station_reuses_index():
+    """ Test the name index is only rebuilt when the station list changes """
+
+    stations = get_obs_locations()
+    station = match_forecast_to_station("qld", "brisbane", stations)
+    index = get_station_name_index(stations)
+    assert get_station_name_index(get_obs_locations()) is index
+
+    del stations[station.wmo]
+    assert get_station_name_index(stations) is not index
+    assert match_forecast_to_station("qld", "brisbane", stations) != station
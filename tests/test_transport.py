@@ -0,0 +1,168 @@
+import os
+import sys
+import ftplib
+import shutil
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from bomweather import Forecast, ObservationCache, ObservationFetcher, ObservationSite
+from bomweather.forecasts import FORECAST_FOLDER
+from bomweather.ftp import FTPPool
+from bomweather.scrape_stations import FOLDER, connect, iter_ftp_file
+from bomweather.standin import StandInServer
+from bomweather.transport import (
+    RecordingTransport,
+    ReplayMissError,
+    ReplayTransport,
+    Transport,
+    get_transport,
+    recorded_name,
+    set_transport,
+    split_host,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FEED = "fwo/IDQ60801/IDQ60801.94576.json"
+
+
+@pytest.fixture
+def root(tmp_path):
+    """ Recorded BOM files in the layout served by the stand-in server """
+    feed = tmp_path / "http" / FEED
+    feed.parent.mkdir(parents=True)
+    shutil.copy(str(FIXTURES / "IDQ60801.94576.json"), str(feed))
+    products = tmp_path / "ftp" / FORECAST_FOLDER
+    products.mkdir(parents=True)
+    shutil.copy(str(FIXTURES / "IDQ10095.xml"), str(products))
+    stations = tmp_path / "ftp" / FOLDER
+    stations.mkdir(parents=True)
+    (stations / "stations.zip").write_bytes(b"not really a zip")
+    return tmp_path
+
+
+@pytest.fixture
+def transport():
+    """ Restore the default transport after each test """
+    previous = set_transport(None)
+    yield
+    set_transport(previous)
+
+
+def test_split_host():
+    assert split_host("localhost:2121") == ("localhost", 2121)
+    assert split_host("ftp.bom.gov.au") == ("ftp.bom.gov.au", 21)
+
+
+def test_default_transport_from_environment(transport, monkeypatch):
+    monkeypatch.setenv("BOMWEATHER_HTTP_BASE", "http://mirror.example/")
+    monkeypatch.setenv("BOMWEATHER_FTP_HOST", "mirror.example:2121")
+    current = get_transport()
+    assert current.url(FEED) == "http://mirror.example/" + FEED
+    assert current.ftp_host == "mirror.example:2121"
+    site = ObservationSite(94576, "IDQ60801")
+    assert site.obs_url.startswith("http://mirror.example/fwo/")
+
+
+def test_standin_server(root, transport):
+    """ Test HTTP feeds and FTP products are fetched from the stand-in server """
+
+    with StandInServer(root) as server:
+        set_transport(server.transport())
+        site = ObservationSite(94576, "IDQ60801")
+        assert site.last_observation().name == "Brisbane"
+
+        with FTPPool(FORECAST_FOLDER) as pool:
+            forecast = Forecast("IDQ10095", pool=pool)
+            assert forecast.forecasts
+            assert pool.info("IDQ10095.xml")["size"] > 0
+            assert pool.info("IDQ99999.xml") is None
+            with pytest.raises(ftplib.error_perm):
+                pool.retrieve("IDQ99999.xml")
+
+        with connect() as ftp:
+            assert b"".join(iter_ftp_file(ftp, "stations.zip")) == b"not really a zip"
+
+
+def test_standin_revalidation(root, transport):
+    with StandInServer(root) as server:
+        set_transport(server.transport())
+        cache = ObservationCache(min_ttl=0, max_ttl=0)
+        url = get_transport().url(FEED)
+        first = cache.get(url)
+        assert cache.get(url) == first
+    assert cache.not_modified == 1
+
+
+def test_record_and_replay(root, tmp_path, transport):
+    """ Test recorded downloads are replayed without the server """
+
+    recorded = tmp_path / "recorded"
+    with StandInServer(root) as server:
+        set_transport(RecordingTransport(recorded, server.http_base, server.ftp_host))
+        live = ObservationSite(94576, "IDQ60801").last_observation()
+        live_forecast = Forecast("IDQ10095").forecasts
+    assert (recorded / "http" / FEED).is_file()
+    assert (recorded / "ftp" / FORECAST_FOLDER / "IDQ10095.xml").is_file()
+
+    set_transport(ReplayTransport(recorded, server.http_base, server.ftp_host))
+    assert ObservationSite(94576, "IDQ60801").last_observation() == live
+    assert Forecast("IDQ10095").forecasts == live_forecast
+    with pytest.raises(ReplayMissError):
+        ObservationSite(94577, "IDQ60801").last_observation()
+    with pytest.raises(ftplib.error_perm):
+        Forecast("IDQ10170")
+
+
+def test_transport_urls():
+    transport = Transport("http://localhost:8080/", "localhost:2121")
+    assert transport.url("/qld/forecasts/precis.shtml") == (
+        "http://localhost:8080/qld/forecasts/precis.shtml"
+    )
+
+
+def test_query_recordings_replay_through_standin(root, tmp_path, transport):
+    """ Test recordings of URLs with a query are served by the stand-in server """
+
+    name = recorded_name(FEED, "station=94576")
+    (root / "http" / name).write_bytes(b"{}")
+    recorded = tmp_path / "recorded"
+    with StandInServer(root) as server:
+        set_transport(RecordingTransport(recorded, server.http_base, server.ftp_host))
+        url = get_transport().url(FEED) + "?station=94576"
+        assert get_transport().session().get(url).content == b"{}"
+    assert (recorded / "http" / name).is_file()
+    with StandInServer(recorded) as server:
+        set_transport(server.transport())
+        url = get_transport().url(FEED) + "?station=94576"
+        assert get_transport().session().get(url).content == b"{}"
+    set_transport(ReplayTransport(recorded))
+    assert get_transport().session().get(url).content == b"{}"
+
+
+def test_replay_leaves_caller_session_open():
+    class Session:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    session = Session()
+    ReplayTransport("recorded").wrap_session(session)
+    assert not session.closed
+
+
+def test_replay_serves_caller_sessions(root, transport):
+    """ Test sessions passed in are replayed instead of going to the network """
+
+    set_transport(ReplayTransport(root))
+    with requests.Session() as session:
+        site = ObservationSite(94576, "IDQ60801", session=session)
+        assert site.last_observation().name == "Brisbane"
+        cache = ObservationCache(session=session)
+        assert cache.get(site.obs_url)["observations"]["data"]
+        with ObservationFetcher(session=session) as fetcher:
+            results = fetcher.iter_observations([(94576, "IDQ60801")])
+            assert [obs.wmo for obs in results] == [94576]